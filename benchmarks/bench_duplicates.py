@@ -0,0 +1,97 @@
+# coding: utf-8
+
+"""
+Near-duplicate detection (requires NumPy): hashing batches of thumbnails
+and clustering the hashes with multi-index hashing, compared to comparing all
+pairs (on --pairwise hashes, the clusters must be the same).
+
+The hashes are synthetic: --clusters groups of images differing in a few
+bits from their base plus unrelated images.
+
+Usage: python benchmarks/bench_duplicates.py [--images 50000] [--pairwise 3000] [--repeat 3] [--json out.json]
+"""
+
+# imports
+import random
+from optparse import OptionParser
+
+from benchutils import setup_django, timeit, write_results
+
+
+def make_index(count, clusters, seed=0):
+    rnd = random.Random(seed)
+    images = {}
+    bases = [rnd.getrandbits(64) for i in range(clusters)]
+    for i in range(count):
+        if i < count // 2:
+            value = rnd.choice(bases)
+            for j in range(rnd.randint(0, 3)):
+                value ^= 1 << rnd.randint(0, 63)
+        else:
+            value = rnd.getrandbits(64)
+        images['uploads/image_%06d.jpg' % i] = ['%016x' % value, 0]
+    return {'hash': 'dct', 'images': images, 'updated': 0}
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def pairwise_duplicates(data, threshold):
+    items = sorted((path, int(value[0], 16)) for path, value in data['images'].iteritems())
+    parent = range(len(items))
+    def find(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+    for i in range(len(items)):
+        for j in range(i + 1, len(items)):
+            if hamming(items[i][1], items[j][1]) <= threshold:
+                parent[find(j)] = find(i)
+    clusters = {}
+    for i, (path, value) in enumerate(items):
+        clusters.setdefault(find(i), []).append(path)
+    return sorted(sorted(paths) for paths in clusters.values() if len(paths) > 1)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--images', type='int', default=50000)
+    parser.add_option('--clusters', type='int', default=500)
+    parser.add_option('--pairwise', type='int', default=3000, help='number of hashes compared pairwise')
+    parser.add_option('--threshold', type='int', default=6)
+    parser.add_option('--batch', type='int', default=256, help='thumbnails hashed at once')
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--json', dest='output', help='write results to this file')
+    options, args = parser.parse_args()
+
+    setup_django()
+    import numpy
+    from filebrowser import duplicates
+
+    results = {}
+    pixels = numpy.random.RandomState(options.seed).uniform(0, 255, (options.batch, duplicates.DCT_SIZE, duplicates.DCT_SIZE))
+    for method in ('dct', 'average'):
+        batch = pixels
+        if method == 'average':
+            batch = pixels[:, :duplicates.HASH_SIZE, :duplicates.HASH_SIZE]
+        timing = timeit(lambda: duplicates.compute_hashes(batch, method), repeat=options.repeat)
+        results['hash_' + method] = dict(timing, images=options.batch)
+
+    small = make_index(options.pairwise, options.clusters // 10, options.seed)
+    if sorted(duplicates.find_duplicates(options.threshold, small, existing_only=False)) != pairwise_duplicates(small, options.threshold):
+        raise SystemExit("Multi-index clusters differ from the pairwise comparison")
+    results['pairwise'] = dict(timeit(lambda: pairwise_duplicates(small, options.threshold), repeat=1), images=options.pairwise)
+    results['multi_index_small'] = dict(timeit(lambda: duplicates.find_duplicates(options.threshold, small, existing_only=False), repeat=options.repeat), images=options.pairwise)
+    data = make_index(options.images, options.clusters, options.seed)
+    results['multi_index'] = dict(timeit(lambda: duplicates.find_duplicates(options.threshold, data, existing_only=False), repeat=options.repeat), images=options.images)
+
+    print "%-18s %10s %12s" % ('', 'images', 'ms (best)')
+    for name in ('hash_dct', 'hash_average', 'pairwise', 'multi_index_small', 'multi_index'):
+        print "%-18s %10d %12.2f" % (name, results[name]['images'], results[name]['best'] * 1000)
+    write_results('duplicates', results, options.output)
+
+
+if __name__ == '__main__':
+    main()
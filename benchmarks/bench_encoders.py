@@ -0,0 +1,64 @@
+# coding: utf-8
+
+"""
+Encode time and byte size of versions per encoder setting.
+
+Usage: python benchmarks/bench_encoders.py [--size 140] [--repeat 5] [--json out.json]
+"""
+
+# imports
+import os, tempfile
+from optparse import OptionParser
+
+from benchutils import setup_django, synthetic_image, timeit, write_results
+
+# encoder settings to compare (s. VERSIONS in filebrowser/settings.py)
+ENCODER_SETTINGS = [
+    ('jpeg_q90_optimize', {}),
+    ('jpeg_q90_plain', {'optimize': False}),
+    ('jpeg_q80', {'quality': 80}),
+    ('jpeg_q75_progressive', {'quality': 75, 'progressive': True}),
+    ('jpeg_q85_444', {'quality': 85, 'subsampling': 0}),
+    ('jpeg_q85_420', {'quality': 85, 'subsampling': 2}),
+    ('png_optimize', {'format': 'png'}),
+    ('png_level1', {'format': 'png', 'compress_level': 1}),
+    ('png_level9', {'format': 'png', 'compress_level': 9}),
+    ('webp_q80', {'format': 'webp', 'quality': 80}),
+    ('webp_q80_method6', {'format': 'webp', 'quality': 80, 'method': 6}),
+]
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--size', type='int', default=140, help='width of the version')
+    parser.add_option('--repeat', type='int', default=5)
+    parser.add_option('--json', dest='output', help='write results to this file')
+    options, args = parser.parse_args()
+    
+    versions = {}
+    for name, encoder in ENCODER_SETTINGS:
+        versions[name] = dict(encoder, verbose_name=name, width=options.size, height='', opts='')
+    setup_django(FILEBROWSER_VERSIONS=versions)
+    from filebrowser.functions import save_version, scale_and_crop, get_version_extension
+    
+    source = synthetic_image()
+    version = scale_and_crop(source, options.size, '', '')
+    tmp_dir = tempfile.mkdtemp(prefix='fb_bench_encoders_')
+    results = []
+    print "%-22s %10s %10s" % ('setting', 'ms/encode', 'bytes')
+    for name, encoder in ENCODER_SETTINGS:
+        path = os.path.join(tmp_dir, name + get_version_extension('.jpg', name))
+        try:
+            timing = timeit(lambda: save_version(version, path, name), repeat=options.repeat)
+        except (IOError, KeyError), e:
+            # e.g. PIL without WebP support
+            print "%-22s %s" % (name, e)
+            continue
+        size = os.path.getsize(path)
+        results.append({'setting': name, 'encoder': encoder, 'encode_seconds': timing, 'bytes': size})
+        print "%-22s %10.2f %10d" % (name, timing['best'] * 1000, size)
+    write_results('encoders', results, options.output)
+
+
+if __name__ == '__main__':
+    main()
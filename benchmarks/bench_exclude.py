@@ -0,0 +1,91 @@
+# coding: utf-8
+
+"""
+Filtering a directory listing with EXCLUDE and the version names: one
+compiled pattern per entry tested in a loop (as browse and the
+version_generator command did before) versus the combined ExcludeMatcher.
+Both must exclude exactly the same names, which is checked first.
+
+Usage: python benchmarks/bench_exclude.py [--names 100000] [--repeat 5] [--seed 0] [--json out.json]
+"""
+
+# imports
+import re, random
+from optparse import OptionParser
+
+from benchutils import setup_django, timeit, write_results
+
+
+def make_names(count, seed=0):
+    """
+    Filenames as found in an upload folder: originals, versions,
+    EXCLUDE matches (cropped images), hidden files and odd names.
+    """
+
+    from filebrowser.settings import VERSIONS, EXTENSION_LIST
+    rnd = random.Random(seed)
+    prefixes = sorted(VERSIONS)
+    extensions = sorted(EXTENSION_LIST)
+    names = []
+    for i in range(count):
+        ext = rnd.choice(extensions)
+        kind = rnd.random()
+        if kind < 0.5:
+            name = 'file%06d%s' % (i, ext)
+        elif kind < 0.6:
+            name = 'my_file_%06d%s' % (i, ext)
+        elif kind < 0.85:
+            name = 'file%06d_%s%s' % (i, rnd.choice(prefixes), ext)
+        elif kind < 0.9:
+            name = 'file%06d%s_%d_%d_q%d%s' % (i, ext, rnd.randint(0, 99), rnd.randint(0, 99), rnd.randint(1, 100), ext)
+        elif kind < 0.95:
+            name = '.hidden%06d%s' % (i, ext)
+        else:
+            name = 'file%06d_%s%s.bak' % (i, rnd.choice(prefixes), ext.upper())
+        names.append(name)
+    return names
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--names', type='int', default=100000)
+    parser.add_option('--repeat', type='int', default=5)
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--json', dest='output', help='write results to this file')
+    options, args = parser.parse_args()
+
+    setup_django()
+    from filebrowser.functions import get_exclude_patterns, is_excluded
+
+    names = make_names(options.names, options.seed)
+    filter_re = [re.compile(exp) for exp in get_exclude_patterns()]
+
+    def loop_excluded(name):
+        # the former loop of browse and the version_generator command
+        filtered = name.startswith('.')
+        for re_prefix in filter_re:
+            if re_prefix.search(name):
+                filtered = True
+        return filtered
+
+    expected = [name for name in names if loop_excluded(name)]
+    excluded = [name for name in names if is_excluded(name)]
+    if excluded != expected:
+        raise SystemExit("ExcludeMatcher differs from the pattern loop: %r" % sorted(set(excluded) ^ set(expected))[:10])
+
+    results = {
+        'names': len(names),
+        'excluded': len(excluded),
+        'patterns': len(filter_re),
+        'loop': timeit(lambda: [name for name in names if loop_excluded(name)], repeat=options.repeat),
+        'matcher': timeit(lambda: [name for name in names if is_excluded(name)], repeat=options.repeat),
+    }
+    print "%d names, %d excluded, %d patterns" % (results['names'], results['excluded'], results['patterns'])
+    print "%-10s %12s" % ('', 'ms (best)')
+    for name in ('loop', 'matcher'):
+        print "%-10s %12.2f" % (name, results[name]['best'] * 1000)
+    write_results('exclude', results, options.output)
+
+
+if __name__ == '__main__':
+    main()
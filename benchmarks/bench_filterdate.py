@@ -0,0 +1,79 @@
+# coding: utf-8
+
+"""
+Date filter of browse over many files: the former get_filterdate
+(gmtime/strftime per file) versus one range of timestamps per request
+(get_filterdate_range) compared against the mtimes.
+
+Runs with TZ=UTC, where both agree exactly (which is checked first).
+
+Usage: python benchmarks/bench_filterdate.py [--files 100000] [--repeat 5] [--seed 0] [--json out.json]
+"""
+
+# imports
+import os, time, random
+from time import gmtime, strftime, localtime
+from optparse import OptionParser
+
+from benchutils import setup_django, timeit, write_results
+
+FILTERS = ['today', 'past7days', 'thismonth', 'thisyear']
+
+
+def legacy_filterdate(filterDate, dateTime):
+    # get_filterdate before the date ranges
+    returnvalue = ''
+    dateYear = strftime("%Y", gmtime(dateTime))
+    dateMonth = strftime("%m", gmtime(dateTime))
+    dateDay = strftime("%d", gmtime(dateTime))
+    if filterDate == 'today' and int(dateYear) == int(localtime()[0]) and int(dateMonth) == int(localtime()[1]) and int(dateDay) == int(localtime()[2]): returnvalue = 'true'
+    elif filterDate == 'thismonth' and dateTime >= time.time()-2592000: returnvalue = 'true'
+    elif filterDate == 'thisyear' and int(dateYear) == int(localtime()[0]): returnvalue = 'true'
+    elif filterDate == 'past7days' and dateTime >= time.time()-604800: returnvalue = 'true'
+    elif filterDate == '': returnvalue = 'true'
+    return returnvalue
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--files', type='int', default=100000)
+    parser.add_option('--repeat', type='int', default=5)
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--json', dest='output', help='write results to this file')
+    options, args = parser.parse_args()
+
+    os.environ['TZ'] = 'UTC'
+    time.tzset()
+    setup_django(TIME_ZONE='UTC')
+    from filebrowser.functions import get_filterdate_range
+
+    rnd = random.Random(options.seed)
+    now = time.time()
+    # a third within the last days, the others within the last three years
+    mtimes = [now - rnd.randint(0, i % 3 and 3 * 365 * 86400 or 10 * 86400) for i in range(options.files)]
+
+    def legacy(filter_date):
+        return [mtime for mtime in mtimes if legacy_filterdate(filter_date, mtime)]
+
+    def ranges(filter_date):
+        start, end = get_filterdate_range(filter_date)
+        return [mtime for mtime in mtimes if start <= mtime < end]
+
+    results = {'files': options.files}
+    print "%-12s %10s %12s %12s" % ('filter', 'matches', 'legacy ms', 'range ms')
+    for filter_date in FILTERS:
+        matches = ranges(filter_date)
+        if matches != legacy(filter_date):
+            raise SystemExit("Date ranges differ from get_filterdate for %s" % filter_date)
+        results[filter_date] = {
+            'matches': len(matches),
+            'legacy': timeit(lambda: legacy(filter_date), repeat=options.repeat),
+            'range': timeit(lambda: ranges(filter_date), repeat=options.repeat),
+        }
+        print "%-12s %10d %12.2f %12.2f" % (filter_date, len(matches),
+            results[filter_date]['legacy']['best'] * 1000, results[filter_date]['range']['best'] * 1000)
+    write_results('filterdate', results, options.output)
+
+
+if __name__ == '__main__':
+    main()
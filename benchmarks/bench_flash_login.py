@@ -0,0 +1,60 @@
+# coding: utf-8
+
+"""
+Per-request overhead of flash_login_required (session decode and
+User lookup), without and with the session-to-user cache.
+
+Usage: python benchmarks/bench_flash_login.py [--requests 500] [--repeat 5] [--json out.json]
+"""
+
+# imports
+from optparse import OptionParser
+
+from benchutils import setup_django, timeit, write_results
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--requests', type='int', default=500, help='requests per upload batch')
+    parser.add_option('--repeat', type='int', default=5)
+    parser.add_option('--json', dest='output', help='write results to this file')
+    options, args = parser.parse_args()
+
+    setup_django(
+        SESSION_ENGINE='django.contrib.sessions.backends.db',
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    )
+    from django.db import connection
+    from django.contrib.auth.models import User
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.test.client import RequestFactory
+    from django.http import HttpResponse
+    from filebrowser import decorators
+
+    connection.creation.create_test_db(verbosity=0)
+    user = User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+    session = SessionStore()
+    session['_auth_user_id'] = user.pk
+    session['_auth_user_backend'] = 'django.contrib.auth.backends.ModelBackend'
+    session.save()
+
+    view = decorators.flash_login_required(lambda request: HttpResponse(''))
+    factory = RequestFactory()
+    requests = [factory.post('/upload_flash/', {'session_key': session.session_key}) for i in range(options.requests)]
+
+    def batch():
+        for request in requests:
+            view(request)
+
+    results = []
+    print "%-10s %12s %12s" % ('cache', 'ms/batch', 'us/request')
+    for timeout in (0, 60):
+        decorators.FLASH_SESSION_CACHE_TIMEOUT = timeout
+        timing = timeit(batch, repeat=options.repeat)
+        results.append({'cache_timeout': timeout, 'requests': options.requests, 'seconds': timing})
+        print "%-10s %12.2f %12.1f" % (timeout or 'off', timing['best'] * 1000, timing['best'] * 1e6 / options.requests)
+    write_results('flash_login', results, options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# coding: utf-8
+
+"""
+Import time of filebrowser.fields and filebrowser.urls, each in a fresh
+process (Django itself is imported before the clock starts), and whether
+PIL, NumPy, tinymce or uploadify were imported along with them.
+After filebrowser.urls, the first reverse() is timed as well: it imports
+the views.
+
+Pass --tree with another checkout (e.g. a git worktree of an older
+revision) in order to compare.
+
+Usage: python benchmarks/bench_import.py [--tree DIR] [--repeat 10] [--json out.json]
+"""
+
+# imports
+import os, sys, json, time, shutil, subprocess
+from optparse import OptionParser
+
+from benchutils import BENCHMARK_DIR, write_results
+
+MODULES = ['filebrowser.fields', 'filebrowser.urls']
+OPTIONAL = ['PIL', 'Image', 'numpy', 'tinymce', 'uploadify']
+
+
+def child(module, tree):
+    sys.path.insert(0, tree)
+    from benchutils import setup_django
+    media_root = setup_django(ROOT_URLCONF='filebrowser.urls')
+    shutil.rmtree(media_root)
+    # django modules the filebrowser modules build upon
+    import django.db.models, django.forms, django.template, django.conf.urls.defaults
+    import django.contrib.admin.views.decorators
+    from django.core.urlresolvers import reverse
+    start = time.time()
+    __import__(module)
+    elapsed = time.time() - start
+    result = {'seconds': elapsed, 'loaded': [name for name in OPTIONAL if name in sys.modules]}
+    if module == 'filebrowser.urls':
+        start = time.time()
+        reverse('fb_browse')
+        result['reverse'] = time.time() - start
+        result['reverse_loaded'] = [name for name in OPTIONAL if name in sys.modules]
+    print json.dumps(result)
+
+
+def measure(module, tree):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', module, '--tree', tree],
+        cwd=BENCHMARK_DIR)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--tree', default=os.path.dirname(BENCHMARK_DIR), help='checkout to import filebrowser from')
+    parser.add_option('--repeat', type='int', default=10)
+    parser.add_option('--child', help='(internal) import this module and report')
+    parser.add_option('--json', dest='output', help='write results to this file')
+    options, args = parser.parse_args()
+
+    if options.child:
+        return child(options.child, os.path.abspath(options.tree))
+
+    tree = os.path.abspath(options.tree)
+    results = {'tree': tree}
+    print "%-34s %10s %10s  %s" % ('module', 'best ms', 'mean ms', 'loaded')
+    for module in MODULES:
+        runs = [measure(module, tree) for i in range(options.repeat)]
+        rows = [(module, 'seconds', 'loaded')]
+        if 'reverse' in runs[0]:
+            rows.append(('%s, then reverse()' % module, 'reverse', 'reverse_loaded'))
+        for name, key, loaded in rows:
+            timings = [run[key] for run in runs]
+            results[name] = {
+                'best': min(timings),
+                'mean': sum(timings) / len(timings),
+                'repeat': options.repeat,
+                'loaded': runs[0][loaded],
+            }
+            print "%-34s %10.2f %10.2f  %s" % (name, results[name]['best'] * 1000,
+                results[name]['mean'] * 1000, ', '.join(runs[0][loaded]) or '-')
+    write_results('import', results, options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+# coding: utf-8
+
+"""
+Benchmarks for the hot paths of the FileBrowser: browse (end to end,
+with the Django test client), FileObject properties, sort_by_attr,
+get_version_path, version_generator and the version_generator command.
+
+Every tree size runs in a fresh process with its own synthetic tree
+(nested folders, mixed file types, small JPEG/PNG images and a few
+large ones). Trees, file sizes and dates are generated from --seed,
+so runs are comparable between commits.
+
+Usage: python benchmarks/bench_suite.py [--sizes 1000,20000,100000] [--repeat 3] [--json out.json]
+"""
+
+# imports
+import os, sys, json, time, random, shutil, tempfile, subprocess
+from StringIO import StringIO
+from optparse import OptionParser, SUPPRESS_HELP
+
+from benchutils import setup_django, synthetic_image, random_bytes, timeit, write_results
+
+# file attributes accessed per FileObject (s. filelisting.html)
+FILEOBJECT_ATTRIBUTES = ['filetype', 'filesize', 'date', 'datetime', 'extension',
+    'filetype_checked', 'path_full', 'url_full', 'url_save', 'url_thumbnail']
+SORT_ATTRIBUTES = ['date', 'filesize', 'filename_lower', 'filetype_checked']
+
+
+def encoded_image(width, height, format, seed):
+    output = StringIO()
+    synthetic_image(width, height, seed=seed).save(output, format=format)
+    return output.getvalue()
+
+
+def make_tree(root, count, seed=0, flat_ratio=0.5, image_ratio=0.05, large_images=10, per_dir=250):
+    """
+    Create a synthetic tree of count files below root.
+
+    flat_ratio of the files are located in root itself (the directory
+    measured with browse), the others in nested folders with per_dir
+    files each. image_ratio of the files are small JPEG/PNG images,
+    plus large_images photo-sized JPEGs in root/large.
+    Returns a dict with the paths (relative to root) of the files and images.
+    """
+
+    from filebrowser.settings import EXTENSIONS
+    rnd = random.Random(seed)
+    other_extensions = sorted(ext for filetype, exts in EXTENSIONS.items()
+        if filetype not in ('Folder', 'Image') for ext in exts)
+    images = [('.jpg', encoded_image(64, 48, 'JPEG', seed)), ('.png', encoded_image(64, 48, 'PNG', seed))]
+    now = int(time.time())
+    flat = int(count * flat_ratio)
+    tree = {'files': [], 'images': [], 'large_images': [], 'directories': 1}
+
+    for i in range(count):
+        if i < flat:
+            directory = ''
+        else:
+            j = (i - flat) // per_dir
+            directory = os.path.join('folder_%03d' % (j // 10), 'sub_%02d' % (j % 10))
+        if not os.path.isdir(os.path.join(root, directory)):
+            os.makedirs(os.path.join(root, directory))
+            tree['directories'] += 1
+        if rnd.random() < image_ratio:
+            extension, content = rnd.choice(images)
+        else:
+            extension = rnd.choice(other_extensions)
+            content = random_bytes(rnd, rnd.randint(0, 4096))
+        path = os.path.join(directory, 'file_%06d%s' % (i, extension))
+        f = open(os.path.join(root, path), 'wb')
+        f.write(content)
+        f.close()
+        mtime = now - rnd.randint(0, 3 * 365 * 86400)
+        os.utime(os.path.join(root, path), (mtime, mtime))
+        tree['files'].append(path)
+        if extension in EXTENSIONS['Image']:
+            tree['images'].append(path)
+
+    if large_images:
+        os.makedirs(os.path.join(root, 'large'))
+        tree['directories'] += 1
+        for i in range(large_images):
+            path = os.path.join('large', 'photo_%02d.jpg' % i)
+            synthetic_image(1600, 1200, seed=seed + i).save(os.path.join(root, path), quality=90)
+            tree['large_images'].append(path)
+    return tree
+
+
+def remove_versions(paths):
+    from filebrowser.settings import MEDIA_ROOT, VERSIONS
+    from filebrowser.functions import get_version_path
+    for path in paths:
+        for version_prefix in VERSIONS:
+            version_path = os.path.join(MEDIA_ROOT, get_version_path(path, version_prefix))
+            if os.path.isfile(version_path):
+                os.unlink(version_path)
+
+
+def bench_browse(tree, repeat):
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    from django.test.client import Client
+    from django.contrib.auth.models import User
+    from django.core.urlresolvers import reverse
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+    client = Client()
+    client.login(username='benchmark', password='benchmark')
+    url = reverse('fb_browse')
+
+    results = {}
+    queries = [
+        ('root', {}),
+        ('root_sorted_by_name', {'o': 'filename_lower', 'ot': 'asc'}),
+        ('root_filter_images', {'filter_type': 'Image'}),
+        ('root_search', {'q': '_00'}),
+        ('nested', {'dir': 'folder_000/sub_00/'}),
+    ]
+    for name, query in queries:
+        start = time.time()
+        response = client.get(url, query)
+        if response.status_code != 200:
+            results[name] = {'error': response.status_code}
+            continue
+        # the first request includes generating the admin thumbnails of the page
+        results[name] = {'first': time.time() - start, 'warm': timeit(lambda: client.get(url, query), repeat=repeat)}
+    return results
+
+
+def bench_fileobjects(tree, repeat, sample=2000):
+    from filebrowser.settings import DIRECTORY
+    from filebrowser.base import FileObject
+    from filebrowser.functions import sort_by_attr
+
+    paths = [os.path.join(DIRECTORY, path) for path in tree['files'] if os.sep not in path]
+    sample_paths = paths[:sample]
+    image_paths = [os.path.join(DIRECTORY, path) for path in tree['images']][:sample]
+
+    def properties():
+        for path in sample_paths:
+            fileobject = FileObject(path)
+            for attribute in FILEOBJECT_ATTRIBUTES:
+                getattr(fileobject, attribute)
+
+    def dimensions():
+        for path in image_paths:
+            fileobject = FileObject(path)
+            fileobject.width, fileobject.height, fileobject.orientation
+
+    results = {
+        'properties': dict(timeit(properties, repeat=repeat), files=len(sample_paths)),
+        'dimensions': dict(timeit(dimensions, repeat=repeat), files=len(image_paths)),
+        'sort_by_attr': {},
+    }
+    for attribute in SORT_ATTRIBUTES:
+        # fresh FileObjects, as in browse
+        results['sort_by_attr'][attribute] = dict(timeit(lambda: sort_by_attr([FileObject(path) for path in paths], attribute), repeat=repeat), files=len(paths))
+    return results
+
+
+def bench_version_path(tree, repeat):
+    from filebrowser.settings import DIRECTORY, VERSIONS
+    from filebrowser.functions import get_version_path
+
+    paths = [os.path.join(DIRECTORY, path) for path in tree['images']]
+    def version_paths():
+        for path in paths:
+            for version_prefix in VERSIONS:
+                get_version_path(path, version_prefix)
+    return dict(timeit(version_paths, repeat=repeat), calls=len(paths) * len(VERSIONS))
+
+
+def bench_version_generator(tree, repeat):
+    from filebrowser.settings import DIRECTORY, VERSIONS
+    from filebrowser.functions import version_generator
+
+    paths = [os.path.join(DIRECTORY, path) for path in tree['large_images']]
+    results = {}
+    for version_prefix in sorted(VERSIONS):
+        timings = []
+        for i in range(repeat):
+            remove_versions(paths)
+            start = time.time()
+            for path in paths:
+                version_generator(path, version_prefix)
+            timings.append((time.time() - start) / max(len(paths), 1))
+        # the versions exist now: the up to date check only
+        current = timeit(lambda: [version_generator(path, version_prefix) for path in paths], repeat=repeat)
+        results[version_prefix] = {
+            'generate': {'best': min(timings), 'mean': sum(timings) / len(timings), 'repeat': repeat, 'number': len(paths)},
+            'current': current,
+        }
+    return results
+
+
+def bench_command(tree):
+    from django.core.management import call_command
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        call_command('version_generator')
+        seconds = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return {'seconds': seconds, 'images': len(tree['images']) + len(tree['large_images'])}
+
+
+def run_size(size, options):
+    """
+    All benchmarks for one tree size (within a fresh process).
+    """
+
+    media_root = setup_django(tempfile.mkdtemp(prefix='fb_bench_suite_'), ROOT_URLCONF='bench_urls')
+    from filebrowser.settings import DIRECTORY
+
+    try:
+        start = time.time()
+        tree = make_tree(os.path.join(media_root, DIRECTORY), size, seed=options.seed)
+        results = {
+            'size': size,
+            'tree': {'files': len(tree['files']), 'images': len(tree['images']),
+                'directories': tree['directories'], 'seconds': time.time() - start},
+            'browse': bench_browse(tree, options.repeat),
+            'fileobject': bench_fileobjects(tree, options.repeat),
+            'get_version_path': bench_version_path(tree, options.repeat),
+        }
+        if not options.skip_versions:
+            results['version_generator'] = bench_version_generator(tree, options.repeat)
+        if not options.skip_command:
+            results['command'] = bench_command(tree)
+    finally:
+        if not options.keep:
+            shutil.rmtree(media_root)
+    return results
+
+
+def print_results(results):
+    print "%-8s %-34s %12s" % ('files', 'benchmark', 'ms (best)')
+    for result in results:
+        if 'error' in result:
+            print "%-8s %s" % (result['size'], result['error'])
+            continue
+        rows = []
+        for name, value in sorted(result['browse'].items()):
+            if 'warm' in value:
+                rows.append(('browse ' + name, value['warm']['best']))
+        rows.append(('fileobject properties', result['fileobject']['properties']['best']))
+        rows.append(('fileobject dimensions', result['fileobject']['dimensions']['best']))
+        for name, value in sorted(result['fileobject']['sort_by_attr'].items()):
+            rows.append(('sort_by_attr ' + name, value['best']))
+        rows.append(('get_version_path', result['get_version_path']['best']))
+        for name, value in sorted(result.get('version_generator', {}).items()):
+            rows.append(('version_generator ' + name, value['generate']['best']))
+        if 'command' in result:
+            rows.append(('command version_generator', result['command']['seconds']))
+        for name, seconds in rows:
+            print "%-8s %-34s %12.2f" % (result['size'], name, seconds * 1000)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--sizes', default='1000,20000,100000', help='comma separated number of files per tree')
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--skip-versions', action='store_true', default=False, help='do not benchmark version_generator')
+    parser.add_option('--skip-command', action='store_true', default=False, help='do not benchmark the version_generator command')
+    parser.add_option('--keep', action='store_true', default=False, help='keep the synthetic trees')
+    parser.add_option('--json', dest='output', help='write results to this file')
+    parser.add_option('--run-size', type='int', help=SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.run_size:
+        # child process: one tree size
+        f = open(options.output, 'w')
+        json.dump(run_size(options.run_size, options), f)
+        f.close()
+        return
+
+    results = []
+    for size in [int(size) for size in options.sizes.split(',')]:
+        fd, output = tempfile.mkstemp(prefix='fb_bench_suite_', suffix='.json')
+        os.close(fd)
+        command = [sys.executable, os.path.abspath(__file__), '--run-size', str(size),
+            '--repeat', str(options.repeat), '--seed', str(options.seed), '--json', output]
+        for option in ('skip_versions', 'skip_command', 'keep'):
+            if getattr(options, option):
+                command.append('--' + option.replace('_', '-'))
+        returncode = subprocess.call(command)
+        if returncode:
+            results.append({'size': size, 'error': 'failed with exit code %s' % returncode})
+        else:
+            f = open(output)
+            results.append(json.load(f))
+            f.close()
+        os.unlink(output)
+    print_results(results)
+    write_results('suite', results, options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+# coding: utf-8
+
+"""
+URLconf used by the benchmarks (ROOT_URLCONF='bench_urls').
+"""
+
+from django.conf.urls.defaults import *
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns = patterns('',
+    (r'^admin/filebrowser/', include('filebrowser.urls')),
+    (r'^admin/', include(admin.site.urls)),
+)
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+"""
+Helpers shared by the FileBrowser benchmarks.
+
+The benchmarks run without a Django project: setup_django() configures
+minimal settings with MEDIA_ROOT pointing to a temporary directory.
+"""
+
+# imports
+import os, sys, json, time, random, tempfile, platform
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+
+def setup_django(media_root=None, **extra):
+    """
+    Configure Django settings for a benchmark run (once per process).
+    Returns MEDIA_ROOT.
+    """
+    
+    from django.conf import settings
+    if settings.configured:
+        return settings.MEDIA_ROOT
+    if media_root is None:
+        media_root = tempfile.mkdtemp(prefix='fb_bench_')
+    media_root = os.path.join(media_root, '')
+    static_root = os.path.join(media_root, '.static', '')
+    options = dict(
+        DEBUG=False,
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+        MEDIA_ROOT=media_root,
+        MEDIA_URL='/media/',
+        STATIC_ROOT=static_root,
+        STATIC_URL='/static/',
+        ADMIN_MEDIA_PREFIX='/static/admin/',
+        SECRET_KEY='filebrowser-benchmarks',
+        INSTALLED_APPS=('django.contrib.auth', 'django.contrib.contenttypes',
+            'django.contrib.sessions', 'django.contrib.messages', 'django.contrib.admin', 'filebrowser'),
+        FILEBROWSER_USE_UPLOADIFY=False,
+        # removed along with the temporary MEDIA_ROOT
+        FILEBROWSER_DATA_ROOT=os.path.join(media_root, '.filebrowser'),
+    )
+    options.update(extra)
+    settings.configure(**options)
+    if not os.path.isdir(os.path.join(media_root, 'uploads')):
+        os.makedirs(os.path.join(media_root, 'uploads'))
+    return media_root
+
+
+def synthetic_image(width=1600, height=1200, mode='RGB', seed=0):
+    """
+    Photo-like test image (gradients plus noise), so that encoders
+    have something realistic to compress.
+    """
+    
+    from PIL import Image, ImageDraw, ImageFilter
+    rnd = random.Random(seed)
+    im = Image.new('RGB', (width, height))
+    draw = ImageDraw.Draw(im)
+    for y in range(0, height, 4):
+        c = int(255.0 * y / height)
+        draw.rectangle((0, y, width, y + 4), fill=(c, 255 - c, (c * 3) % 255))
+    for i in range(60):
+        x, y = rnd.randint(0, width), rnd.randint(0, height)
+        r = rnd.randint(10, width / 6)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=(rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255)))
+    im = im.filter(ImageFilter.BLUR)
+    frombytes = getattr(Image, 'frombytes', None) or Image.fromstring
+    noise = frombytes('L', (width, height), random_bytes(rnd, width * height))
+    im = Image.blend(im, Image.merge('RGB', (noise, noise, noise)), 0.08)
+    if mode != 'RGB':
+        im = im.convert(mode)
+    return im
+
+
+def random_bytes(rnd, count):
+    """
+    count bytes from the random.Random instance rnd (reproducible, unlike os.urandom).
+    """
+    
+    return ('%x' % rnd.getrandbits(count * 8)).zfill(count * 2).decode('hex')
+
+
+def timeit(func, repeat=5, number=1):
+    """
+    Best and mean wall time (seconds per call) of func.
+    """
+    
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        for j in range(number):
+            func()
+        timings.append((time.time() - start) / number)
+    return {'best': min(timings), 'mean': sum(timings) / len(timings), 'repeat': repeat, 'number': number}
+
+
+def write_results(name, results, output=None):
+    """
+    Collect results (and write them as JSON to output, if given).
+    """
+    
+    data = {
+        'benchmark': name,
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if output:
+        f = open(output, 'w')
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.close()
+    return data
@@ -0,0 +1,740 @@
+# coding: utf-8
+
+"""
+Smoke checks of the FileBrowser internals which can be exercised without
+a Django project (caches, parsing, matching, sorting, locking).
+Every check raises AssertionError on failure.
+
+Usage: python benchmarks/checks.py [check ...]
+"""
+
+# imports
+import os, sys, time, errno, shutil, tempfile, traceback, logging
+
+from benchutils import setup_django
+
+CHECKS = []
+
+
+def check(func):
+    CHECKS.append(func)
+    return func
+
+
+def expect(value, expected, message=''):
+    if value != expected:
+        raise AssertionError("%s: %r != %r" % (message, value, expected))
+
+
+def touch(path, content='x', mtime=None):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    f = open(path, 'wb')
+    f.write(content)
+    f.close()
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+@check
+def metadata_cache():
+    from filebrowser.cache import MetadataCache
+    root = tempfile.mkdtemp(prefix='fb_check_')
+    try:
+        cache = MetadataCache(ttl=None, max_entries=2)
+        path = touch(os.path.join(root, 'a.txt'))
+        expect(cache.listdir(root), [u'a.txt'], 'listing')
+        touch(os.path.join(root, 'b.txt'))
+        expect(cache.listdir(root), [u'a.txt'], 'cached listing')
+        cache.invalidate(path)
+        expect(sorted(cache.listdir(root)), [u'a.txt', u'b.txt'], 'listing after invalidate')
+        expect(cache.isfile(path), True, 'isfile')
+        expect(cache.stat(os.path.join(root, 'missing')), None, 'missing')
+        # LRU: the listing and a.txt are dropped by two more stats
+        cache.stat(os.path.join(root, 'b.txt'))
+        cache.stat(os.path.join(root, 'c.txt'))
+        expect(len(cache._stats), 2, 'bounded')
+        expect(MetadataCache(ttl=0).enabled, False, 'ttl 0 disables')
+    finally:
+        shutil.rmtree(root)
+
+
+@check
+def watcher_fallback():
+    import ctypes, errno
+    from filebrowser.cache import MetadataCache
+    from filebrowser.watcher import InotifyWatcher, PollingWatcher
+    root = tempfile.mkdtemp(prefix='fb_check_')
+    try:
+        os.makedirs(os.path.join(root, 'full', 'sub'))
+        watcher = InotifyWatcher([root], MetadataCache(ttl=None))
+        expect(watcher.poller, None, 'everything watched')
+        class ExhaustedLibc(object):
+            # inotify_add_watch fails like with max_user_watches exhausted
+            def inotify_add_watch(self, fd, path, mask):
+                ctypes.set_errno(errno.ENOSPC)
+                return -1
+        watcher.libc = ExhaustedLibc()
+        watcher.add_tree(os.path.join(root, 'full'))
+        assert isinstance(watcher.poller, PollingWatcher), 'no poller'
+        expect(watcher.poller.roots, [os.path.join(root, 'full')], 'polled subtree')
+        os.close(watcher.fd)
+    finally:
+        shutil.rmtree(root)
+
+
+@check
+def worker_pool():
+    from filebrowser.workers import WorkerPool, get_upload_versions
+    # a queue of one: most items are processed within the calling thread
+    pool = WorkerPool(max_workers=2, max_queue=1)
+    expect(pool.map(lambda x: 10 / x, [1, 2, 0, 5, 10]), [10, 5, None, 2, 1], 'map')
+    expect(pool.submit(lambda: 42).result(timeout=5), 42, 'submit')
+    from filebrowser.settings import VERSIONS
+    assert set(get_upload_versions(True)) <= set(VERSIONS), 'unknown upload versions'
+
+
+@check
+def version_lock():
+    from filebrowser.functions import acquire_version_lock, release_version_lock, get_umask
+    from filebrowser.settings import VERSION_LOCK_TIMEOUT
+    root = tempfile.mkdtemp(prefix='fb_check_')
+    try:
+        lock_path = os.path.join(root, '.a_small.jpg.lock')
+        original, version = os.path.join(root, 'a.jpg'), os.path.join(root, 'a_small.jpg')
+        first = acquire_version_lock(lock_path, original, version)
+        assert first, 'lock not acquired'
+        # the first holder stalls, the lock is taken over as stale
+        stale = time.time() - VERSION_LOCK_TIMEOUT - 10
+        os.utime(lock_path, (stale, stale))
+        second = acquire_version_lock(lock_path, original, version)
+        assert second and second != first, 'stale lock not taken over'
+        release_version_lock(lock_path, first)
+        expect(os.path.exists(lock_path), True, 'lock of the second holder removed')
+        release_version_lock(lock_path, second)
+        expect(os.path.exists(lock_path), False, 'lock not released')
+        # the version is up to date: nothing to do
+        touch(original, mtime=1000)
+        touch(version, mtime=2000)
+        touch(lock_path)
+        expect(acquire_version_lock(lock_path, original, version), None, 'current version')
+        umask = os.umask(0)
+        os.umask(umask)
+        expect(get_umask(), umask, 'umask')
+    finally:
+        shutil.rmtree(root)
+
+
+@check
+def version_format_excluded():
+    from filebrowser import functions
+    versions = functions.VERSIONS
+    functions.VERSIONS = dict(versions, webp_small={'width': 300, 'height': '', 'opts': '', 'format': 'webp'},
+        avif_small={'width': 300, 'height': '', 'opts': '', 'format': 'avif'})
+    try:
+        matcher = functions.ExcludeMatcher(functions.get_exclude_patterns())
+        expect(bool(matcher.search(u'photo_webp_small.webp')), True, 'webp version')
+        expect(bool(matcher.search(u'photo_avif_small.avif')), True, 'version in a format without extension setting')
+        expect(bool(matcher.search(u'photo_webp_small.jpg')), True, 'version with the extension of the original')
+        expect(bool(matcher.search(u'photo.webp')), False, 'original')
+    finally:
+        functions.VERSIONS = versions
+
+
+@check
+def lazy_fileobject():
+    from filebrowser.base import FileObject, LazyFileObject
+    from filebrowser.settings import MEDIA_URL, DIRECTORY
+    value = MEDIA_URL + DIRECTORY + 'folder/photo.JPG'
+    lazy = LazyFileObject(value)
+    expect(sorted(lazy.__dict__), ['value'], 'resolved on construction')
+    eager = FileObject(DIRECTORY + 'folder/photo.JPG')
+    for name in ('path', 'url_rel', 'head', 'filename', 'filename_lower', 'filetype'):
+        expect(getattr(lazy, name), getattr(eager, name), name)
+
+
+@check
+def worker_pool_nested():
+    from filebrowser.workers import WorkerPool, get_pool, get_request_pool
+    # map called by the only worker of the pool must not wait for itself
+    pool = WorkerPool(max_workers=1, max_queue=10)
+    task = pool.submit(lambda: pool.map(lambda x: x * 2, [1, 2, 3]))
+    expect(task.result(timeout=5), [2, 4, 6], 'nested map')
+    assert get_request_pool() is not get_pool(), 'request work shares the background pool'
+
+
+@check
+def version_list_tag():
+    from django.conf import settings
+    from django.template import Template, Context
+    from benchutils import synthetic_image
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads', 'check_versions')
+    os.makedirs(directory)
+    try:
+        synthetic_image(400, 300).save(os.path.join(directory, 'photo.jpg'))
+        template = Template('{% load fb_versions %}{% version_list sources "small" as items %}'
+            '{% for item in items %}{{ item.url }}|{{ item.missing }}|{{ item.generated }};{% endfor %}')
+        sources = ['uploads/check_versions/photo.jpg', 'uploads/check_versions/missing.jpg', '']
+        first = template.render(Context({'sources': sources}))
+        expect(first, '/media/uploads/check_versions/photo_small.jpg|True|True;|False|False;|False|False;', 'generated')
+        second = template.render(Context({'sources': sources}))
+        expect(second, '/media/uploads/check_versions/photo_small.jpg|False|False;|False|False;|False|False;', 'existing')
+    finally:
+        shutil.rmtree(directory)
+
+
+@check
+def prefetch_cached():
+    from django.conf import settings
+    from filebrowser.base import FileObject
+    from filebrowser.bulk import prefetch_fileobjects
+    from filebrowser.cache import metadata_cache, _key
+    from filebrowser.functions import version_generator
+    from benchutils import synthetic_image
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads', 'check_prefetch')
+    os.makedirs(directory)
+    ttl = metadata_cache.ttl
+    metadata_cache.ttl = None
+    try:
+        synthetic_image(400, 300).save(os.path.join(directory, 'photo.jpg'))
+        version = version_generator('uploads/check_prefetch/photo.jpg', 'small')
+        metadata_cache.clear()
+        fileobject = FileObject('uploads/check_prefetch/photo.jpg')
+        prefetch_fileobjects([fileobject], versions=['small'], dimensions=False)
+        expect(fileobject.prefetched_version('small'), version, 'version')
+        for path in ('photo.jpg', 'photo_small.jpg'):
+            assert _key(os.path.join(directory, path)) in metadata_cache._stats, '%s not cached' % path
+    finally:
+        metadata_cache.ttl = ttl
+        metadata_cache.clear()
+        shutil.rmtree(directory)
+
+
+@check
+def task_keeps_request_metrics():
+    from filebrowser import instrumentation
+    from filebrowser.workers import Task
+    metrics = instrumentation.Metrics()
+    instrumentation.activate(metrics, ['browse'])
+    try:
+        # run inline like WorkerPool.map does with a full queue
+        Task(lambda: None, (), {}).run()
+        assert instrumentation.current() is metrics, 'metrics of the request dropped'
+        expect(instrumentation.current_scopes(), ['browse'], 'scopes')
+    finally:
+        instrumentation.deactivate()
+
+
+@check
+def benchmark_tree():
+    from bench_suite import make_tree
+    roots = [tempfile.mkdtemp(prefix='fb_check_') for i in range(2)]
+    try:
+        trees = [make_tree(root, 60, seed=3, per_dir=10, large_images=1) for root in roots]
+        expect(trees[0], trees[1], 'same seed, same tree')
+        expect(len(trees[0]['files']), 60, 'files')
+        sizes = [[os.path.getsize(os.path.join(root, path)) for path in trees[0]['files']] for root in roots]
+        expect(sizes[0], sizes[1], 'file sizes')
+    finally:
+        for root in roots:
+            shutil.rmtree(root)
+
+
+@check
+def range_header():
+    from filebrowser.functions import parse_range
+    cases = [
+        (None, None),
+        ('bytes=0-0', (0, 1)),
+        ('bytes=0-', (0, 1000)),
+        ('bytes=10-19', (10, 10)),
+        ('bytes=990-5000', (990, 10)),
+        ('bytes=-1', (999, 1)),
+        ('bytes=-100', (900, 100)),
+        ('bytes=-5000', (0, 1000)),
+        ('bytes=-0', False),
+        ('bytes=1000-', False),
+        ('bytes=20-10', None),
+        ('bytes=5-2', None),
+        ('bytes=1000-2000', False),
+        ('bytes=1500-1200', None),
+        ('bytes=1500-999', None),
+        ('bytes=0-999', (0, 1000)),
+        ('bytes=0-1,5-6', None),
+        ('bytes=x-1', None),
+        ('items=0-1', None),
+    ]
+    for header, expected in cases:
+        expect(parse_range(header, 1000), expected, header)
+
+
+@check
+def on_demand_version():
+    from django.conf import settings
+    from django.http import Http404
+    from django.test.client import RequestFactory
+    from filebrowser.views import version
+    from filebrowser.functions import get_serve_path
+    from benchutils import synthetic_image
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads', 'check_on_demand')
+    os.makedirs(directory)
+    try:
+        synthetic_image(400, 300).save(os.path.join(directory, 'photo.jpg'))
+        request = RequestFactory().get('/')
+        response = version(request, 'small', 'uploads/check_on_demand/photo.jpg')
+        expect(response.status_code, 302, 'redirect')
+        expect(response['Location'], '/media/uploads/check_on_demand/photo_small.jpg', 'location')
+        assert os.path.isfile(os.path.join(directory, 'photo_small.jpg')), 'version not generated'
+        for prefix, path in [('unknown', 'uploads/check_on_demand/photo.jpg'), ('small', 'uploads/check_on_demand/missing.jpg'),
+                ('small', 'uploads/../../etc/passwd'), ('small', 'uploads/check_on_demand/.photo.jpg')]:
+            try:
+                version(request, prefix, path)
+            except Http404:
+                pass
+            else:
+                raise AssertionError("no 404 for %s %s" % (prefix, path))
+        expect(get_serve_path('/etc/passwd'), None, 'absolute path')
+    finally:
+        shutil.rmtree(directory)
+
+
+@check
+def edit_form():
+    from django.conf import settings
+    from filebrowser import forms
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads', 'check_edit')
+    path = touch(os.path.join(directory, 'notes.txt'), 'line 1\nline 2\n')
+    os.chmod(path, 0640)
+    try:
+        form = forms.EditForm(directory, 'notes.txt', '.txt')
+        expect(form.fields['content'].initial, u'line 1\nline 2\n', 'initial content')
+        form = forms.EditForm(directory, 'notes.txt', '.txt', {'content': u'line 1\r\nline 2\r\n'})
+        assert form.is_valid(), form.errors
+        expect(form.save(), False, 'unchanged content written')
+        form = forms.EditForm(directory, 'notes.txt', '.txt', {'content': u'\xe4nderung\r\n'})
+        assert form.is_valid(), form.errors
+        expect(form.save(), True, 'changed content not written')
+        expect(open(path, 'rb').read(), u'\xe4nderung\n'.encode(settings.DEFAULT_CHARSET), 'saved content')
+        expect(os.stat(path).st_mode & 0777, 0640, 'file mode')
+        expect([name for name in os.listdir(directory) if name != 'notes.txt'], [], 'temporary files')
+        max_size = forms.EDIT_MAX_SIZE
+        forms.EDIT_MAX_SIZE = 4
+        try:
+            form = forms.EditForm(directory, 'notes.txt', '.txt', {'content': u'x'})
+            expect(form.is_valid(), False, 'too large file saved')
+        finally:
+            forms.EDIT_MAX_SIZE = max_size
+    finally:
+        shutil.rmtree(directory)
+
+
+@check
+def flash_session_cache():
+    from django.core.cache import cache
+    from django.contrib.auth.models import User
+    from filebrowser.decorators import get_cached_user, set_cached_user, session_cache_key
+    user = User(pk=5, username='editor')
+    set_cached_user('session-a', user)
+    expect(get_cached_user('session-a').pk, 5, 'cached user')
+    expect(get_cached_user('session-b'), None, 'other session')
+    assert 'session-a' not in session_cache_key('session-a'), 'session key used as cache key'
+    # tampered and expired entries are ignored
+    user, expires, signature = cache.get(session_cache_key('session-a'))
+    cache.set(session_cache_key('session-a'), (User(pk=1, username='admin'), expires, signature))
+    expect(get_cached_user('session-a'), None, 'tampered entry')
+    cache.set(session_cache_key('session-a'), (user, int(time.time()) - 1, signature))
+    expect(get_cached_user('session-a'), None, 'expired entry')
+
+
+@check
+def upload_multiple():
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test.client import RequestFactory
+    from django.utils import simplejson
+    from filebrowser.views import upload_multiple
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads', 'check_upload')
+    touch(os.path.join(directory, 'existing.txt'))
+    try:
+        files = [SimpleUploadedFile(name, 'content') for name in ('new.txt', 'new.txt', 'existing.txt', 'tool.exe')]
+        request = RequestFactory().post('/?dir=check_upload/', {'file': files})
+        request.user = User(username='staff', is_staff=True, is_active=True)
+        response = upload_multiple(request)
+        expect(response.status_code, 200, 'status')
+        result = simplejson.loads(response.content)
+        expect([f['path'] for f in result['uploaded']], ['uploads/check_upload/new.txt'], 'uploaded')
+        expect(sorted(result['errors']), ['existing.txt', 'new.txt', 'tool.exe'], 'errors')
+        expect(sorted(os.listdir(directory)), ['existing.txt', 'new.txt'], 'stored files')
+        request = RequestFactory().post('/?dir=missing/', {'file': files[:1]})
+        request.user = User(username='staff', is_staff=True, is_active=True)
+        expect(upload_multiple(request).status_code, 404, 'missing folder')
+    finally:
+        shutil.rmtree(directory)
+
+
+@check
+def chunked_upload():
+    from StringIO import StringIO
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.test.client import RequestFactory
+    from filebrowser.chunked import ChunkedUpload, ChunkedUploadError, merge_ranges
+    from filebrowser.views import upload_chunked_complete, filebrowser_pre_upload
+    expect(merge_ranges([(5, 10), (0, 5), (12, 14), (13, 20), (3, 3)]), [(0, 10), (12, 20)], 'merged ranges')
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads', 'check_chunked')
+    os.makedirs(directory)
+    try:
+        upload = ChunkedUpload.create('uploads/check_chunked', u'movie.txt', 10, 5)
+        upload.write_chunk(5, StringIO('56789'), 5)
+        expect(upload.is_complete, False, 'incomplete')
+        upload.write_chunk(0, StringIO('01234'), 5)
+        expect(upload.received, [(0, 10)], 'received')
+        request = RequestFactory().post('/')
+        request.user = User(pk=5, username='staff', is_staff=True, is_active=True)
+        # a concurrent request has claimed the upload
+        upload.claim()
+        expect(upload_chunked_complete(request, upload.upload_id).status_code, 409, 'completed twice')
+        try:
+            upload.write_chunk(0, StringIO('01234'), 5)
+        except ChunkedUploadError:
+            pass
+        else:
+            raise AssertionError("chunk written into a completed upload")
+        upload.unclaim()
+        # failures after the claim leave the upload to be completed again
+        def fail(**kwargs):
+            raise IOError("signal failed")
+        filebrowser_pre_upload.connect(fail)
+        try:
+            upload_chunked_complete(request, upload.upload_id)
+        except IOError:
+            pass
+        finally:
+            filebrowser_pre_upload.disconnect(fail)
+        expect(os.path.exists(upload.data_path), True, 'unclaimed after a failure')
+        # DATA_ROOT on another filesystem than the target
+        link = os.link
+        def cross_device_link(source, target):
+            if source == upload.complete_path:
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            return link(source, target)
+        os.link = cross_device_link
+        try:
+            expect(upload_chunked_complete(request, upload.upload_id).status_code, 200, 'completed')
+        finally:
+            os.link = link
+        expect(open(os.path.join(directory, 'movie.txt')).read(), '0123456789', 'assembled file')
+        expect(os.listdir(directory), ['movie.txt'], 'temporary copy removed')
+        expect(ChunkedUpload.get(upload.upload_id), None, 'staged upload removed')
+    finally:
+        shutil.rmtree(directory)
+
+
+@check
+def usage_journal():
+    import threading
+    from django.conf import settings
+    from filebrowser import usage
+    from filebrowser.workers import WorkerPool
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads', 'check_usage')
+    touch(os.path.join(directory, 'sub', 'a.txt'), 'abc')
+    try:
+        data = usage.scan_usage(WorkerPool(max_workers=2))
+        base = data['folders'][u'uploads'][:2]
+        expect(data['folders'][u'uploads/check_usage'][:2], [3, 1], 'scanned')
+        def add():
+            for i in range(50):
+                usage.update(os.path.join(directory, 'sub', 'b%s.txt' % i), 2, 1)
+        threads = [threading.Thread(target=add) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        usage.folder_renamed(os.path.join(directory, 'sub'), os.path.join(directory, 'renamed'))
+        assert usage.load()['folders'][u'uploads'][:2] == base, 'usage.json rewritten on update'
+        folders = usage.get_usage_data()['folders']
+        expect(folders[u'uploads/check_usage/renamed'][:2], [403, 201], 'journaled updates')
+        expect(folders[u'uploads'][:2], [base[0] + 400, base[1] + 200], 'parent folder')
+        # compacted into usage.json
+        compact_size = usage.JOURNAL_COMPACT_SIZE
+        usage.JOURNAL_COMPACT_SIZE = 0
+        try:
+            usage.update(os.path.join(directory, 'c.txt'), 5, 1)
+            usage.get_usage_data()
+        finally:
+            usage.JOURNAL_COMPACT_SIZE = compact_size
+        expect(os.path.exists(usage.get_journal_path()), False, 'journal removed')
+        expect(usage.load()['folders'][u'uploads/check_usage'][:2], [408, 202], 'compacted')
+        # callers get snapshots
+        snapshot = usage.get_usage_data()
+        usage.update(os.path.join(directory, 'new', 'd.txt'), 1, 1)
+        expect(u'uploads/check_usage/new' in usage.get_usage_data()['folders'], True, 'new folder')
+        expect(u'uploads/check_usage/new' in snapshot['folders'], False, 'snapshot changed')
+        # a scan replaces the changes journaled before it, but not those during it
+        class UploadingPool(object):
+            uploaded = False
+            def map(self, func, items):
+                if not self.uploaded:
+                    usage.update(os.path.join(directory, 'e.txt'), 7, 1)
+                    self.uploaded = True
+                return map(func, items)
+        usage.scan_usage(WorkerPool(max_workers=2))
+        data = usage.scan_usage(UploadingPool())
+        expect(data['folders'][u'uploads/check_usage'][:2], [3, 1], 'rescanned')
+        expect(usage.get_usage('uploads/check_usage'), dict(zip(usage.FIELDS, [10, 2, 0, 0])), 'changes during the scan')
+    finally:
+        shutil.rmtree(directory)
+
+
+@check
+def version_gc():
+    from django.conf import settings
+    from filebrowser import version_gc
+    expect(version_gc.index_images(['a.jpg', 'a.png', 'b.txt', 'c.gif']), {'a': ['a.jpg', 'a.png'], 'c': ['c.gif']}, 'index')
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads', 'check_gc')
+    versions_dir = os.path.join(settings.MEDIA_ROOT, '_versions')
+    touch(os.path.join(directory, 'photo.jpg'), mtime=time.time())
+    touch(os.path.join(directory, 'photo_small.jpg'), mtime=time.time() - 60)
+    # the original team.jpg has been deleted
+    touch(os.path.join(directory, 'team_small.jpg'))
+    # not an output of the version small
+    touch(os.path.join(directory, 'notes_small.txt'))
+    try:
+        found = dict((os.path.basename(v['path']), v['status']) for v in version_gc.find_versions())
+        expect(found, {'photo_small.jpg': 'stale', 'team_small.jpg': 'orphaned'}, 'versions next to the originals')
+        version_gc.collect_garbage()
+        assert os.path.exists(os.path.join(directory, 'team_small.jpg')), 'deleted in a dry run'
+        basedir = version_gc.VERSIONS_BASEDIR
+        version_gc.VERSIONS_BASEDIR = '_versions/'
+        try:
+            touch(os.path.join(versions_dir, 'uploads', 'check_gc', 'gone_small.jpg'))
+            touch(os.path.join(versions_dir, 'uploads', 'check_gc', 'notes_small.txt'))
+            os.unlink(os.path.join(directory, 'team_small.jpg'))
+            found = dict((os.path.basename(v['path']), v['status']) for v in version_gc.find_versions())
+            expect(found, {'gone_small.jpg': 'orphaned'}, 'versions within VERSIONS_BASEDIR')
+            report = version_gc.collect_garbage()
+            expect((report['dry_run'], report['orphaned']['count']), (True, 1), 'dry run by default')
+            assert os.path.exists(os.path.join(versions_dir, 'uploads', 'check_gc', 'gone_small.jpg')), 'deleted in a dry run'
+        finally:
+            version_gc.VERSIONS_BASEDIR = basedir
+    finally:
+        shutil.rmtree(directory)
+        shutil.rmtree(versions_dir, ignore_errors=True)
+
+
+@check
+def exclude_matcher():
+    import re
+    from filebrowser.functions import ExcludeMatcher, required_char, is_excluded
+    expect(required_char(r'_(small|big)\.jpg'), '_', 'literal')
+    expect(required_char(r'(?i)_small'), None, 'ignore case')
+    expect(required_char(r'a|_b'), None, 'alternation')
+    patterns = [r'_(small|big)\.(jpg|png)$', r'(?i)^thumbs\.db$', r'(\w)\1{3}', r'(?P<x>tmp)-(?P=x)', r'~$']
+    names = ['photo_small.jpg', 'photo.jpg', 'Thumbs.db', 'aaaa.txt', 'tmp-tmp', 'tmp-x', 'notes.txt~', '_big.png', 'x_big.gif']
+    for subset in (patterns, patterns[:1], patterns[:1] + patterns[-1:], patterns[1:]):
+        matcher = ExcludeMatcher(subset)
+        for name in names:
+            expect(matcher.search(name), bool([p for p in subset if re.search(p, name)]), '%s %s' % (name, subset))
+    expect(ExcludeMatcher([r'_x', r'~$']).required, '_~', 'required characters')
+    expect(ExcludeMatcher([]).search('anything'), False, 'no patterns')
+    expect(bool(is_excluded('.hidden')), True, 'hidden')
+    expect(bool(is_excluded('photo.jpg')), False, 'original')
+    expect(bool(is_excluded('photo_fb_thumb.jpg')), True, 'version')
+
+
+@check
+def duplicates():
+    import random
+    from django.core.exceptions import ImproperlyConfigured
+    from filebrowser import duplicates
+    numpy = duplicates.numpy
+    if numpy is None:
+        try:
+            duplicates.find_duplicates(data={'images': {}})
+        except ImproperlyConfigured:
+            return
+        raise AssertionError("no ImproperlyConfigured without NumPy")
+    rnd = random.Random(0)
+    values = [rnd.getrandbits(64) for i in range(200)]
+    # near copies: 1 to 4 flipped bits
+    values += [v ^ sum(1 << rnd.randrange(64) for k in range(rnd.randint(1, 4))) for v in values[:50]]
+    array = numpy.array(values, dtype=numpy.uint64)
+    expect(duplicates.popcount(array).tolist(), [bin(v).count('1') for v in values], 'popcount')
+    expected = set((i, j) for i in range(len(values)) for j in range(i + 1, len(values)) if bin(values[i] ^ values[j]).count('1') <= 4)
+    expect(duplicates.similar_pairs(array, 4, block_size=16), expected, 'similar pairs')
+    data = {'images': {
+        'uploads/a.jpg': ['%016x' % values[0], 0],
+        'uploads/a_copy.jpg': ['%016x' % values[200], 0],
+        'uploads/a_same.jpg': ['%016x' % values[0], 0],
+        'uploads/b.jpg': ['%016x' % values[1], 0],
+    }}
+    expect(duplicates.find_duplicates(4, data, existing_only=False), [['uploads/a.jpg', 'uploads/a_copy.jpg', 'uploads/a_same.jpg']], 'clusters')
+    expect(duplicates.find_duplicates(0, data, existing_only=False), [['uploads/a.jpg', 'uploads/a_same.jpg']], 'identical hashes')
+
+
+@check
+def dimension_filter():
+    from django.conf import settings
+    from filebrowser import image_index
+    from filebrowser.image_index import DimensionFilter, get_dimensions, load
+    from filebrowser.workers import WorkerPool
+    from benchutils import synthetic_image
+    expect(DimensionFilter({}).active, False, 'no filters')
+    for value, ratio in [('16:9', 16 / 9.0), ('1.5', 1.5), ('0', None), ('-1', None), ('4:0', None), ('inf', None), ('nan', None), ('wide', None)]:
+        expect(DimensionFilter({'filter_ratio': value}).ratio, ratio, 'ratio %s' % value)
+    expect(DimensionFilter({'filter_min_width': 'x', 'filter_orientation': 'Diagonal'}).active, False, 'invalid values')
+    f = DimensionFilter({'filter_min_width': '300', 'filter_orientation': 'Landscape', 'filter_ratio': '4:3'})
+    expect([f.match(d) for d in [(400, 300), (200, 150), (300, 400), (400, 200), None]], [True, False, False, False, False], 'match')
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads', 'check_dimensions')
+    os.makedirs(directory)
+    try:
+        synthetic_image(120, 90).save(os.path.join(directory, 'wide.jpg'))
+        synthetic_image(90, 120).save(os.path.join(directory, 'tall.png'))
+        touch(os.path.join(directory, 'broken.jpg'))
+        dimensions = get_dimensions(directory, ['wide.jpg', 'tall.png', 'broken.jpg', 'missing.jpg'], pool=WorkerPool(max_workers=2))
+        expect(dimensions, {'wide.jpg': (120, 90), 'tall.png': (90, 120), 'broken.jpg': None}, 'dimensions')
+        expect(sorted(load(directory)), [u'broken.jpg', u'tall.png', u'wide.jpg'], 'stored')
+        expect(get_dimensions(directory, ['wide.jpg'], fill=False), {'wide.jpg': (120, 90)}, 'from the index')
+        # a DATA_ROOT which cannot be written does not break browse or uploads
+        data_root = image_index.DATA_ROOT
+        image_index.DATA_ROOT = '/dev/null/fb'
+        try:
+            expect(get_dimensions(directory, ['tall.png']), {'tall.png': (90, 120)}, 'unwritable index')
+        finally:
+            image_index.DATA_ROOT = data_root
+    finally:
+        shutil.rmtree(directory)
+
+
+@check
+def filterdate_range():
+    import calendar
+    from filebrowser import functions
+    now = calendar.timegm((2024, 3, 31, 12, 0, 0))
+    utc = lambda *t: calendar.timegm(t + (0,) * (6 - len(t)))
+    expect(functions.get_filterdate_range('', now), None, 'no filter')
+    expect(functions.get_filterdate_range('tomorrow', now), (0, 0), 'unknown filter')
+    expect(functions.get_filterdate_range('past7days', now), (now - 7 * 86400, float('inf')), 'past7days')
+    timezone = functions.FILTER_TIMEZONE
+    try:
+        functions.FILTER_TIMEZONE = 'UTC'
+        expect(functions.get_filterdate_range('today', now), (utc(2024, 3, 31), utc(2024, 4, 1)), 'today (UTC)')
+        expect(functions.get_filterdate_range('thisyear', now), (utc(2024, 1, 1), utc(2025, 1, 1)), 'thisyear (UTC)')
+        try:
+            import pytz
+        except ImportError:
+            return
+        # the day daylight saving time starts has 23 hours
+        functions.FILTER_TIMEZONE = pytz.timezone('Europe/Berlin').zone
+        expect(functions.get_filterdate_range('today', now), (utc(2024, 3, 30, 23), utc(2024, 3, 31, 22)), 'today (Berlin)')
+        expect(functions.get_filterdate_range('today', utc(2024, 3, 30, 23, 30)), (utc(2024, 3, 30, 23), utc(2024, 3, 31, 22)), 'after midnight (Berlin)')
+    finally:
+        functions.FILTER_TIMEZONE = timezone
+
+
+@check
+def windowed_listing():
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.test.client import RequestFactory
+    from filebrowser import listing
+    from filebrowser.views import browse
+    threshold = listing.LIST_WINDOW_THRESHOLD
+    listing.LIST_WINDOW_THRESHOLD = 3
+    try:
+        expect(listing.use_window(range(4), {}, 'date'), True, 'huge folder')
+        expect(listing.use_window(range(3), {}, 'date'), False, 'small folder')
+        expect(listing.use_window(range(4), {}, 'filetype'), False, 'sorting by FileObject')
+        expect(listing.use_window(range(4), {'q': 'x'}, 'date'), False, 'search')
+        expect(listing.use_window(range(4), {'filter_type': 'Image'}, 'date'), False, 'filter')
+        expect(listing.use_window(range(4), {'filter_type': ''}, 'date'), True, 'empty filter')
+    finally:
+        listing.LIST_WINDOW_THRESHOLD = threshold
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads', 'check_window')
+    names = ['b.txt', 'A.txt', 'c.txt', 'd.txt']
+    for i, name in enumerate(names):
+        touch(os.path.join(directory, name), 'x' * (10 - i), mtime=1000000000 + i * 10)
+    try:
+        files = listing.WindowedListing(directory, 'uploads/check_window', names, 'filename_lower')
+        expect(len(files), 4, 'len')
+        expect([f.filename for f in files[1:3]], ['b.txt', 'c.txt'], 'sorted by name')
+        expect(files[-1].filename, 'd.txt', 'negative index')
+        files = listing.WindowedListing(directory, 'uploads/check_window', names, 'date', True)
+        expect([f.filename for f in files[0:2]], ['d.txt', 'c.txt'], 'newest first')
+        files = listing.WindowedListing(directory, 'uploads/check_window', names, 'filesize')
+        expect([f.filename for f in files[0:4]], ['d.txt', 'c.txt', 'A.txt', 'b.txt'], 'smallest first')
+        expect(files[5:9], [], 'beyond the end')
+    finally:
+        shutil.rmtree(directory)
+    # a missing folder redirects to the upload folder
+    request = RequestFactory().get('/', {'dir': 'missing/', 'o': 'date'})
+    request.user = User(username='staff', is_staff=True, is_active=True)
+    response = browse(request)
+    expect((response.status_code, response['Location']), (302, '/admin/filebrowser/browse/?o=date'), 'redirect')
+
+
+@check
+def settings_snapshot():
+    from filebrowser import settings as fb_settings
+    from filebrowser.functions import get_settings_var, get_file_type
+    snapshot = get_settings_var()
+    expect(get_settings_var() is snapshot, True, 'computed once')
+    for change in (lambda: snapshot.__setitem__('DEBUG', True), lambda: snapshot['VERSIONS'].pop('small'),
+            lambda: snapshot['EXTENSIONS'].update({}), lambda: snapshot['EXTENSIONS']['Image'].append('.bmp')):
+        try:
+            change()
+        except (TypeError, AttributeError):
+            pass
+        else:
+            raise AssertionError("snapshot changed")
+    expect(isinstance(fb_settings.EXTENSIONS['Image'], list), True, 'settings left alone')
+    def naive_file_type(filename):
+        extension = os.path.splitext(filename)[1].lower()
+        file_type = ''
+        for k, v in fb_settings.EXTENSIONS.iteritems():
+            if extension in [e.lower() for e in v]:
+                file_type = k
+        return file_type
+    for filename in ('photo.JPG', 'clip.mov', 'notes.txt', 'folder', 'archive.tar.gz', 'unknown.xyz', '.hidden'):
+        expect(get_file_type(filename), naive_file_type(filename), filename)
+
+
+@check
+def lazy_view_imports():
+    import json, subprocess
+    from benchutils import BENCHMARK_DIR
+    # in a fresh process: the checks above have imported everything
+    output = subprocess.check_output([sys.executable, os.path.join(BENCHMARK_DIR, 'bench_import.py'), '--child', 'filebrowser.urls'],
+        cwd=BENCHMARK_DIR)
+    result = json.loads(output.strip().splitlines()[-1])
+    expect(result['reverse_loaded'], [], 'imported by reverse()')
+
+
+def main():
+    names = sys.argv[1:]
+    media_root = setup_django(ROOT_URLCONF='bench_urls')
+    # failures the checks provoke on purpose are logged
+    logging.basicConfig(level=logging.CRITICAL)
+    failed = 0
+    try:
+        for func in CHECKS:
+            if names and func.__name__ not in names:
+                continue
+            try:
+                func()
+            except Exception:
+                failed += 1
+                print "FAIL %s" % func.__name__
+                traceback.print_exc()
+            else:
+                print "ok   %s" % func.__name__
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+    sys.exit(failed and 1 or 0)
+
+
+if __name__ == '__main__':
+    main()
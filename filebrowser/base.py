@@ -1,7 +1,7 @@
 # coding: utf-8
 
 # imports
-import os, re, datetime
+import os, re, stat, datetime
 from time import gmtime, strftime
 
 # django imports
@@ -9,18 +9,12 @@ from django.conf import settings
 
 # filebrowser imports
 from filebrowser.settings import *
-from filebrowser.functions import get_file_type, url_join, is_selectable, get_version_path
+from filebrowser.functions import get_file_type, url_join, is_selectable, get_version_path, url_to_path
+from filebrowser.cache import metadata_cache
+from filebrowser.instrumentation import timed
+from filebrowser.lazy import Image
 from django.utils.encoding import force_unicode
 
-# PIL import
-if STRICT_PIL:
-    from PIL import Image
-else:
-    try:
-        from PIL import Image
-    except ImportError:
-        import Image
-
 
 class FileObject(object):
     """
@@ -29,21 +23,36 @@ class FileObject(object):
     PATH has to be relative to MEDIA_ROOT.
     """
     
+    # stat result, dimensions and versions filled in by
+    # filebrowser.bulk.prefetch_fileobjects
+    _prefetched = None
+    
     def __init__(self, path):
+        self._set_path(path)
+        self.filetype = get_file_type(self.filename)
+    
+    def _set_path(self, path):
         self.path = force_unicode(path)
         self.url_rel = path.replace("\\","/")
         self.head = os.path.split(path)[0]
         self.filename = os.path.split(path)[1]
         self.filename_lower = self.filename.lower() # important for sorting
-        self.filetype = get_file_type(self.filename)
+    
+    def _get_stat(self):
+        """
+        stat result (None if the file does not exist).
+        """
+        if self._prefetched is not None and 'stat' in self._prefetched:
+            return self._prefetched['stat']
+        return metadata_cache.stat(self.path_full)
     
     def _filesize(self):
         """
         Filesize.
         """
-        path = force_unicode(self.path)
-        if os.path.isfile(os.path.join(MEDIA_ROOT, self.path)) or os.path.isdir(os.path.join(MEDIA_ROOT, self.path)):
-            return os.path.getsize(os.path.join(MEDIA_ROOT, self.path))
+        st = self._get_stat()
+        if st is not None:
+            return st.st_size
         return ""
     filesize = property(_filesize)
     
@@ -51,8 +60,9 @@ class FileObject(object):
         """
         Date.
         """
-        if os.path.isfile(os.path.join(MEDIA_ROOT, self.path)) or os.path.isdir(os.path.join(MEDIA_ROOT, self.path)):
-            return os.path.getmtime(os.path.join(MEDIA_ROOT, self.path))
+        st = self._get_stat()
+        if st is not None:
+            return st.st_mtime
         return ""
     date = property(_date)
     
@@ -71,9 +81,12 @@ class FileObject(object):
     extension = property(_extension)
     
     def _filetype_checked(self):
-        if self.filetype == "Folder" and os.path.isdir(self.path_full):
+        st = self._get_stat()
+        if st is None:
+            return ""
+        if self.filetype == "Folder" and stat.S_ISDIR(st.st_mode):
             return self.filetype
-        elif self.filetype != "Folder" and os.path.isfile(self.path_full):
+        elif self.filetype != "Folder" and stat.S_ISREG(st.st_mode):
             return self.filetype
         else:
             return ""
@@ -130,6 +143,25 @@ class FileObject(object):
             return ""
     url_thumbnail = property(_url_thumbnail)
     
+    def _usage(self):
+        """
+        Recursive size and number of files of a Folder
+        (s. filebrowser.usage, None if not scanned yet).
+        """
+        if self.filetype != "Folder":
+            return None
+        from filebrowser.usage import get_usage
+        return get_usage(self.path)
+    usage = property(_usage)
+    
+    def _url_serve(self):
+        """
+        URL of the serving view (s. FILEBROWSER_SERVE).
+        """
+        from django.core.urlresolvers import reverse
+        return reverse("fb_serve", args=[self.path])
+    url_serve = property(_url_serve)
+    
     def url_admin(self):
         if self.filetype_checked == "Folder":
             directory_re = re.compile(r'^(%s)' % (DIRECTORY))
@@ -143,8 +175,11 @@ class FileObject(object):
         Image Dimensions.
         """
         if self.filetype == 'Image':
+            if self._prefetched is not None and 'dimensions' in self._prefetched:
+                return self._prefetched['dimensions']
             try:
-                im = Image.open(os.path.join(MEDIA_ROOT, self.path))
+                with timed('image_open'):
+                    im = Image.open(os.path.join(MEDIA_ROOT, self.path))
                 return im.size
             except:
                 pass
@@ -156,16 +191,29 @@ class FileObject(object):
         """
         Image Width.
         """
-        return self.dimensions[0]
+        if self.dimensions:
+            return self.dimensions[0]
+        return None
     width = property(_width)
     
     def _height(self):
         """
         Image Height.
         """
-        return self.dimensions[1]
+        if self.dimensions:
+            return self.dimensions[1]
+        return None
     height = property(_height)
     
+    def _aspect_ratio(self):
+        """
+        Image Width / Height.
+        """
+        if self.dimensions and self.dimensions[1]:
+            return float(self.dimensions[0]) / self.dimensions[1]
+        return None
+    aspect_ratio = property(_aspect_ratio)
+    
     def _orientation(self):
         """
         Image Orientation.
@@ -183,8 +231,8 @@ class FileObject(object):
         """
         True if Folder is empty, False if not.
         """
-        if os.path.isdir(self.path_full):
-            if not os.listdir(self.path_full):
+        if metadata_cache.isdir(self.path_full):
+            if not metadata_cache.listdir(self.path_full):
                 return True
             else:
                 return False
@@ -192,6 +240,14 @@ class FileObject(object):
             return None
     is_empty = property(_is_empty)
     
+    def prefetched_version(self, version_prefix):
+        """
+        PATH of an up to date version, if known from prefetch_fileobjects.
+        """
+        if self._prefetched is not None:
+            return self._prefetched.get('versions', {}).get(version_prefix)
+        return None
+    
     def __repr__(self):
         return force_unicode(self.url_save)
     
@@ -202,3 +258,28 @@ class FileObject(object):
         return force_unicode(self.url_save)
 
 
+class LazyFileObject(FileObject):
+    """
+    A FileObject which is resolved on first access.
+    
+    VALUE is the (URL or PATH) value as stored by a FileBrowseField.
+    Path related attributes are computed when one of them is accessed
+    for the first time, the filetype when it is accessed.
+    """
+    
+    path_attributes = ('path', 'url_rel', 'head', 'filename', 'filename_lower')
+    
+    def __init__(self, value):
+        self.value = value
+    
+    def __getattr__(self, name):
+        # only called for attributes which are not set (yet)
+        if 'value' not in self.__dict__:
+            raise AttributeError(name)
+        if name in self.path_attributes:
+            self._set_path(url_to_path(self.value))
+        elif name == 'filetype':
+            self.filetype = get_file_type(self.filename)
+        else:
+            raise AttributeError(name)
+        return self.__dict__[name]
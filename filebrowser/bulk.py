@@ -0,0 +1,184 @@
+# coding: utf-8
+
+# imports
+import os
+
+# django imports
+from django.utils.encoding import smart_str, force_unicode
+
+# filebrowser imports
+from filebrowser.settings import MEDIA_ROOT, VERSIONS_BASEDIR, ADMIN_VERSIONS
+from filebrowser.functions import url_to_path, path_to_url, get_version_path, get_version_extension, version_generator
+from filebrowser.base import FileObject, Image
+from filebrowser.cache import metadata_cache
+from filebrowser.instrumentation import timed
+
+
+def prefetch_fileobjects(fileobjects, versions=(), dimensions=True):
+    """
+    Resolve many FileObjects at once.
+
+    The FileObjects are grouped by directory and every directory is listed
+    only once: filesize, date, filetype_checked, dimensions (if dimensions
+    is True) and the up to date versions given with versions are filled
+    in on the FileObjects (s. FileObject.prefetched_version).
+    Images are opened in parallel on the request WorkerPool (headers only).
+    Listings and stats go through (and fill) the metadata cache.
+
+    Returns the FileObjects.
+    """
+
+    fileobjects = [f for f in fileobjects if isinstance(f, FileObject)]
+    images = []
+    version_dirs = {}
+    listings = {}
+    for directory, group in group_by_directory(fileobjects, lambda f: f.path_full).iteritems():
+        names = listdir(directory, listings)
+        for fileobject in group:
+            prefetched = {'versions': {}}
+            if fileobject._prefetched is not None and 'dimensions' in fileobject._prefetched:
+                # e.g. from the image index (s. browse)
+                prefetched['dimensions'] = fileobject._prefetched['dimensions']
+            if force_unicode(fileobject.filename) in names:
+                prefetched['stat'] = metadata_cache.stat(fileobject.path_full)
+            else:
+                prefetched['stat'] = None
+            fileobject._prefetched = prefetched
+            if prefetched['stat'] is None or fileobject.filetype != 'Image':
+                continue
+            if dimensions:
+                images.append(fileobject)
+            for version_prefix in versions:
+                version_path = get_version_path_fast(fileobject, version_prefix)
+                if version_path is None:
+                    continue
+                version_dir, version_filename = os.path.split(os.path.join(MEDIA_ROOT, version_path))
+                version_dirs.setdefault(version_dir, []).append((fileobject, version_prefix, version_path, version_filename))
+
+    # VERSIONS: ONE LISTING PER VERSION DIRECTORY, STAT ONLY EXISTING VERSIONS
+    for version_dir, items in version_dirs.iteritems():
+        names = listdir(version_dir, listings)
+        for fileobject, version_prefix, version_path, version_filename in items:
+            if force_unicode(version_filename) not in names:
+                continue
+            st = metadata_cache.stat(os.path.join(version_dir, version_filename))
+            if st is not None and st.st_mtime >= fileobject._prefetched['stat'].st_mtime:
+                fileobject._prefetched['versions'][version_prefix] = version_path
+                metadata_cache.set_version(fileobject.path_full, version_prefix, os.path.join(version_dir, version_filename))
+
+    # DIMENSIONS
+    if images:
+        from filebrowser.workers import get_request_pool
+        for fileobject, size in zip(images, get_request_pool().map(read_dimensions, images)):
+            fileobject._prefetched['dimensions'] = size
+    return fileobjects
+
+
+def prefetch_field(objects, field_name, versions=(), dimensions=True):
+    """
+    prefetch_fileobjects for the FileBrowseField field_name of many
+    model instances (e.g. a QuerySet). Returns the instances as a list.
+
+    Usage: products = prefetch_field(Product.objects.all(), 'image', versions=['thumbnail'])
+    """
+
+    objects = list(objects)
+    prefetch_fileobjects([getattr(obj, field_name) for obj in objects], versions, dimensions)
+    return objects
+
+
+def resolve_versions(sources, version_prefix, generate=True):
+    """
+    Resolve the version version_prefix for many sources (FileObjects,
+    URLs or PATHs relative to MEDIA_ROOT) at once.
+
+    Existing versions are found with grouped directory listings
+    (s. prefetch_fileobjects). Missing and outdated versions are generated
+    in parallel on the request WorkerPool (if generate is True).
+
+    Returns a list (in the order of sources) of dicts with the keys
+    source, fileobject, url ('' if there is no version), missing
+    (True if the version was missing or outdated) and generated.
+    """
+
+    fileobjects = []
+    for source in sources:
+        if isinstance(source, FileObject) or not source:
+            fileobjects.append(source)
+        else:
+            fileobjects.append(FileObject(url_to_path(force_unicode(source))))
+    prefetch_fileobjects(fileobjects, versions=[version_prefix], dimensions=False)
+
+    missing = [f for f in fileobjects
+        if isinstance(f, FileObject) and f._prefetched['stat'] is not None and f.filetype == 'Image' and not f.prefetched_version(version_prefix)]
+    if generate and missing:
+        from filebrowser.workers import get_request_pool
+        paths = sorted(set(f.path for f in missing))
+        generated = dict(zip(paths, get_request_pool().map(lambda path: version_generator(path, version_prefix, force=True), paths)))
+        for fileobject in missing:
+            if generated[fileobject.path]:
+                fileobject._prefetched['versions'][version_prefix] = generated[fileobject.path]
+
+    results = []
+    missing = set(id(f) for f in missing)
+    for source, fileobject in zip(sources, fileobjects):
+        version_path = isinstance(fileobject, FileObject) and fileobject.prefetched_version(version_prefix)
+        results.append({
+            'source': source,
+            'fileobject': fileobject,
+            'url': version_path and path_to_url(version_path) or '',
+            'missing': id(fileobject) in missing,
+            'generated': id(fileobject) in missing and bool(version_path),
+        })
+    return results
+
+
+def group_by_directory(items, path_func):
+    """
+    Group items by the directory of path_func(item).
+    """
+
+    groups = {}
+    for item in items:
+        groups.setdefault(os.path.dirname(path_func(item)), []).append(item)
+    return groups
+
+
+def listdir(directory, listings):
+    """
+    Names within directory (empty if it does not exist), as a set kept
+    in listings for the directories listed before.
+    """
+
+    if directory not in listings:
+        try:
+            listings[directory] = set(metadata_cache.listdir(directory))
+        except OSError:
+            listings[directory] = set()
+    return listings[directory]
+
+
+def get_version_path_fast(fileobject, version_prefix):
+    """
+    get_version_path for a FileObject known to exist,
+    without checking the filesystem for the common case.
+    """
+
+    filename, ext = os.path.splitext(fileobject.filename)
+    if filename.split("_")[-1] in ADMIN_VERSIONS:
+        # the original might be a version itself, s. get_version_path
+        return get_version_path(fileobject.path, version_prefix)
+    version_filename = filename + "_" + version_prefix + get_version_extension(ext, version_prefix)
+    return os.path.join(VERSIONS_BASEDIR, fileobject.head, version_filename)
+
+
+def read_dimensions(fileobject):
+    """
+    Image size, read from the header.
+    """
+
+    try:
+        with timed('image_open'):
+            return Image.open(smart_str(fileobject.path_full)).size
+    except:
+        return None
@@ -0,0 +1,242 @@
+# coding: utf-8
+
+# imports
+import os, stat, threading
+from time import time
+from collections import OrderedDict
+
+# django imports
+from django.utils.encoding import smart_str, force_unicode
+
+# filebrowser imports
+from filebrowser.settings import MEDIA_ROOT, CACHE_TTL, CACHE_MAX_ENTRIES
+from filebrowser.instrumentation import timed
+
+# marker for negative lookups (path does not exist)
+MISSING = object()
+
+
+class MetadataCache(object):
+    """
+    Cache for directory listings, stat results and up to date versions.
+
+    Sits between FileObject/views and the filesystem in order to avoid
+    repeated syscalls on slow (e.g. NFS-mounted) MEDIA_ROOTs.
+    Entries expire after TTL seconds (TTL None means: never expire,
+    TTL 0 disables the cache). The number of entries is bounded (LRU).
+
+    All paths are absolute server paths.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._stats = OrderedDict()
+        self._listings = OrderedDict()
+        self._versions = OrderedDict()
+        self._version_keys = {}
+        self._lock = threading.RLock()
+        self.reset_counters()
+
+    def _enabled(self):
+        return self.ttl is None or self.ttl > 0
+    enabled = property(_enabled)
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def counters(self):
+        """
+        Hit/Miss counters. Every hit is a saved syscall.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'saved_syscalls': self.hits,
+            'invalidations': self.invalidations,
+            'hit_rate': lookups and float(self.hits) / lookups or 0.0,
+            'entries': len(self._stats) + len(self._listings) + len(self._versions),
+        }
+
+    def _get(self, store, key):
+        with self._lock:
+            try:
+                expires, value = store.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires is not None and expires < time():
+                self.misses += 1
+                return None
+            # re-insert in order to mark the entry as recently used
+            store[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def _set(self, store, key, value):
+        if self.ttl is None:
+            expires = None
+        else:
+            expires = time() + self.ttl
+        with self._lock:
+            store.pop(key, None)
+            store[key] = (expires, value)
+            while len(store) > self.max_entries:
+                store.popitem(last=False)
+
+    def stat(self, path):
+        """
+        os.stat(path), or None if the path does not exist.
+        """
+        path = _key(path)
+        if not self.enabled:
+            return stat_path(path)
+        value = self._get(self._stats, path)
+        if value is None:
+            value = stat_path(path)
+            self._set(self._stats, path, value is None and MISSING or value)
+            return value
+        if value is MISSING:
+            return None
+        return value
+
+    def listdir(self, path):
+        """
+        os.listdir(path) with unicode filenames. Raises OSError like os.listdir.
+        The returned list must not be modified.
+        """
+        if not self.enabled:
+            return listdir_path(path)
+        key = _key(path)
+        value = self._get(self._listings, key)
+        if value is None:
+            value = listdir_path(path)
+            self._set(self._listings, key, value)
+        return value
+
+    def get_version(self, source, version_prefix):
+        """
+        The version path (relative to MEDIA_ROOT) of source, if the
+        version is known to exist and to be up to date.
+        """
+        if not self.enabled:
+            return None
+        return self._get(self._versions, (_key(source), version_prefix))
+
+    def set_version(self, source, version_prefix, version):
+        """
+        Remember that version (an absolute path) is an up to date version
+        of source. The entry is dropped as soon as either source or version
+        is invalidated.
+        """
+        if not self.enabled:
+            return
+        key = (_key(source), version_prefix)
+        version_path = os.path.relpath(version, smart_str(MEDIA_ROOT))
+        self._set(self._versions, key, version_path)
+        with self._lock:
+            if len(self._version_keys) > 2 * self.max_entries:
+                # drop index entries of versions evicted from the LRU
+                for path in self._version_keys.keys():
+                    keys = set(k for k in self._version_keys[path] if k in self._versions)
+                    if keys:
+                        self._version_keys[path] = keys
+                    else:
+                        del self._version_keys[path]
+            self._version_keys.setdefault(key[0], set()).add(key)
+            self._version_keys.setdefault(_key(version), set()).add(key)
+
+    def _invalidate_versions(self, path):
+        for key in self._version_keys.pop(path, ()):
+            self._versions.pop(key, None)
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def isfile(self, path):
+        st = self.stat(path)
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def isdir(self, path):
+        st = self.stat(path)
+        return st is not None and stat.S_ISDIR(st.st_mode)
+
+    def getsize(self, path):
+        st = self.stat(path)
+        if st is None:
+            raise OSError(2, 'No such file or directory', path)
+        return st.st_size
+
+    def getmtime(self, path):
+        st = self.stat(path)
+        if st is None:
+            raise OSError(2, 'No such file or directory', path)
+        return st.st_mtime
+
+    def invalidate(self, path):
+        """
+        Forget everything about path: its stat result, its listing (if
+        path is a directory) and the listing of its parent directory.
+        """
+        path = _key(path)
+        with self._lock:
+            self.invalidations += 1
+            self._stats.pop(path, None)
+            self._listings.pop(path, None)
+            self._invalidate_versions(path)
+            parent = os.path.dirname(path)
+            self._stats.pop(parent, None)
+            self._listings.pop(parent, None)
+
+    def invalidate_tree(self, path):
+        """
+        Forget path and everything below path.
+        """
+        path = _key(path)
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            for store in (self._stats, self._listings):
+                for key in [k for k in store if k == path or k.startswith(prefix)]:
+                    del store[key]
+            for key in [k for k in self._version_keys if k == path or k.startswith(prefix)]:
+                self._invalidate_versions(key)
+        self.invalidate(path)
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+            self._listings.clear()
+            self._versions.clear()
+            self._version_keys.clear()
+
+
+def _key(path):
+    """
+    Normalized (byte string) cache key for path.
+    """
+    return os.path.normpath(smart_str(path))
+
+
+def stat_path(path):
+    """
+    os.stat(path), or None if the path does not exist.
+    """
+    with timed('stat'):
+        try:
+            return os.stat(path)
+        except OSError:
+            return None
+
+
+def listdir_path(path):
+    """
+    os.listdir(path) with unicode filenames.
+    """
+    with timed('listdir'):
+        return os.listdir(force_unicode(path))
+
+
+metadata_cache = MetadataCache()
@@ -0,0 +1,248 @@
+# coding: utf-8
+
+"""
+Resumable chunked uploads.
+
+An upload is staged within DATA_ROOT/chunks/<upload_id>/: meta.json holds
+the target directory, filename, size, owner and the byte ranges received
+so far, data.part is the file itself. Chunks are written into data.part at
+their offsets (in any order, possibly several times), so completing the
+upload means moving data.part into place - no concatenation needed.
+Completing renames data.part to data.complete first, so an upload is
+completed once only.
+"""
+
+# imports
+import os, re, errno, shutil, tempfile, uuid
+from time import time
+
+# django imports
+from django.utils import simplejson
+from django.utils.encoding import smart_str
+
+# filebrowser imports
+from filebrowser.settings import DATA_ROOT, CHUNKED_UPLOAD_EXPIRY
+from filebrowser.functions import rename_file, get_umask, FileLock
+
+upload_id_re = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ChunkedUploadError(Exception):
+    pass
+
+
+def get_staging_root():
+    return os.path.join(smart_str(DATA_ROOT), 'chunks')
+
+
+class ChunkedUpload(object):
+    """
+    A resumable upload (s. module docstring).
+    """
+
+    def __init__(self, upload_id, meta=None):
+        self.upload_id = upload_id
+        self.directory = os.path.join(get_staging_root(), upload_id)
+        self.meta_path = os.path.join(self.directory, 'meta.json')
+        self.data_path = os.path.join(self.directory, 'data.part')
+        self.complete_path = os.path.join(self.directory, 'data.complete')
+        self.meta = meta
+
+    @classmethod
+    def create(cls, path, filename, size, user_id, use_image_generator=False):
+        """
+        Stage a new upload of filename (size bytes) into path
+        (a directory relative to MEDIA_ROOT).
+        """
+        upload = cls(uuid.uuid4().hex, {
+            'path': path,
+            'filename': filename,
+            'size': size,
+            'user': user_id,
+            'use_image_generator': use_image_generator,
+            'received': [],
+            'created': time(),
+        })
+        os.makedirs(upload.directory, 0700)
+        open(upload.data_path, 'wb').close()
+        upload.save()
+        return upload
+
+    @classmethod
+    def get(cls, upload_id):
+        """
+        The staged upload upload_id (None if it does not exist).
+        """
+        if not upload_id_re.match(upload_id or ''):
+            return None
+        upload = cls(upload_id)
+        try:
+            upload.load()
+        except (IOError, ValueError):
+            return None
+        return upload
+
+    def load(self):
+        f = open(self.meta_path)
+        try:
+            self.meta = simplejson.load(f)
+        finally:
+            f.close()
+
+    def save(self):
+        fd, tmp_path = tempfile.mkstemp(prefix='.meta.', dir=self.directory)
+        f = os.fdopen(fd, 'w')
+        try:
+            simplejson.dump(self.meta, f)
+        finally:
+            f.close()
+        rename_file(tmp_path, self.meta_path)
+
+    def locked(self):
+        """
+        Lock for updating meta.json (concurrent chunks of one upload).
+        """
+        return FileLock(os.path.join(self.directory, 'meta.lock'))
+
+    def _received(self):
+        return [tuple(r) for r in self.meta['received']]
+    received = property(_received)
+
+    def _is_complete(self):
+        return self.received == [(0, self.meta['size'])] or self.meta['size'] == 0
+    is_complete = property(_is_complete)
+
+    def write_chunk(self, offset, stream, length, chunk_size=64*1024):
+        """
+        Write length bytes read from stream into the file at offset.
+        Returns the ranges received so far.
+        """
+        if offset < 0 or length < 0 or offset + length > self.meta['size']:
+            raise ChunkedUploadError("Chunk exceeds the size of the upload.")
+        written = 0
+        try:
+            f = open(self.data_path, 'r+b')
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            raise ChunkedUploadError("The upload has already been completed.")
+        try:
+            f.seek(offset)
+            while written < length:
+                data = stream.read(min(chunk_size, length - written))
+                if not data:
+                    break
+                f.write(data)
+                written += len(data)
+        finally:
+            f.close()
+        with self.locked():
+            self.load()
+            self.meta['received'] = merge_ranges(self.received + [(offset, offset + written)])
+            self.save()
+        if written < length:
+            raise ChunkedUploadError("Chunk is incomplete.")
+        return self.received
+
+    def claim(self):
+        """
+        Reserve the received file for completion (s. assemble). Raises
+        ChunkedUploadError if it has been claimed by another request.
+        """
+        try:
+            os.rename(self.data_path, self.complete_path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            raise ChunkedUploadError("The upload has already been completed.")
+
+    def unclaim(self):
+        """
+        Undo claim (if the upload could not be completed).
+        """
+        os.rename(self.complete_path, self.data_path)
+
+    def assemble(self, directory):
+        """
+        Move the claimed file into directory (an absolute path) without
+        copying it (if DATA_ROOT is on another filesystem, it is copied next
+        to the target first). An existing file is never replaced, the name
+        gets a suffix instead. Returns the absolute path of the file.
+        """
+        name, ext = os.path.splitext(smart_str(self.meta['filename']))
+        target = os.path.join(directory, name + ext)
+        source, tmp_path = self.complete_path, None
+        count = 0
+        try:
+            while True:
+                try:
+                    os.link(source, target)
+                except AttributeError:
+                    # no hard links (Windows)
+                    if os.path.exists(target):
+                        raise OSError(errno.EEXIST, target)
+                    shutil.move(source, target)
+                    return target
+                except OSError, e:
+                    if e.errno == errno.EXDEV and tmp_path is None:
+                        fd, tmp_path = tempfile.mkstemp(prefix='.upload.', dir=directory)
+                        os.close(fd)
+                        shutil.copyfile(self.complete_path, tmp_path)
+                        os.chmod(tmp_path, 0666 & ~get_umask())
+                        source = tmp_path
+                        continue
+                    if e.errno != errno.EEXIST:
+                        raise
+                    count += 1
+                    target = os.path.join(directory, "%s_%s%s" % (name, count, ext))
+                    continue
+                os.unlink(self.complete_path)
+                return target
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def delete(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def status(self):
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.meta['filename'],
+            'size': self.meta['size'],
+            'received': self.received,
+            'complete': self.is_complete,
+        }
+
+
+def merge_ranges(ranges):
+    """
+    Merge overlapping and adjacent (start, end) ranges.
+    """
+    merged = []
+    for start, end in sorted(r for r in ranges if r[1] > r[0]):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def cleanup_chunked_uploads(max_age=CHUNKED_UPLOAD_EXPIRY):
+    """
+    Remove staged uploads which have not been touched for max_age seconds.
+    """
+    root = get_staging_root()
+    try:
+        upload_ids = os.listdir(root)
+    except OSError:
+        return
+    for upload_id in upload_ids:
+        upload = ChunkedUpload(upload_id)
+        for path in (upload.meta_path, upload.directory):
+            try:
+                if os.path.getmtime(path) < time() - max_age:
+                    upload.delete()
+                break
+            except OSError:
+                continue
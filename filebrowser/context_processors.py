@@ -0,0 +1,16 @@
+# coding: utf-8
+
+# filebrowser imports
+from filebrowser.functions import get_settings_var
+
+
+def settings_var(request):
+    """
+    The FileBrowser settings (s. functions.get_settings_var) as settings_var,
+    e.g. for templates extending the FileBrowser templates.
+    
+    Add "filebrowser.context_processors.settings_var" to
+    TEMPLATE_CONTEXT_PROCESSORS in order to use it.
+    """
+    
+    return {'settings_var': get_settings_var()}
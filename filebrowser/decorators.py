@@ -1,30 +1,86 @@
 # coding: utf-8
 
+# imports
+from time import time
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
 # django imports
 from django.contrib.sessions.models import Session
 from django.shortcuts import get_object_or_404, render_to_response
 from django.contrib.auth.models import User
 from django.template import RequestContext
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.crypto import salted_hmac, constant_time_compare
+from django.utils.importlib import import_module
+
+# filebrowser imports
+from filebrowser.settings import FLASH_SESSION_CACHE_TIMEOUT
+
+
+def get_session_engine():
+    try:
+        return import_module(settings.SESSION_ENGINE)
+    except:
+        import django.contrib.sessions.backends.db
+        return django.contrib.sessions.backends.db
+
+
+def session_signature(session_key, user_id, expires):
+    return salted_hmac('filebrowser.flash_login_required', "%s:%s:%s" % (session_key, user_id, expires)).hexdigest()
+
+
+def get_cached_user(session_key):
+    """
+    The User cached for session_key by flash_login_required (or None).
+    Entries are signed and expire after FLASH_SESSION_CACHE_TIMEOUT seconds.
+    """
+
+    value = cache.get(session_cache_key(session_key))
+    if not value:
+        return None
+    try:
+        user, expires, signature = value
+    except (TypeError, ValueError):
+        return None
+    if expires < time() or not constant_time_compare(signature, session_signature(session_key, user.pk, expires)):
+        return None
+    return user
+
+
+def set_cached_user(session_key, user):
+    expires = int(time()) + FLASH_SESSION_CACHE_TIMEOUT
+    cache.set(session_cache_key(session_key), (user, expires, session_signature(session_key, user.pk, expires)), FLASH_SESSION_CACHE_TIMEOUT)
+
+
+def session_cache_key(session_key):
+    # the session key itself is never used as cache key
+    return 'filebrowser_flash_session_%s' % md5(settings.SECRET_KEY + str(session_key)).hexdigest()
 
 
 def flash_login_required(function):
     """
     Decorator to recognize a user  by its session.
     Used for Flash-Uploading.
+
+    The session-to-user lookup is cached for FLASH_SESSION_CACHE_TIMEOUT
+    seconds (0 disables the cache), so that a bulk upload does not decode
+    the session and query the User for every file.
     """
-    
+
     def decorator(request, *args, **kwargs):
-        try:
-            engine = __import__(settings.SESSION_ENGINE, {}, {}, [''])
-        except:
-            import django.contrib.sessions.backends.db
-            engine = django.contrib.sessions.backends.db
-        session_data = engine.SessionStore(request.POST.get('session_key'))
-        user_id = session_data['_auth_user_id']
-        # will return 404 if the session ID does not resolve to a valid user
-        request.user = get_object_or_404(User, pk=user_id)
+        session_key = request.POST.get('session_key')
+        user = FLASH_SESSION_CACHE_TIMEOUT and session_key and get_cached_user(session_key)
+        if not user:
+            session_data = get_session_engine().SessionStore(session_key)
+            user_id = session_data['_auth_user_id']
+            # will return 404 if the session ID does not resolve to a valid user
+            user = get_object_or_404(User, pk=user_id)
+            if FLASH_SESSION_CACHE_TIMEOUT and session_key:
+                set_cached_user(session_key, user)
+        request.user = user
         return function(request, *args, **kwargs)
     return decorator
-
-
@@ -0,0 +1,283 @@
+# coding: utf-8
+
+"""
+Near-duplicate detection.
+
+build_index() computes a 64 bit perceptual hash of every image from its
+ADMIN_THUMBNAIL version (only existing versions are used, nothing is
+generated). Thumbnails are decoded in batches on the WorkerPool and each
+batch is hashed at once with NumPy (s. DUPLICATES_HASH). The hashes are
+stored in DATA_ROOT/duplicates.json and only recomputed for changed
+thumbnails.
+
+find_duplicates() groups images whose hashes differ in at most
+DUPLICATES_THRESHOLD bits. Equal hashes are grouped first, the distinct
+hashes are matched with multi-index hashing instead of comparing all pairs.
+"""
+
+# imports
+import os, tempfile
+from time import time
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# django imports
+from django.utils import simplejson
+from django.utils.encoding import smart_str, force_unicode
+from django.core.exceptions import ImproperlyConfigured
+
+# filebrowser imports
+from filebrowser.settings import MEDIA_ROOT, DIRECTORY, DATA_ROOT, ADMIN_THUMBNAIL, EXTENSIONS, DUPLICATES_HASH, DUPLICATES_THRESHOLD, DUPLICATES_BATCH_SIZE
+from filebrowser.functions import get_version_path, is_excluded, rename_file, FileLock, Image
+from filebrowser.instrumentation import timed
+
+# the hash has HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = 8
+# thumbnails are scaled to DCT_SIZE x DCT_SIZE for the DCT hash
+DCT_SIZE = 32
+
+
+def get_store_path():
+    return os.path.join(smart_str(DATA_ROOT), 'duplicates.json')
+
+
+def get_lock_path():
+    return os.path.join(smart_str(DATA_ROOT), 'duplicates.lock')
+
+
+def find_thumbnails():
+    """
+    (original, thumbnail, mtime) for every image within DIRECTORY with an
+    existing ADMIN_THUMBNAIL version. original is relative to MEDIA_ROOT,
+    thumbnail absolute, mtime the one of the thumbnail.
+    """
+
+    root = os.path.join(smart_str(MEDIA_ROOT), smart_str(DIRECTORY))
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in filenames:
+            if is_excluded(filename) or os.path.splitext(filename)[1].lower() not in EXTENSIONS['Image']:
+                continue
+            original = os.path.relpath(os.path.join(dirpath, filename), smart_str(MEDIA_ROOT))
+            version_path = get_version_path(original, ADMIN_THUMBNAIL)
+            if version_path is None:
+                continue
+            thumbnail = os.path.join(smart_str(MEDIA_ROOT), version_path)
+            try:
+                mtime = os.path.getmtime(thumbnail)
+            except OSError:
+                continue
+            yield original, thumbnail, mtime
+
+
+def load_pixels(path, size):
+    """
+    Grayscale pixels of the image path scaled to size x size
+    (None if the image cannot be read).
+    """
+
+    try:
+        with timed('image_open'):
+            im = Image.open(path)
+            im = im.convert('L').resize((size, size), Image.ANTIALIAS)
+    except (IOError, ValueError):
+        return None
+    return numpy.asarray(im, dtype=numpy.float64)
+
+
+def dct_matrix(n):
+    k = numpy.arange(n)[:, None]
+    i = numpy.arange(n)[None, :]
+    m = numpy.cos(numpy.pi * (2 * i + 1) * k / (2.0 * n)) * numpy.sqrt(2.0 / n)
+    m[0] /= numpy.sqrt(2.0)
+    return m
+
+
+def dct_hashes(pixels):
+    """
+    Bits of the DCT hash for pixels of shape (n, DCT_SIZE, DCT_SIZE):
+    the lowest HASH_SIZE x HASH_SIZE frequencies compared to their median
+    (without the DC term). Returns a boolean array of shape (n, 64).
+    """
+
+    d = dct_matrix(pixels.shape[1])
+    # D * P * D^T for all images at once
+    coefficients = numpy.dot(numpy.dot(d, pixels).transpose(1, 0, 2), d.T)
+    low = coefficients[:, :HASH_SIZE, :HASH_SIZE].reshape(len(pixels), HASH_SIZE * HASH_SIZE)
+    return low > numpy.median(low[:, 1:], axis=1)[:, None]
+
+
+def average_hashes(pixels):
+    """
+    Bits of the average hash for pixels of shape (n, HASH_SIZE, HASH_SIZE).
+    """
+
+    flat = pixels.reshape(len(pixels), -1)
+    return flat > flat.mean(axis=1)[:, None]
+
+
+def compute_hashes(pixels, method=DUPLICATES_HASH):
+    """
+    Hashes (hex strings) for pixels of shape (n, size, size).
+    """
+
+    if method == 'average':
+        bits = average_hashes(pixels)
+    else:
+        bits = dct_hashes(pixels)
+    return [row.tostring().encode('hex') for row in numpy.packbits(bits, axis=1)]
+
+
+def build_index(pool=None, batch_size=DUPLICATES_BATCH_SIZE):
+    """
+    Hash the thumbnails of all images (unchanged thumbnails keep their
+    stored hash) and store the index. Thumbnails are loaded in parallel on
+    pool (default: the WorkerPool). Returns the stored data.
+    """
+
+    if numpy is None:
+        raise ImproperlyConfigured("Near-duplicate detection requires NumPy.")
+    if pool is None:
+        from filebrowser.workers import get_pool
+        pool = get_pool()
+    size = DUPLICATES_HASH == 'average' and HASH_SIZE or DCT_SIZE
+
+    stored = load()
+    if not stored or stored.get('hash') != DUPLICATES_HASH:
+        stored = {'images': {}}
+    images = {}
+    pending = []
+    for original, thumbnail, mtime in find_thumbnails():
+        key = force_unicode(original)
+        entry = stored['images'].get(key)
+        if entry and entry[1] == mtime:
+            images[key] = entry
+        else:
+            pending.append((key, thumbnail, mtime))
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        pixels = pool.map(lambda item: load_pixels(item[1], size), batch)
+        loaded = [(item, value) for item, value in zip(batch, pixels) if value is not None]
+        if not loaded:
+            continue
+        hashes = compute_hashes(numpy.array([value for item, value in loaded]), DUPLICATES_HASH)
+        for ((key, thumbnail, mtime), value), image_hash in zip(loaded, hashes):
+            images[key] = [image_hash, mtime]
+
+    data = {'hash': DUPLICATES_HASH, 'images': images, 'updated': time()}
+    if not os.path.isdir(smart_str(DATA_ROOT)):
+        os.makedirs(smart_str(DATA_ROOT))
+    with FileLock(get_lock_path()):
+        save(data)
+    return data
+
+
+def save(data):
+    fd, tmp_path = tempfile.mkstemp(prefix='.duplicates.', dir=smart_str(DATA_ROOT))
+    f = os.fdopen(fd, 'w')
+    try:
+        simplejson.dump(data, f)
+    finally:
+        f.close()
+    rename_file(tmp_path, get_store_path())
+
+
+def load():
+    try:
+        f = open(get_store_path())
+    except IOError:
+        return None
+    try:
+        return simplejson.load(f)
+    finally:
+        f.close()
+
+
+def popcount(values):
+    """
+    Number of set bits of every element of the uint64 array values (SWAR).
+    """
+
+    m1, m2, m4, h01 = [numpy.uint64(c) for c in (0x5555555555555555, 0x3333333333333333, 0x0f0f0f0f0f0f0f0f, 0x0101010101010101)]
+    values = values - ((values >> numpy.uint64(1)) & m1)
+    values = (values & m2) + ((values >> numpy.uint64(2)) & m2)
+    values = (values + (values >> numpy.uint64(4))) & m4
+    return (values * h01) >> numpy.uint64(56)
+
+
+def similar_pairs(values, threshold, block_size=1024):
+    """
+    Index pairs (i, j) of the distinct hashes values (a uint64 array)
+    differing in at most threshold bits, using multi-index hashing: split
+    into threshold + 1 chunks, two such hashes are equal in at least one
+    chunk, so only hashes within the same bucket of a chunk are compared
+    (vectorized, block_size rows at once).
+    """
+
+    chunks = threshold + 1
+    boundaries = [64 * i // chunks for i in range(chunks + 1)]
+    pairs = set()
+    for start, end in zip(boundaries, boundaries[1:]):
+        keys = (values >> numpy.uint64(start)) & numpy.uint64((1 << (end - start)) - 1)
+        order = numpy.argsort(keys, kind='mergesort')
+        for bucket in numpy.split(order, numpy.flatnonzero(numpy.diff(keys[order])) + 1):
+            if len(bucket) < 2:
+                continue
+            bucket_values = values[bucket]
+            for row in range(0, len(bucket), block_size):
+                distances = popcount(bucket_values[row:row + block_size, None] ^ bucket_values[None, :])
+                i, j = numpy.nonzero(distances <= threshold)
+                i += row
+                mask = i < j
+                pairs.update(zip(bucket[i[mask]].tolist(), bucket[j[mask]].tolist()))
+    return pairs
+
+
+def find_duplicates(threshold=DUPLICATES_THRESHOLD, data=None, existing_only=True):
+    """
+    Clusters of near-duplicate images (paths relative to MEDIA_ROOT),
+    largest first, from the stored index (or data). Clusters are
+    transitive: two images may differ in more than threshold bits if
+    they are linked by a third one. With existing_only, images deleted
+    since the index was built are left out. Returns None without an index.
+    """
+
+    if numpy is None:
+        raise ImproperlyConfigured("Near-duplicate detection requires NumPy.")
+    if data is None:
+        data = load()
+    if not data:
+        return None
+
+    by_hash = {}
+    for path, (image_hash, mtime) in data['images'].iteritems():
+        by_hash.setdefault(image_hash, []).append(path)
+    hashes = sorted(by_hash)
+
+    # union-find over the distinct hashes
+    parent = range(len(hashes))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    if threshold and len(hashes) > 1:
+        values = numpy.array([int(image_hash, 16) for image_hash in hashes], dtype=numpy.uint64)
+        for i, j in similar_pairs(values, threshold):
+            parent[find(j)] = find(i)
+
+    clusters = {}
+    for i, image_hash in enumerate(hashes):
+        clusters.setdefault(find(i), []).extend(by_hash[image_hash])
+    results = []
+    for paths in clusters.itervalues():
+        if existing_only:
+            paths = [path for path in paths if os.path.exists(os.path.join(smart_str(MEDIA_ROOT), smart_str(path)))]
+        paths.sort()
+        if len(paths) > 1:
+            results.append(paths)
+    results.sort(key=lambda paths: (-len(paths), paths[0]))
+    return results
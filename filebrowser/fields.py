@@ -14,8 +14,7 @@ from django.utils.translation import ugettext_lazy as _
 
 # filebrowser imports
 from filebrowser.settings import *
-from filebrowser.base import FileObject
-from filebrowser.functions import url_to_path
+from filebrowser.base import FileObject, LazyFileObject
 
 
 class FileBrowseWidget(Input):
@@ -91,7 +90,8 @@ class FileBrowseField(Field):
     def to_python(self, value):
         if not value or isinstance(value, FileObject):
             return value
-        return FileObject(url_to_path(value))
+        # path and filetype are resolved on first access
+        return LazyFileObject(value)
     
     def get_db_prep_value(self, value):
         if value is None:
@@ -1,17 +1,24 @@
 # coding: utf-8
 
 # imports
-import re, os
+import re, os, tempfile
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
 
 # django imports
 from django import forms
 from django.conf import settings
 from django.forms.formsets import BaseFormSet
 from django.utils.translation import ugettext as _
+from django.template.defaultfilters import filesizeformat
 
 # filebrowser imports
-from filebrowser.settings import MAX_UPLOAD_SIZE, FOLDER_REGEX
-from filebrowser.functions import convert_filename, get_file_type, get_file
+from filebrowser.settings import MAX_UPLOAD_SIZE, FOLDER_REGEX, EDIT_MAX_SIZE, EDIT_CHUNK_SIZE
+from filebrowser.functions import convert_filename, get_file_type, get_file, rename_file
+from filebrowser.cache import metadata_cache
+from filebrowser import usage
 
 alnum_name_re = re.compile(FOLDER_REGEX)
 
@@ -76,14 +83,88 @@ class EditForm(forms.Form):
         self.filename = filename
         self.file_extension = file_extension
         super(EditForm, self).__init__(*args, **kwargs)
-        file_content = open(os.path.join(path, filename), 'r').read()
-        self.fields['content'].initial = file_content.decode(settings.DEFAULT_CHARSET)
+        self.file_path = os.path.join(path, filename)
+        self.too_large = EDIT_MAX_SIZE is not None and os.path.getsize(self.file_path) > EDIT_MAX_SIZE
+        if self.too_large:
+            # files above EDIT_MAX_SIZE are not loaded
+            self.fields['content'].widget.attrs['disabled'] = 'disabled'
+            self.fields['content'].help_text = self.too_large_message()
+        elif not self.is_bound:
+            self.fields['content'].initial = self.read_content()
+
+    def too_large_message(self):
+        return _('The file is too large to be edited (max. %s).') % filesizeformat(EDIT_MAX_SIZE)
+
+    def read_content(self):
+        chunks = []
+        in_file = open(self.file_path, 'rb')
+        try:
+            for chunk in iter(lambda: in_file.read(EDIT_CHUNK_SIZE), ''):
+                chunks.append(chunk)
+        finally:
+            in_file.close()
+        return ''.join(chunks).decode(settings.DEFAULT_CHARSET)
+
+    def clean_content(self):
+        if self.too_large:
+            raise forms.ValidationError(self.too_large_message())
+        return self.cleaned_data['content']
+
+    def encoded_chunks(self):
+        """
+        The content, encoded with DEFAULT_CHARSET and without carriage
+        returns, in chunks of about EDIT_CHUNK_SIZE characters.
+        """
+        content = self.cleaned_data['content']
+        start = 0
+        while start < len(content):
+            end = start + EDIT_CHUNK_SIZE
+            if u'\ud800' <= content[end-1:end] <= u'\udbff':
+                # do not split a surrogate pair (narrow Python builds)
+                end += 1
+            yield content[start:end].encode(settings.DEFAULT_CHARSET).replace("\r", "")
+            start = end
+
+    def file_hash(self):
+        file_hash = md5()
+        in_file = open(self.file_path, 'rb')
+        try:
+            for chunk in iter(lambda: in_file.read(EDIT_CHUNK_SIZE), ''):
+                file_hash.update(chunk)
+        finally:
+            in_file.close()
+        return file_hash.digest()
 
     def save(self):
-        content = self.cleaned_data['content']
-        out_file = open(os.path.join(self.path, self.filename), 'w')
-        out_file.write(content.encode(settings.DEFAULT_CHARSET).replace("\r", ""))
-        out_file.close()
+        """
+        Save the content. The file is written to a temporary file first and
+        then moved into place. Returns False if the content is unchanged
+        (nothing is written then).
+        """
+        content_hash = md5()
+        for chunk in self.encoded_chunks():
+            content_hash.update(chunk)
+        if content_hash.digest() == self.file_hash():
+            return False
+        fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % self.filename, dir=self.path)
+        try:
+            out_file = os.fdopen(fd, 'wb')
+            try:
+                for chunk in self.encoded_chunks():
+                    out_file.write(chunk)
+                out_file.flush()
+                os.fsync(out_file.fileno())
+            finally:
+                out_file.close()
+            st = os.stat(self.file_path)
+            os.chmod(tmp_path, st.st_mode & 07777)
+            rename_file(tmp_path, self.file_path)
+        except:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        usage.update(self.file_path, os.path.getsize(self.file_path) - st.st_size, 0)
+        return True
 
 
 class BaseUploadFormSet(BaseFormSet):
@@ -94,12 +175,18 @@ class BaseUploadFormSet(BaseFormSet):
     def __init__(self, **kwargs):
         self.path = kwargs['path']
         del kwargs['path']
+        self.dir_list = None
         super(BaseUploadFormSet, self).__init__(**kwargs)
     
     def _construct_form(self, i, **kwargs):
         # this works because BaseFormSet._construct_form() passes **kwargs
         # to the form's __init__()
         kwargs["path"] = self.path
+        if self.is_bound:
+            # one directory snapshot for all forms
+            if self.dir_list is None:
+                self.dir_list = set(metadata_cache.listdir(self.path))
+            kwargs["dir_list"] = self.dir_list
         return super(BaseUploadFormSet, self)._construct_form(i, **kwargs)
     
 
@@ -108,6 +195,8 @@ class UploadForm(forms.Form):
     def __init__(self, *args, **kwargs):
         self.path = kwargs['path']
         del kwargs['path']
+        # names within path (s. BaseUploadFormSet), listed if not given
+        self.dir_list = kwargs.pop('dir_list', None)
         super(UploadForm, self).__init__(*args, **kwargs)
     
     file = forms.FileField(label=_(u'File'))
@@ -115,27 +204,37 @@ class UploadForm(forms.Form):
     
     def clean_file(self):
         if self.cleaned_data['file']:
-            filename = convert_filename(self.cleaned_data['file'].name)
-            
-            # CHECK IF FILE EXISTS
-            dir_list = os.listdir(self.path)
-            if filename in dir_list:
-                raise forms.ValidationError(_(u'File already exists.'))
-                
-            # TODO: CHECK IF VERSIONS_PATH EXISTS (IF USE_IMAGE_GENERATOR IS TRUE)
-            
-            # CHECK FILENAME
-            if not alnum_name_re.search(filename):
-                raise forms.ValidationError(_(u'Filename is not allowed.'))
-                
-            # CHECK EXTENSION / FILE_TYPE
-            file_type = get_file_type(filename)
-            if not file_type:
-                raise forms.ValidationError(_(u'File extension is not allowed.'))
-                
-            # CHECK FILESIZE
-            filesize = self.cleaned_data['file'].size
-            if filesize > MAX_UPLOAD_SIZE:
-                raise forms.ValidationError(_(u'Filesize exceeds allowed Upload Size.'))
+            dir_list = self.dir_list
+            if dir_list is None:
+                dir_list = metadata_cache.listdir(self.path)
+            check_upload(convert_filename(self.cleaned_data['file'].name), self.cleaned_data['file'].size, dir_list)
         return self.cleaned_data['file']
 
+
+def check_upload(filename, filesize, dir_list):
+    """
+    Validate an upload: filename (converted with convert_filename) must not
+    be in dir_list (the names within the upload directory), has to be an
+    allowed name with an allowed extension and filesize must not exceed
+    MAX_UPLOAD_SIZE. Raises forms.ValidationError.
+    """
+    
+    # CHECK IF FILE EXISTS
+    if filename in dir_list:
+        raise forms.ValidationError(_(u'File already exists.'))
+        
+    # TODO: CHECK IF VERSIONS_PATH EXISTS (IF USE_IMAGE_GENERATOR IS TRUE)
+    
+    # CHECK FILENAME
+    if not alnum_name_re.search(filename):
+        raise forms.ValidationError(_(u'Filename is not allowed.'))
+        
+    # CHECK EXTENSION / FILE_TYPE
+    file_type = get_file_type(filename)
+    if not file_type:
+        raise forms.ValidationError(_(u'File extension is not allowed.'))
+        
+    # CHECK FILESIZE
+    if filesize > MAX_UPLOAD_SIZE:
+        raise forms.ValidationError(_(u'Filesize exceeds allowed Upload Size.'))
+
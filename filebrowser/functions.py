@@ -1,8 +1,8 @@
 # coding: utf-8
 
 # imports
-import os, re, decimal
-from time import gmtime, strftime, localtime, mktime, time
+import os, re, sre_parse, sre_constants, errno, tempfile, calendar, datetime, threading, uuid
+from time import mktime, time, sleep
 from urlparse import urlparse
 
 # django imports
@@ -14,15 +14,45 @@ from django.utils.encoding import smart_str
 
 # filebrowser imports
 from filebrowser.settings import *
+from filebrowser.cache import metadata_cache
+from filebrowser.instrumentation import timed
+from filebrowser.lazy import Image, ImageFile
 
-# PIL import
-if STRICT_PIL:
-    from PIL import Image
-else:
-    try:
-        from PIL import Image
-    except ImportError:
-        import Image
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_umask = None
+_umask_lock = threading.Lock()
+
+def get_umask():
+    """
+    The umask of the process (for the file mode of new versions).
+    
+    Read from /proc where available: os.umask can only be read by setting
+    it, which affects files created by other threads meanwhile.
+    """
+    
+    global _umask
+    if _umask is None:
+        with _umask_lock:
+            if _umask is None:
+                try:
+                    f = open('/proc/self/status')
+                    try:
+                        _umask = [int(line.split()[1], 8) for line in f if line.startswith('Umask:')][0]
+                    finally:
+                        f.close()
+                except (IOError, IndexError, ValueError):
+                    _umask = os.umask(0)
+                    os.umask(_umask)
+    return _umask
+
+# Precompile regular expressions
+mediaurl_re = re.compile(r'^(%s)' % (MEDIA_URL))
+mediaroot_re = re.compile(r'^(%s)' % (MEDIA_ROOT))
+directory_re = re.compile(r'^(%s)' % (DIRECTORY))
 
 
 def url_to_path(value):
@@ -33,7 +63,6 @@ def url_to_path(value):
     Returns a PATH relative to MEDIA_ROOT.
     """
     
-    mediaurl_re = re.compile(r'^(%s)' % (MEDIA_URL))
     value = mediaurl_re.sub('', value)
     return value
 
@@ -46,7 +75,6 @@ def path_to_url(value):
     Return an URL relative to MEDIA_ROOT.
     """
     
-    mediaroot_re = re.compile(r'^(%s)' % (MEDIA_ROOT))
     value = mediaroot_re.sub('', value)
     return url_join(MEDIA_URL, value)
 
@@ -58,9 +86,7 @@ def dir_from_url(value):
     an URL relative to MEDIA_URL.
     """
     
-    mediaurl_re = re.compile(r'^(%s)' % (MEDIA_URL))
     value = mediaurl_re.sub('', value)
-    directory_re = re.compile(r'^(%s)' % (DIRECTORY))
     value = directory_re.sub('', value)
     return os.path.split(value)[0]
 
@@ -74,9 +100,10 @@ def get_version_path(value, version_prefix):
     Returns a path relative to MEDIA_ROOT.
     """
     
-    if os.path.isfile(smart_str(os.path.join(MEDIA_ROOT, value))):
+    if metadata_cache.isfile(os.path.join(MEDIA_ROOT, value)):
         path, filename = os.path.split(value)
         filename, ext = os.path.splitext(filename)
+        ext = get_version_extension(ext, version_prefix)
         
         # check if this file is a version of an other file
         # to return filename_<version>.ext instead of filename_<version>_<version>.ext
@@ -86,7 +113,7 @@ def get_version_path(value, version_prefix):
             # so we strip the suffix (aka. version_perfix)
             new_filename = filename.replace("_" + tmp[len(tmp)-1], "")
             # check if the version exists when we use the new_filename
-            if os.path.isfile(smart_str(os.path.join(MEDIA_ROOT, path, new_filename + "_" + version_prefix + ext))):
+            if metadata_cache.isfile(os.path.join(MEDIA_ROOT, path, new_filename + "_" + version_prefix + ext)):
                 # our "original" filename seem to be filename_<version> construct
                 # so we replace it with the new_filename
                 filename = new_filename
@@ -101,6 +128,60 @@ def get_version_path(value, version_prefix):
         return None
 
 
+def get_version_extension(ext, version_prefix):
+    """
+    Extension of a version, given the extension of the original.
+    Differs from the original if the version defines an output format.
+    """
+    
+    output_format = VERSIONS.get(version_prefix, {}).get('format')
+    if output_format:
+        return VERSION_FORMAT_EXTENSIONS.get(output_format.lower(), '.' + output_format.lower())
+    return ext
+
+
+def get_version_extensions():
+    """
+    Extensions a version can have: EXTENSION_LIST plus the extensions of
+    the output formats of versions (e.g. .webp, s. get_version_extension).
+    """
+    
+    extensions = list(EXTENSION_LIST)
+    for extension in VERSION_FORMAT_EXTENSIONS.values() + [get_version_extension('', k) for k in VERSIONS]:
+        if extension and extension not in extensions:
+            extensions.append(extension)
+    return extensions
+
+
+def get_version_save_options(version_prefix, output_format):
+    """
+    Keyword arguments for saving a version with PIL (encoder settings).
+    output_format is the PIL format name (e.g. JPEG, PNG, WEBP, GIF).
+    """
+    
+    setting = VERSIONS[version_prefix]
+    options = {}
+    if output_format in ('JPEG', 'WEBP'):
+        options['quality'] = setting.get('quality', VERSION_QUALITY)
+    if output_format == 'JPEG':
+        options['optimize'] = setting.get('optimize', True)
+        if setting.get('progressive'):
+            options['progressive'] = True
+        if setting.get('subsampling') is not None:
+            options['subsampling'] = setting['subsampling']
+    elif output_format == 'PNG':
+        if setting.get('compress_level') is not None:
+            options['compress_level'] = setting['compress_level']
+        else:
+            options['optimize'] = setting.get('optimize', True)
+    elif output_format == 'WEBP':
+        if setting.get('lossless'):
+            options['lossless'] = True
+        if setting.get('method') is not None:
+            options['method'] = setting['method']
+    return options
+
+
 def sort_by_attr(seq, attr):
     """
     Sort the sequence of objects by object's attribute
@@ -150,7 +231,7 @@ def get_path(path):
     Get Path.
     """
     
-    if path.startswith('.') or os.path.isabs(path) or not os.path.isdir(os.path.join(MEDIA_ROOT, DIRECTORY, path)):
+    if path.startswith('.') or os.path.isabs(path) or not metadata_cache.isdir(os.path.join(MEDIA_ROOT, DIRECTORY, path)):
         return None
     return path
 
@@ -162,11 +243,86 @@ def get_file(path, filename):
     
     converted_path = smart_str(os.path.join(MEDIA_ROOT, DIRECTORY, path, filename))
     
-    if not os.path.isfile(converted_path) and not os.path.isdir(converted_path):
+    if not metadata_cache.exists(converted_path):
         return None
     return filename
 
 
+def get_serve_path(path):
+    """
+    Absolute path of a file which may be served (s. views.serve) or None.
+    path is relative to MEDIA_ROOT and has to be located within DIRECTORY
+    or VERSIONS_BASEDIR. Hidden files (e.g. lockfiles) are not served.
+    """
+    
+    path = os.path.normpath(smart_str(path))
+    if os.path.isabs(path) or path == '.' or [part for part in path.split(os.sep) if part.startswith('.')]:
+        return None
+    roots = [os.path.normpath(smart_str(DIRECTORY))]
+    if VERSIONS_BASEDIR:
+        roots.append(os.path.normpath(smart_str(VERSIONS_BASEDIR)))
+    if not [root for root in roots if root == '.' or path.startswith(root + os.sep)]:
+        return None
+    absolute_path = os.path.join(smart_str(MEDIA_ROOT), path)
+    if not metadata_cache.isfile(absolute_path):
+        return None
+    return absolute_path
+
+
+def parse_range(header, size):
+    """
+    Parse a HTTP Range header (single byte ranges only).
+    
+    Returns (offset, length), None if the header is missing, malformed
+    (e.g. the last byte is before the first) or has several ranges (the
+    whole file should be sent then) or False if the range cannot be
+    satisfied.
+    """
+    
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, sep, end = header[6:].strip().partition('-')
+    try:
+        if not start:
+            # suffix range: the last bytes
+            length = min(int(end), size)
+            if length <= 0:
+                return False
+            return size - length, length
+        start = int(start)
+        # (an end of 0 is a valid end, e.g. bytes=0-0)
+        last = end and int(end)
+    except ValueError:
+        return None
+    if end and last < start:
+        # invalid, the header is ignored (RFC 7233, 3.1)
+        return None
+    if start >= size:
+        return False
+    if not end or last >= size:
+        last = size - 1
+    return start, last - start + 1
+
+
+def file_iterator(path, offset=0, length=None, chunk_size=64*1024):
+    """
+    Read length bytes (all bytes if length is None) from path, starting at offset.
+    """
+    
+    f = open(path, 'rb')
+    try:
+        f.seek(offset)
+        while length is None or length > 0:
+            data = f.read(length is None and chunk_size or min(chunk_size, length))
+            if not data:
+                break
+            if length is not None:
+                length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
 def get_breadcrumbs(query, path):
     """
     Get breadcrumbs.
@@ -184,23 +340,105 @@ def get_breadcrumbs(query, path):
 def get_filterdate(filterDate, dateTime):
     """
     Get filterdate.
+    
+    'true' if the timestamp dateTime matches filterDate, '' if not.
+    To filter many files, use get_filterdate_range once instead.
     """
     
-    returnvalue = ''
-    dateYear = strftime("%Y", gmtime(dateTime))
-    dateMonth = strftime("%m", gmtime(dateTime))
-    dateDay = strftime("%d", gmtime(dateTime))
-    if filterDate == 'today' and int(dateYear) == int(localtime()[0]) and int(dateMonth) == int(localtime()[1]) and int(dateDay) == int(localtime()[2]): returnvalue = 'true'
-    elif filterDate == 'thismonth' and dateTime >= time()-2592000: returnvalue = 'true'
-    elif filterDate == 'thisyear' and int(dateYear) == int(localtime()[0]): returnvalue = 'true'
-    elif filterDate == 'past7days' and dateTime >= time()-604800: returnvalue = 'true'
-    elif filterDate == '': returnvalue = 'true'
-    return returnvalue
+    date_range = get_filterdate_range(filterDate)
+    if date_range is None or date_range[0] <= dateTime < date_range[1]:
+        return 'true'
+    return ''
 
 
-def get_settings_var():
+def get_filter_timezone():
     """
-    Get settings variables used for FileBrowser listing.
+    The pytz timezone FILTER_TIMEZONE (None for local time, 'UTC' for UTC).
+    """
+    
+    if FILTER_TIMEZONE in (None, 'UTC'):
+        return FILTER_TIMEZONE
+    import pytz
+    return pytz.timezone(FILTER_TIMEZONE)
+
+
+def filter_date(timestamp):
+    """
+    The date of timestamp in FILTER_TIMEZONE.
+    """
+    
+    tz = get_filter_timezone()
+    if tz is None:
+        return datetime.date.fromtimestamp(timestamp)
+    if tz == 'UTC':
+        return datetime.datetime.utcfromtimestamp(timestamp).date()
+    return datetime.datetime.fromtimestamp(timestamp, tz).date()
+
+
+def filter_date_start(date):
+    """
+    The timestamp of midnight starting date in FILTER_TIMEZONE.
+    """
+    
+    tz = get_filter_timezone()
+    if tz is None:
+        return mktime((date.year, date.month, date.day, 0, 0, 0, 0, 0, -1))
+    midnight = datetime.datetime(date.year, date.month, date.day)
+    if tz != 'UTC':
+        midnight = tz.localize(midnight)
+    return calendar.timegm(midnight.utctimetuple())
+
+
+def get_filterdate_range(filterDate, now=None):
+    """
+    The timestamps (start, end) matched by filterDate (today, past7days,
+    thismonth or thisyear, s. filter.html), computed once so that files
+    can be filtered by comparing their mtime. None without a filter,
+    an empty range for unknown filters.
+    """
+    
+    if not filterDate:
+        return None
+    if now is None:
+        now = time()
+    if filterDate == 'past7days':
+        return (now - 604800, float('inf'))
+    if filterDate == 'thismonth':
+        return (now - 2592000, float('inf'))
+    today = filter_date(now)
+    if filterDate == 'today':
+        return (filter_date_start(today), filter_date_start(today + datetime.timedelta(days=1)))
+    if filterDate == 'thisyear':
+        return (filter_date_start(datetime.date(today.year, 1, 1)), filter_date_start(datetime.date(today.year + 1, 1, 1)))
+    return (0, 0)
+
+
+class FrozenDict(dict):
+    """
+    A dict which cannot be changed after it has been created.
+    """
+    
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("%s is immutable" % self.__class__.__name__)
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+
+def freeze(value):
+    """
+    Immutable copy of value: dicts become FrozenDicts, lists tuples.
+    """
+    
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def make_settings_var():
+    """
+    Settings variables used for FileBrowser listing, plus values derived
+    from them (s. get_settings_var).
     """
     
     settings_var = {}
@@ -230,7 +468,31 @@ def get_settings_var():
     settings_var['CONVERT_FILENAME'] = CONVERT_FILENAME
     # Use or not Uploadify
     settings_var['USE_UPLOADIFY'] = USE_UPLOADIFY
-    return settings_var
+    # Derived: {extension: filetype} (the last filetype listing an
+    # extension wins, like before) and {format: filetypes} of SELECT_FORMATS
+    extension_types = {}
+    for k,v in EXTENSIONS.iteritems():
+        for extension in v:
+            extension_types[extension.lower()] = k
+    settings_var['EXTENSION_TYPES'] = extension_types
+    settings_var['SELECTABLE'] = dict((k, frozenset(v)) for k, v in SELECT_FORMATS.iteritems())
+    return freeze(settings_var)
+
+
+_settings_var = None
+
+def get_settings_var():
+    """
+    Get settings variables used for FileBrowser listing.
+    
+    The variables are an immutable snapshot, computed once
+    (s. also filebrowser.context_processors.settings_var).
+    """
+    
+    global _settings_var
+    if _settings_var is None:
+        _settings_var = make_settings_var()
+    return _settings_var
 
 
 def handle_file_upload(path, file):
@@ -239,7 +501,11 @@ def handle_file_upload(path, file):
     """
     file_path = os.path.join(path, file.name)
     storage = FileSystemStorage(location=MEDIA_ROOT)
+    from filebrowser import usage, image_index
     uploadedfile = storage.save(file_path, file)
+    metadata_cache.invalidate(os.path.join(MEDIA_ROOT, uploadedfile))
+    usage.file_added(os.path.join(MEDIA_ROOT, uploadedfile))
+    image_index.image_added(os.path.join(MEDIA_ROOT, uploadedfile))
     return uploadedfile
 
 
@@ -249,12 +515,7 @@ def get_file_type(filename):
     """
     
     file_extension = os.path.splitext(filename)[1].lower()
-    file_type = ''
-    for k,v in EXTENSIONS.iteritems():
-        for extension in v:
-            if file_extension == extension.lower():
-                file_type = k
-    return file_type
+    return get_settings_var()['EXTENSION_TYPES'].get(file_extension, '')
 
 
 def is_selectable(filename, selecttype):
@@ -271,39 +532,297 @@ def is_selectable(filename, selecttype):
     return select_types
 
 
+def get_exclude_patterns():
+    """
+    Patterns of files hidden from browse and the version_generator command:
+    EXCLUDE plus one pattern per version.
+    """
+    
+    patterns = list(EXCLUDE)
+    for k in VERSIONS:
+        patterns.append(r'_%s.(%s)' % (k, '|'.join(get_version_extensions())))
+    return patterns
+
+
+def required_char(pattern):
+    """
+    The (ASCII) character every match of pattern starts with, None if
+    there is no such literal.
+    """
+    
+    parsed = sre_parse.parse(pattern)
+    if parsed.pattern.flags & sre_constants.SRE_FLAG_IGNORECASE or not len(parsed):
+        return None
+    op, av = parsed[0]
+    if op == sre_constants.LITERAL and av < 128:
+        return chr(av)
+    return None
+
+
+class ExcludeMatcher(object):
+    """
+    Test filenames against a list of patterns (with re.search, like testing
+    each pattern in turn) using one compiled alternation. If every pattern
+    starts with a literal (e.g. the "_" of version names), names without
+    any of these characters are rejected without running the expression.
+    Patterns with backreferences, named groups or inline flags cannot be
+    combined and are tested separately.
+    """
+    
+    uncombinable_re = re.compile(r'\\[1-9]|\(\?P|\(\?[iLmsux]')
+    
+    def __init__(self, patterns):
+        combinable = [p for p in patterns if not self.uncombinable_re.search(p)]
+        self.separate = [re.compile(p) for p in patterns if self.uncombinable_re.search(p)]
+        self.combined = None
+        self.required = None
+        if combinable:
+            self.combined = re.compile('|'.join('(?:%s)' % p for p in combinable))
+            chars = set(required_char(p) for p in combinable)
+            if None not in chars:
+                self.required = ''.join(sorted(chars))
+    
+    def search(self, filename):
+        if self.combined is not None and (self.required is None or [c for c in self.required if c in filename]):
+            if self.combined.search(filename):
+                return True
+        for pattern in self.separate:
+            if pattern.search(filename):
+                return True
+        return False
+
+
+_exclude_matcher = None
+
+def get_exclude_matcher():
+    """
+    The ExcludeMatcher of get_exclude_patterns (compiled on first use).
+    """
+    
+    global _exclude_matcher
+    if _exclude_matcher is None:
+        _exclude_matcher = ExcludeMatcher(get_exclude_patterns())
+    return _exclude_matcher
+
+
+def is_excluded(filename):
+    """
+    True for hidden files and files matching EXCLUDE or a version name.
+    """
+    
+    return filename.startswith('.') or get_exclude_matcher().search(filename)
+
+
 def version_generator(value, version_prefix, force=None):
     """
     Generate Version for an Image.
     value has to be a serverpath relative to MEDIA_ROOT.
+    
+    Only one thread/process generates a given version at a time (lockfile),
+    others wait and reuse the result. The version is written to a temporary
+    file first and then moved into place, so readers never see a partially
+    written image.
     """
     
     # PIL's Error "Suspension not allowed here" work around:
     # s. http://mail.python.org/pipermail/image-sig/1999-August/000816.html
-    if STRICT_PIL:
-        from PIL import ImageFile
-    else:
-        try:
-            from PIL import ImageFile
-        except ImportError:
-            import ImageFile
     ImageFile.MAXBLOCK = IMAGE_MAXBLOCK # default is 64k
     
+    with timed('version_generator'):
+        try:
+            absolute_path = smart_str(os.path.join(MEDIA_ROOT, value))
+            version_path = get_version_path(value, version_prefix)
+            absolute_version_path = smart_str(os.path.join(MEDIA_ROOT, version_path))
+            version_dir, version_filename = os.path.split(absolute_version_path)
+            if not os.path.isdir(version_dir):
+                try:
+                    os.makedirs(version_dir)
+                    os.chmod(version_dir, 0775)
+                except OSError:
+                    # created concurrently
+                    if not os.path.isdir(version_dir):
+                        raise
+                metadata_cache.invalidate(version_dir)
+            lock_path = os.path.join(version_dir, '.%s.lock' % version_filename)
+            lock_token = acquire_version_lock(lock_path, absolute_path, absolute_version_path)
+            if lock_token is None:
+                # generated by somebody else in the meantime
+                return version_path
+            try:
+                with timed('image_open'):
+                    im = Image.open(absolute_path)
+                    im.load()
+                with timed('scale_and_crop'):
+                    version = scale_and_crop(im, VERSIONS[version_prefix]['width'], VERSIONS[version_prefix]['height'], VERSIONS[version_prefix]['opts'])
+                fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(version_filename)[1], prefix='.%s.' % version_filename, dir=version_dir)
+                os.close(fd)
+                try:
+                    with timed('encode'):
+                        save_version(version, tmp_path, version_prefix)
+                    os.chmod(tmp_path, 0666 & ~get_umask())
+                    try:
+                        old_size = os.path.getsize(absolute_version_path)
+                    except OSError:
+                        old_size = None
+                    rename_file(tmp_path, absolute_version_path)
+                except:
+                    if os.path.exists(tmp_path):
+                        os.unlink(tmp_path)
+                    raise
+            finally:
+                release_version_lock(lock_path, lock_token)
+            metadata_cache.invalidate(absolute_version_path)
+            from filebrowser import usage
+            usage.update(absolute_version_path, os.path.getsize(absolute_version_path) - (old_size or 0), old_size is None and 1 or 0)
+            return version_path
+        except:
+            return None
+
+
+def delete_versions(value):
+    """
+    Delete all versions of an Image.
+    value has to be a serverpath relative to MEDIA_ROOT.
+    """
+    
+    from filebrowser import usage
+    for version_prefix in VERSIONS:
+        try:
+            version_path = os.path.join(MEDIA_ROOT, get_version_path(value, version_prefix))
+            size = os.path.getsize(version_path)
+            os.unlink(version_path)
+            metadata_cache.invalidate(version_path)
+            usage.file_removed(version_path, size)
+        except:
+            pass
+
+
+def save_version(im, path, version_prefix):
+    """
+    Encode the version im to path, using the encoder settings of the version.
+    """
+    
+    Image.init()
+    output_format = Image.EXTENSION.get(os.path.splitext(path)[1].lower(), im.format or 'JPEG')
+    if output_format == 'JPEG' and im.mode not in ('RGB', 'L', 'CMYK'):
+        im = im.convert('RGB')
+    elif output_format == 'WEBP' and im.mode not in ('RGB', 'RGBA'):
+        im = im.convert(('A' in im.mode or 'transparency' in im.info) and 'RGBA' or 'RGB')
+    options = get_version_save_options(version_prefix, output_format)
     try:
-        im = Image.open(smart_str(os.path.join(MEDIA_ROOT, value)))
-        version_path = get_version_path(value, version_prefix)
-        absolute_version_path = smart_str(os.path.join(MEDIA_ROOT, version_path))
-        version_dir = os.path.split(absolute_version_path)[0]
-        if not os.path.isdir(version_dir):
-            os.makedirs(version_dir)
-            os.chmod(version_dir, 0775)
-        version = scale_and_crop(im, VERSIONS[version_prefix]['width'], VERSIONS[version_prefix]['height'], VERSIONS[version_prefix]['opts'])
+        im.save(path, output_format, **options)
+    except IOError:
+        # optimized/progressive JPEGs may exceed the encoder buffer (s. IMAGE_MAXBLOCK)
+        if output_format != 'JPEG' or not (options.get('optimize') or options.get('progressive')):
+            raise
+        options.pop('optimize', None)
+        options.pop('progressive', None)
+        im.save(path, output_format, **options)
+
+
+def acquire_version_lock(lock_path, absolute_path, absolute_version_path):
+    """
+    Acquire the lockfile for generating a version.
+    
+    Returns the token written to the lockfile (s. release_version_lock),
+    or None if another thread/process generated an up to date version
+    while we were waiting for the lock.
+    Locks older than VERSION_LOCK_TIMEOUT are considered stale and removed.
+    """
+    
+    token = '%s-%s' % (os.getpid(), uuid.uuid4().hex)
+    waited = False
+    while True:
         try:
-            version.save(absolute_version_path, quality=90, optimize=(os.path.splitext(version_path)[1].lower() != '.gif'))
-        except IOError:
-            version.save(absolute_version_path, quality=90)
-        return version_path
-    except:
-        return None
+            fd = os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0644)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        else:
+            os.write(fd, token)
+            os.close(fd)
+            if waited and version_is_current(absolute_path, absolute_version_path):
+                # the winner finished right before we got the lock
+                release_version_lock(lock_path, token)
+                return None
+            return token
+        waited = True
+        if version_is_current(absolute_path, absolute_version_path):
+            return None
+        try:
+            if os.path.getmtime(lock_path) < time() - VERSION_LOCK_TIMEOUT:
+                os.unlink(lock_path)
+                continue
+        except OSError:
+            # lock has been released
+            continue
+        sleep(0.05)
+
+
+def release_version_lock(lock_path, token):
+    """
+    Remove the lockfile, unless it has been taken over as stale
+    by somebody else (i.e. it does not contain token anymore).
+    """
+    
+    try:
+        f = open(lock_path)
+        try:
+            current = f.read()
+        finally:
+            f.close()
+        if current == token:
+            os.unlink(lock_path)
+    except (IOError, OSError):
+        pass
+
+
+class FileLock(object):
+    """
+    Exclusive (or shared) lock (flock) on the file path, used as context
+    manager. Without fcntl (Windows), nothing is locked.
+    """
+    
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+    
+    def __enter__(self):
+        self.f = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), self.shared and fcntl.LOCK_SH or fcntl.LOCK_EX)
+        return self
+    
+    def __exit__(self, *args):
+        # closing the file releases the lock
+        self.f.close()
+        return False
+
+
+def version_is_current(absolute_path, absolute_version_path):
+    """
+    True if the version exists and is not older than the original.
+    """
+    
+    try:
+        return os.path.getmtime(absolute_version_path) >= os.path.getmtime(absolute_path)
+    except OSError:
+        return False
+
+
+def rename_file(src, dst):
+    """
+    Atomically move src to dst (replacing dst).
+    """
+    
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # Windows does not replace existing files
+        if not os.path.exists(dst):
+            raise
+        os.unlink(dst)
+        os.rename(src, dst)
 
 
 def scale_and_crop(im, width, height, opts):
@@ -0,0 +1,256 @@
+# coding: utf-8
+
+"""
+Index of image dimensions.
+
+The width and height of every image (read from the header) are stored per
+folder in DATA_ROOT/images/<md5 of the folder>.json, together with mtime
+and size of the image, so that browse can filter and sort by dimensions
+without opening the images. The index is filled when images are uploaded,
+by the fb_image_index command and for images missing from the index
+(new or changed) the first time their dimensions are needed.
+"""
+
+# imports
+import os, tempfile, logging
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+# django imports
+from django.utils import simplejson
+from django.utils.encoding import smart_str, force_unicode
+
+# filebrowser imports
+from filebrowser.settings import MEDIA_ROOT, DIRECTORY, DATA_ROOT, EXTENSIONS
+from filebrowser.functions import is_excluded, rename_file, FileLock, Image
+from filebrowser.cache import metadata_cache
+from filebrowser.instrumentation import timed
+
+# attributes of FileObject which need the dimensions for sorting
+DIMENSION_SORTS = ('width', 'height', 'orientation', 'aspect_ratio')
+# relative tolerance of filter_ratio
+RATIO_TOLERANCE = 0.01
+
+logger = logging.getLogger('filebrowser.image_index')
+
+_loaded = {}
+
+
+def get_index_root():
+    return os.path.join(smart_str(DATA_ROOT), 'images')
+
+
+def get_index_path(directory):
+    key = force_unicode(os.path.relpath(smart_str(directory), smart_str(MEDIA_ROOT)))
+    return os.path.join(get_index_root(), md5(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def is_image(filename):
+    return os.path.splitext(filename)[1].lower() in EXTENSIONS['Image']
+
+
+def read_header(path):
+    """
+    (width, height) of the image path, read from the header (None if it
+    cannot be read).
+    """
+
+    try:
+        with timed('image_open'):
+            return Image.open(smart_str(path)).size
+    except:
+        return None
+
+
+def load(directory):
+    """
+    Stored entries of directory: {filename: [mtime, size, width, height]}.
+    Reloaded only if the index file has changed.
+    """
+
+    index_path = get_index_path(directory)
+    try:
+        mtime = os.path.getmtime(index_path)
+    except OSError:
+        return {}
+    if index_path in _loaded and _loaded[index_path][0] == mtime:
+        return _loaded[index_path][1]
+    try:
+        f = open(index_path)
+        try:
+            entries = simplejson.load(f)['images']
+        finally:
+            f.close()
+    except (IOError, ValueError, KeyError):
+        return {}
+    _loaded[index_path] = (mtime, entries)
+    return entries
+
+
+def save(directory, entries):
+    index_root = get_index_root()
+    if not os.path.isdir(index_root):
+        os.makedirs(index_root)
+    fd, tmp_path = tempfile.mkstemp(prefix='.images.', dir=index_root)
+    try:
+        f = os.fdopen(fd, 'w')
+        try:
+            simplejson.dump({'path': force_unicode(os.path.relpath(smart_str(directory), smart_str(MEDIA_ROOT))), 'images': entries}, f)
+        finally:
+            f.close()
+        rename_file(tmp_path, get_index_path(directory))
+    except:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def get_dimensions(directory, filenames, fill=True, pool=None):
+    """
+    {filename: (width, height) or None} for the images filenames within
+    directory (absolute). Entries are valid while mtime and size of the
+    image are unchanged. Missing entries are read from the headers in
+    parallel on pool (default: the request WorkerPool) and stored, if fill is True.
+    """
+
+    entries = load(directory)
+    dimensions = {}
+    missing = []
+    for filename in filenames:
+        st = metadata_cache.stat(os.path.join(directory, filename))
+        if st is None:
+            continue
+        entry = entries.get(force_unicode(filename))
+        if is_current(entry, st):
+            dimensions[filename] = entry[2] is not None and (entry[2], entry[3]) or None
+        elif fill:
+            missing.append((filename, st))
+        else:
+            dimensions[filename] = None
+    if missing:
+        if pool is None:
+            from filebrowser.workers import get_request_pool
+            pool = get_request_pool()
+        sizes = pool.map(lambda item: read_header(os.path.join(directory, item[0])), missing)
+        updates = {}
+        for (filename, st), size in zip(missing, sizes):
+            dimensions[filename] = size
+            updates[force_unicode(filename)] = [st.st_mtime, st.st_size] + list(size or (None, None))
+        update(directory, updates)
+    return dimensions
+
+
+def is_current(entry, st):
+    return bool(entry) and entry[0] == st.st_mtime and entry[1] == st.st_size
+
+
+def update(directory, updates):
+    """
+    Store the entries updates for directory. Entries of images which do
+    not exist anymore are removed. The index is a cache: if it cannot be
+    written (e.g. DATA_ROOT is not writable), a warning is logged.
+    """
+
+    if not updates:
+        return
+    index_root = get_index_root()
+    try:
+        if not os.path.isdir(index_root):
+            os.makedirs(index_root)
+        with FileLock(os.path.join(index_root, '.lock')):
+            entries = dict(load(directory))
+            entries.update(updates)
+            try:
+                names = set(force_unicode(name) for name in os.listdir(smart_str(directory)))
+            except OSError:
+                names = set()
+            save(directory, dict((name, entry) for name, entry in entries.iteritems() if name in names))
+    except (IOError, OSError), e:
+        logger.warning("Storing the image dimensions of %s failed: %s", directory, e)
+
+
+def image_added(path):
+    """
+    Add the image path (absolute) to the index (e.g. after an upload).
+    """
+
+    path = smart_str(path)
+    if not is_image(path):
+        return
+    directory, filename = os.path.split(path)
+    get_dimensions(directory, [filename])
+
+
+def scan_images(pool=None):
+    """
+    Fill the index for all images within DIRECTORY. Returns the number of
+    images read (images with up to date entries are skipped).
+    """
+
+    count = 0
+    root = os.path.join(smart_str(MEDIA_ROOT), smart_str(DIRECTORY))
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        images = [f for f in filenames if is_image(f) and not is_excluded(f)]
+        if not images:
+            continue
+        entries = load(dirpath)
+        for filename in images:
+            if not is_current(entries.get(force_unicode(filename)), metadata_cache.stat(os.path.join(dirpath, filename))):
+                count += 1
+        get_dimensions(dirpath, images, pool=pool)
+    return count
+
+
+class DimensionFilter(object):
+    """
+    Dimension filters of browse, from the query:
+    filter_min_width, filter_min_height (pixels), filter_orientation
+    (Landscape or Portrait) and filter_ratio (width/height, e.g. 1.5 or 16:9).
+    Invalid values are ignored.
+    """
+
+    def __init__(self, query):
+        self.min_width = self._int(query.get('filter_min_width'))
+        self.min_height = self._int(query.get('filter_min_height'))
+        self.orientation = query.get('filter_orientation') in ('Landscape', 'Portrait') and query.get('filter_orientation') or None
+        self.ratio = self._ratio(query.get('filter_ratio'))
+        self.active = bool(self.min_width or self.min_height or self.orientation or self.ratio)
+
+    def _int(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _ratio(self, value):
+        try:
+            if value and ':' in value:
+                width, height = value.split(':', 1)
+                ratio = float(width) / float(height)
+            else:
+                ratio = value and float(value)
+        except (ValueError, ZeroDivisionError):
+            return None
+        # neither 0, negative, inf nor nan
+        return ratio and 0 < ratio < float('inf') and ratio or None
+
+    def match(self, dimensions):
+        """
+        True if the image with dimensions (width, height) passes the
+        filters (images without dimensions never do).
+        """
+        if not dimensions:
+            return False
+        width, height = dimensions
+        if self.min_width and width < self.min_width:
+            return False
+        if self.min_height and height < self.min_height:
+            return False
+        if self.orientation and (width >= height and 'Landscape' or 'Portrait') != self.orientation:
+            return False
+        if self.ratio and (not height or abs(float(width) / height - self.ratio) > self.ratio * RATIO_TOLERANCE):
+            return False
+        return True
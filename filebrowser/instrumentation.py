@@ -0,0 +1,193 @@
+# coding: utf-8
+
+"""
+Opt-in instrumentation (FILEBROWSER_INSTRUMENTATION = True).
+
+Counts and times expensive operations (stat/listdir calls, Image.open,
+scale_and_crop, encode, version_generator) per request, grouped by view
+and template tag. Add 'filebrowser.instrumentation.InstrumentationMiddleware'
+to MIDDLEWARE_CLASSES in order to get a response header, a summary log line
+and the filebrowser_metrics signal for every request.
+"""
+
+# imports
+import threading, logging
+from time import time
+
+# django imports
+from django.dispatch import Signal
+
+# filebrowser imports
+from filebrowser.settings import INSTRUMENTATION, INSTRUMENTATION_HEADER
+
+logger = logging.getLogger('filebrowser.instrumentation')
+
+# sent at the end of every instrumented request
+filebrowser_metrics = Signal(providing_args=["request", "metrics"])
+
+_local = threading.local()
+
+
+class Metrics(object):
+    """
+    Counters and timings of one request: {scope: {operation: [count, seconds]}}.
+    Shared with the worker threads doing work for the request.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+        self.started = time()
+
+    def add(self, scope, operation, seconds):
+        with self.lock:
+            value = self.data.setdefault(scope, {}).setdefault(operation, [0, 0.0])
+            value[0] += 1
+            value[1] += seconds
+
+    def totals(self):
+        """
+        Counters and timings per operation (all scopes).
+        """
+        totals = {}
+        with self.lock:
+            for operations in self.data.values():
+                for operation, (count, seconds) in operations.items():
+                    value = totals.setdefault(operation, [0, 0.0])
+                    value[0] += count
+                    value[1] += seconds
+        return totals
+
+    def as_dict(self):
+        with self.lock:
+            return dict((scope, dict((operation, {'count': count, 'ms': seconds * 1000})
+                for operation, (count, seconds) in operations.items()))
+                for scope, operations in self.data.items())
+
+    def summary(self):
+        """
+        operation=count/milliseconds pairs, e.g. "stat=12/3.1ms;listdir=1/0.2ms".
+        """
+        return ";".join("%s=%d/%.1fms" % (operation, count, seconds * 1000)
+            for operation, (count, seconds) in sorted(self.totals().items()))
+
+
+class NoopTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NOOP = NoopTimer()
+
+
+class Timer(object):
+    def __init__(self, metrics, operation):
+        self.metrics = metrics
+        self.operation = operation
+        self.scope = current_scope()
+
+    def __enter__(self):
+        self.start = time()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.add(self.scope, self.operation, time() - self.start)
+        return False
+
+
+class Scope(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'scopes', None)
+        if stack is None:
+            stack = _local.scopes = []
+        stack.append(self.name)
+        return self
+
+    def __exit__(self, *args):
+        _local.scopes.pop()
+        return False
+
+
+def current():
+    """
+    Metrics of the current request (None if not instrumented).
+    """
+    return getattr(_local, 'metrics', None)
+
+
+def current_scopes():
+    return list(getattr(_local, 'scopes', None) or [])
+
+
+def current_scope():
+    return "/".join(getattr(_local, 'scopes', None) or ['-'])
+
+
+def activate(metrics, scopes=None):
+    """
+    Collect metrics within the current thread.
+    """
+    _local.metrics = metrics
+    _local.scopes = list(scopes or [])
+
+
+def deactivate():
+    _local.metrics = None
+    _local.scopes = []
+
+
+def timed(operation):
+    """
+    Context manager timing operation (a no-op if nothing is collected).
+
+    with timed('image_open'):
+        im = Image.open(path)
+    """
+    if INSTRUMENTATION:
+        metrics = getattr(_local, 'metrics', None)
+        if metrics is not None:
+            return Timer(metrics, operation)
+    return NOOP
+
+
+def scope(name):
+    """
+    Context manager grouping the operations within, e.g. by template tag.
+    """
+    if INSTRUMENTATION:
+        return Scope(name)
+    return NOOP
+
+
+class InstrumentationMiddleware(object):
+    """
+    Collects metrics per request, adds them as a response header
+    (INSTRUMENTATION_HEADER), logs a summary line and sends filebrowser_metrics.
+    """
+
+    def process_request(self, request):
+        if INSTRUMENTATION:
+            activate(Metrics())
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if INSTRUMENTATION and current() is not None:
+            _local.scopes = [getattr(view_func, '__name__', 'view')]
+
+    def process_response(self, request, response):
+        metrics = current()
+        if metrics is None:
+            return response
+        deactivate()
+        summary = metrics.summary()
+        if summary:
+            if INSTRUMENTATION_HEADER:
+                response[INSTRUMENTATION_HEADER] = summary
+            logger.info("%s %s %s %.1fms %s", request.method, request.path, response.status_code,
+                (time() - metrics.started) * 1000, summary)
+        filebrowser_metrics.send(sender=self.__class__, request=request, metrics=metrics)
+        return response
@@ -0,0 +1,55 @@
+# coding: utf-8
+
+"""
+Imports deferred until first use.
+
+PIL is imported the first time an attribute of Image (or ImageFile) is
+accessed, i.e. when an image is actually opened or created. Importing
+the models, fields or URLs, management commands and the startup of
+workers do not pay for it.
+"""
+
+# imports
+from django.utils.importlib import import_module
+
+# filebrowser imports
+from filebrowser.settings import STRICT_PIL
+
+
+class LazyModule(object):
+    """
+    Proxy for the module name, imported on the first attribute access.
+    If the import fails, fallback (if given) is imported instead.
+    """
+
+    def __init__(self, name, fallback=None):
+        self.__dict__['_name'] = name
+        self.__dict__['_fallback'] = fallback
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            try:
+                module = import_module(self._name)
+            except ImportError:
+                if not self._fallback:
+                    raise
+                module = import_module(self._fallback)
+            self.__dict__['_module'] = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __repr__(self):
+        if self._module is None:
+            return "<lazy module '%s'>" % self._name
+        return repr(self._module)
+
+
+# PIL (with STRICT_PIL False, the old standalone PIL is used as a fallback)
+Image = LazyModule('PIL.Image', not STRICT_PIL and 'Image' or None)
+ImageFile = LazyModule('PIL.ImageFile', not STRICT_PIL and 'ImageFile' or None)
@@ -0,0 +1,146 @@
+# coding: utf-8
+
+"""
+Windowed listing of huge folders.
+
+browse creates a FileObject for every entry of a folder in order to filter,
+count and sort them. For folders with more than LIST_WINDOW_THRESHOLD
+entries (and without filters or search) WindowedListing is used instead:
+the entries are counted by name (the counts are kept as long as the
+directory listing is cached, s. MetadataCache.listdir) and FileObjects are
+created only for the slice the Paginator asks for.
+"""
+
+# imports
+import os, heapq, threading
+
+# filebrowser imports
+from filebrowser.settings import EXTENSIONS, LIST_WINDOW_THRESHOLD
+from filebrowser.functions import is_excluded, get_file_type, get_settings_var
+from filebrowser.base import FileObject
+from filebrowser.cache import metadata_cache
+
+# sortings which do not need FileObjects
+WINDOW_SORTS = ('filename_lower', 'date', 'filesize')
+
+_counts = {}
+_lock = threading.Lock()
+
+
+def use_window(dir_list, query, sort_by):
+    """
+    True if browse should list dir_list (sorted by sort_by) with a
+    WindowedListing: huge folders without filters or search.
+    """
+    if not LIST_WINDOW_THRESHOLD or len(dir_list) <= LIST_WINDOW_THRESHOLD or sort_by not in WINDOW_SORTS:
+        return False
+    if query.get('q') or [key for key in query if key.startswith('filter_') and query.get(key)]:
+        return False
+    return True
+
+
+def count_entries(directory, dir_list, select_type=None):
+    """
+    Names (without excluded files), results_var and counter of browse for
+    the listing dir_list of directory, by filetype of the names.
+    Cached as long as dir_list is the cached listing of directory.
+
+    Empty folders are not counted for delete_total (which is only used to
+    decide whether the delete column is shown).
+    """
+
+    key = (directory, select_type)
+    with _lock:
+        cached = _counts.get(key)
+    if cached is not None and cached[0] is dir_list:
+        return cached[1]
+
+    results_var = {'results_total': 0, 'results_current': 0, 'delete_total': 0, 'images_total': 0, 'select_total': 0}
+    counter = dict((k, 0) for k in EXTENSIONS)
+    names = []
+    select_formats = select_type and get_settings_var()['SELECTABLE'].get(select_type)
+    for name in dir_list:
+        if is_excluded(name):
+            continue
+        names.append(name)
+        filetype = get_file_type(name)
+        if filetype:
+            counter[filetype] += 1
+        if filetype == 'Image':
+            results_var['images_total'] += 1
+        if filetype != 'Folder':
+            results_var['delete_total'] += 1
+        if select_formats and filetype in select_formats or not select_type:
+            results_var['select_total'] += 1
+    results_var['results_total'] = results_var['results_current'] = len(names)
+
+    result = (names, results_var, counter)
+    if metadata_cache.enabled:
+        with _lock:
+            if len(_counts) > 100:
+                _counts.clear()
+            _counts[key] = (dir_list, result)
+    return result
+
+
+class WindowedListing(object):
+    """
+    The entries names of directory (absolute) as a lazy sequence of
+    FileObjects for the Paginator: len() is the number of names, slicing
+    creates the FileObjects of the slice only.
+
+    Sorting by filename_lower sorts the names; sorting by date or filesize
+    stats the entries (without creating FileObjects) and selects the entries
+    up to the end of the requested slice with a partial sort.
+    """
+
+    def __init__(self, directory, path, names, sort_by, reverse=False):
+        self.directory = directory
+        self.path = path
+        self.names = names
+        self.sort_by = sort_by
+        self.reverse = reverse
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if stop <= start:
+                return []
+            names = self.get_sorted(stop)[start:stop:step]
+            return [FileObject(os.path.join(self.path, name)) for name in names]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self[index:index + 1][0]
+
+    def sort_key(self):
+        if self.sort_by == 'date':
+            attr = 'st_mtime'
+        else:
+            attr = 'st_size'
+        def key(name):
+            st = metadata_cache.stat(os.path.join(self.directory, name))
+            return st is not None and getattr(st, attr) or 0
+        return key
+
+    def get_sorted(self, stop):
+        """
+        The first stop names in sort order.
+        """
+        if self._sorted is not None and len(self._sorted) >= stop:
+            return self._sorted
+        # descending like sort_by_attr and reverse: equal keys in reverse order
+        if self.sort_by == 'filename_lower' and self.reverse:
+            self._sorted = sorted(reversed(self.names), key=lambda name: name.lower(), reverse=True)
+        elif self.sort_by == 'filename_lower':
+            self._sorted = sorted(self.names, key=lambda name: name.lower())
+        elif self.reverse:
+            self._sorted = heapq.nlargest(stop, reversed(self.names), key=self.sort_key())
+        else:
+            self._sorted = heapq.nsmallest(stop, self.names, key=self.sort_key())
+        return self._sorted
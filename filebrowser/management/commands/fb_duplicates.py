@@ -0,0 +1,49 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = "Hash the admin thumbnails of all images and report clusters of near-duplicates (requires NumPy)"
+    option_list = BaseCommand.option_list + (
+        make_option('--threshold', type='int', default=None,
+            help='Max. number of differing bits (default: FILEBROWSER_DUPLICATES_THRESHOLD).'),
+        make_option('--threads', type='int', default=0,
+            help='Number of threads loading thumbnails (default: FILEBROWSER_WORKER_THREADS).'),
+        make_option('--no-index', action='store_false', dest='index', default=True,
+            help='Report from the stored hashes without updating them.'),
+        make_option('--limit', type='int', default=20,
+            help='Number of clusters to report (largest first, 0 for all).'),
+        make_option('--json', action='store_true', default=False,
+            help='Output JSON.'),
+    )
+
+    def handle(self, **options):
+        from django.utils import simplejson
+        from django.core.exceptions import ImproperlyConfigured
+        from filebrowser import duplicates
+        from filebrowser.workers import WorkerPool
+        
+        data = None
+        if options['index']:
+            pool = options['threads'] and WorkerPool(max_workers=options['threads']) or None
+            try:
+                data = duplicates.build_index(pool)
+            except ImproperlyConfigured, e:
+                raise CommandError(str(e))
+        threshold = options['threshold']
+        if threshold is None:
+            threshold = duplicates.DUPLICATES_THRESHOLD
+        clusters = duplicates.find_duplicates(threshold, data)
+        if clusters is None:
+            raise CommandError("No hashes stored yet, run without --no-index.")
+        
+        total = len(clusters)
+        if options['limit']:
+            clusters = clusters[:options['limit']]
+        if options['json']:
+            self.stdout.write(simplejson.dumps(clusters, indent=2) + "\n")
+            return
+        for paths in clusters:
+            self.stdout.write("%d images:\n" % len(paths))
+            for path in paths:
+                self.stdout.write("    %s\n" % path)
+        self.stdout.write("%d clusters of near-duplicates.\n" % total)
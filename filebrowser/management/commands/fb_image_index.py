@@ -0,0 +1,17 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = "Read the dimensions of new and changed images within DIRECTORY into the image index"
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', default=0,
+            help='Number of threads reading image headers (default: FILEBROWSER_WORKER_THREADS).'),
+    )
+
+    def handle(self, **options):
+        from filebrowser import image_index
+        from filebrowser.workers import WorkerPool
+        
+        pool = options['threads'] and WorkerPool(max_workers=options['threads']) or None
+        count = image_index.scan_images(pool)
+        self.stdout.write("%d images indexed.\n" % count)
@@ -0,0 +1,39 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = "Scan DIRECTORY (and VERSIONS_BASEDIR) and report disk usage per folder"
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', default=0,
+            help='Number of threads listing directories (default: FILEBROWSER_WORKER_THREADS).'),
+        make_option('--no-scan', action='store_false', dest='scan', default=True,
+            help='Report the stored aggregates without scanning.'),
+        make_option('--limit', type='int', default=20,
+            help='Number of folders to report (largest first, 0 for all).'),
+        make_option('--json', action='store_true', default=False,
+            help='Output JSON.'),
+    )
+
+    def handle(self, **options):
+        from django.utils import simplejson
+        from django.template.defaultfilters import filesizeformat
+        from filebrowser import usage
+        from filebrowser.workers import WorkerPool
+        
+        if options['scan']:
+            pool = options['threads'] and WorkerPool(max_workers=options['threads']) or None
+            data = usage.scan_usage(pool)
+        else:
+            data = usage.get_usage_data()
+            if not data:
+                self.stderr.write("No usage data stored yet, run without --no-scan.\n")
+                return
+        
+        folders = sorted(data['folders'].iteritems(), key=lambda item: item[1][0], reverse=True)
+        if options['limit']:
+            folders = folders[:options['limit']]
+        if options['json']:
+            self.stdout.write(simplejson.dumps([dict(zip(usage.FIELDS, value), path=path) for path, value in folders], indent=2) + "\n")
+            return
+        for path, (size, count, versions_size, versions_count) in folders:
+            self.stdout.write("%10s %8d files %10s in versions  %s\n" % (filesizeformat(size), count, filesizeformat(versions_size), path))
@@ -0,0 +1,32 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = "Report (with --delete: delete) versions of missing originals and retired prefixes (FILEBROWSER_VERSIONS_RETIRED), regenerate outdated versions"
+    option_list = BaseCommand.option_list + (
+        make_option('--delete', action='store_false', dest='dry_run', default=True,
+            help='Delete and regenerate versions (without, only report what would be done).'),
+        make_option('--delete-stale', action='store_false', dest='regenerate_stale', default=True,
+            help='Delete outdated versions instead of regenerating them.'),
+        make_option('--threads', type='int', default=0,
+            help='Number of threads deleting/regenerating versions (default: FILEBROWSER_WORKER_THREADS).'),
+    )
+
+    def handle(self, **options):
+        from django.template.defaultfilters import filesizeformat
+        from filebrowser import version_gc
+        from filebrowser.workers import WorkerPool
+        
+        pool = options['threads'] and WorkerPool(max_workers=options['threads']) or None
+        report = version_gc.collect_garbage(dry_run=options['dry_run'], regenerate_stale=options['regenerate_stale'], pool=pool)
+        
+        if int(options.get('verbosity', 1)) > 1:
+            for version in report['versions']:
+                if 'action' in version:
+                    self.stdout.write("%-10s %-10s %s\n" % (version['action'], version['status'], version['path']))
+        for status in version_gc.STATUSES:
+            self.stdout.write("%-8s %6d versions %10s\n" % (status, report[status]['count'], filesizeformat(report[status]['bytes'])))
+        if report['dry_run']:
+            self.stdout.write("Dry run: %s would be reclaimed (use --delete).\n" % filesizeformat(report['reclaimed']))
+        else:
+            self.stdout.write("%s reclaimed, %d versions regenerated, %d errors.\n" % (filesizeformat(report['reclaimed']), report['regenerated'], report['errors']))
@@ -4,32 +4,18 @@ class Command(NoArgsCommand):
     help = "(Re)Generate versions of Images"
 
     def handle_noargs(self, **options):
-        import os, re
-        from filebrowser.settings import EXTENSION_LIST, EXCLUDE, MEDIA_ROOT, DIRECTORY, VERSIONS, EXTENSIONS
+        import os
+        from filebrowser.settings import MEDIA_ROOT, DIRECTORY, EXTENSIONS
+        from filebrowser.functions import is_excluded
         
-        # Precompile regular expressions
-        filter_re = []
-        for exp in EXCLUDE:
-           filter_re.append(re.compile(exp))
-        for k,v in VERSIONS.iteritems():
-            exp = (r'_%s.(%s)') % (k, '|'.join(EXTENSION_LIST))
-            filter_re.append(re.compile(exp))
-            
         path = os.path.join(MEDIA_ROOT, DIRECTORY)
         
         # walkt throu the filebrowser directory
         # for all/new files (except file versions itself and excludes)
         for dirpath,dirnames,filenames in os.walk(path):
             for filename in filenames:
-                filtered = False
-                # no "hidden" files (stating with ".")
-                if filename.startswith('.'):
-                    continue
-                # check the exclude list
-                for re_prefix in filter_re:
-                    if re_prefix.search(filename):
-                        filtered = True
-                if filtered:
+                # no "hidden" files (stating with "."), check the exclude list
+                if is_excluded(filename):
                     continue
                 (tmp, extension) = os.path.splitext(filename)
                 if extension in EXTENSIONS["Image"]:
@@ -1,20 +1,23 @@
 # coding: utf-8
 
 # imports
-import os
+import os, pkgutil
 
 # django imports
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
+from django.utils.functional import lazy
 
 # settings for django-tinymce
-try:
-    import tinymce.settings
-    DEFAULT_URL_TINYMCE = tinymce.settings.JS_BASE_URL + '/'
-    DEFAULT_PATH_TINYMCE = tinymce.settings.JS_ROOT + '/'
-except ImportError:
-    DEFAULT_URL_TINYMCE = settings.ADMIN_MEDIA_PREFIX + "tinymce/jscripts/tiny_mce/"
-    DEFAULT_PATH_TINYMCE = os.path.join(settings.STATIC_ROOT, 'admin/tinymce/jscripts/tiny_mce/')
+# (imported when the defaults are used, not when the settings are loaded)
+def get_tinymce_defaults():
+    try:
+        import tinymce.settings
+        return tinymce.settings.JS_BASE_URL + '/', tinymce.settings.JS_ROOT + '/'
+    except ImportError:
+        return settings.ADMIN_MEDIA_PREFIX + "tinymce/jscripts/tiny_mce/", os.path.join(settings.STATIC_ROOT, 'admin/tinymce/jscripts/tiny_mce/')
+DEFAULT_URL_TINYMCE = lazy(lambda: get_tinymce_defaults()[0], str)()
+DEFAULT_PATH_TINYMCE = lazy(lambda: get_tinymce_defaults()[1], str)()
 
 # Set to True in order to see the FileObject when Browsing.
 DEBUG = getattr(settings, "FILEBROWSER_DEBUG", False)
@@ -66,6 +69,10 @@ SELECT_FORMATS = getattr(settings, "FILEBROWSER_SELECT_FORMATS", {
 # VERSION URL: VERSIONS_BASEDIR/original_path/originalfilename_versionsuffix.extension
 VERSIONS_BASEDIR = getattr(settings, 'FILEBROWSER_VERSIONS_BASEDIR', '')
 # Versions Format. Available Attributes: verbose_name, width, height, opts
+# Optional encoder settings: format (output format, e.g. 'webp' or 'jpeg'),
+# quality (JPEG/WebP), optimize (JPEG/PNG), progressive (JPEG),
+# subsampling (JPEG, 0=4:4:4, 1=4:2:2, 2=4:2:0), compress_level (PNG, 0-9),
+# lossless and method (WebP).
 VERSIONS = getattr(settings, "FILEBROWSER_VERSIONS", {
     'fb_thumb': {'verbose_name': 'Admin Thumbnail', 'width': 60, 'height': 60, 'opts': 'crop upscale'},
     'thumbnail': {'verbose_name': 'Thumbnail (140px)', 'width': 140, 'height': '', 'opts': ''},
@@ -75,12 +82,33 @@ VERSIONS = getattr(settings, "FILEBROWSER_VERSIONS", {
     'cropped': {'verbose_name': 'Cropped (60x60px)', 'width': 60, 'height': 60, 'opts': 'crop'},
     'croppedthumbnail': {'verbose_name': 'Cropped Thumbnail (140x140px)', 'width': 140, 'height': 140, 'opts': 'crop'},
 })
+# Prefixes of versions which have been removed from VERSIONS. Existing
+# versions with these prefixes are deleted by "fb_version_gc --delete".
+VERSIONS_RETIRED = getattr(settings, 'FILEBROWSER_VERSIONS_RETIRED', [])
+# Default quality for JPEG/WebP versions.
+VERSION_QUALITY = getattr(settings, 'FILEBROWSER_VERSION_QUALITY', 90)
+# Extensions used for versions with an output format.
+VERSION_FORMAT_EXTENSIONS = getattr(settings, 'FILEBROWSER_VERSION_FORMAT_EXTENSIONS', {
+    'jpeg': '.jpg',
+    'png': '.png',
+    'gif': '.gif',
+    'webp': '.webp',
+})
 # Versions available within the Admin-Interface.
 ADMIN_VERSIONS = getattr(settings, 'FILEBROWSER_ADMIN_VERSIONS', ['thumbnail','small', 'medium','big'])
 # Which Version should be used as Admin-thumbnail.
 ADMIN_THUMBNAIL = getattr(settings, 'FILEBROWSER_ADMIN_THUMBNAIL', 'fb_thumb')
 # Preview Version
 PREVIEW_VERSION = getattr(settings, 'FILEBROWSER_PREVIEW_VERSION', 'small')
+# Versions generated in the background right after an upload.
+# If "Use Image Generator" is checked, ADMIN_VERSIONS are generated as well.
+UPLOAD_VERSIONS = getattr(settings, 'FILEBROWSER_UPLOAD_VERSIONS', [ADMIN_THUMBNAIL, PREVIEW_VERSION])
+# Do not generate versions while rendering templates. If a version is missing
+# or outdated, the version tags return the URL of a view which generates the
+# version on the first request and redirects to it.
+VERSIONS_ON_DEMAND = getattr(settings, 'FILEBROWSER_VERSIONS_ON_DEMAND', False)
+# Seconds after which a lock for generating a version is considered stale.
+VERSION_LOCK_TIMEOUT = getattr(settings, 'FILEBROWSER_VERSION_LOCK_TIMEOUT', 30)
 
 # EXTRA SETTINGS
 # True to save the URL including MEDIA_URL to your model fields
@@ -98,22 +126,91 @@ EXTENSION_LIST = []
 for exts in EXTENSIONS.values():
     EXTENSION_LIST += exts
 EXCLUDE = getattr(settings, 'FILEBROWSER_EXCLUDE', (r'_(%(exts)s)_.*_q\d{1,3}\.(%(exts)s)' % {'exts': ('|'.join(EXTENSION_LIST))},))
+# Timezone of the date filters (today, this year): None for the local
+# time of the server process (TIME_ZONE), 'UTC' or another name (requires pytz).
+FILTER_TIMEZONE = getattr(settings, "FILEBROWSER_FILTER_TIMEZONE", None)
 # Max. Upload Size in Bytes.
 MAX_UPLOAD_SIZE = getattr(settings, "FILEBROWSER_MAX_UPLOAD_SIZE", 10485760)
+# Directory for data of the FileBrowser (staged chunked uploads, indexes).
+# Must not be served by the web server, i.e. keep it outside of MEDIA_ROOT.
+# Default is a hidden folder next to MEDIA_ROOT.
+DATA_ROOT = getattr(settings, "FILEBROWSER_DATA_ROOT", os.path.join(os.path.dirname(os.path.normpath(MEDIA_ROOT)), '.filebrowser'))
+# Chunk size in Bytes suggested to clients of the chunked upload.
+CHUNKED_UPLOAD_CHUNK_SIZE = getattr(settings, "FILEBROWSER_CHUNKED_UPLOAD_CHUNK_SIZE", 4*1024*1024)
+# Seconds after which incomplete chunked uploads are removed.
+CHUNKED_UPLOAD_EXPIRY = getattr(settings, "FILEBROWSER_CHUNKED_UPLOAD_EXPIRY", 24*60*60)
+# Perceptual hash used for near-duplicate detection (requires NumPy):
+# 'dct' (robust against scaling and compression) or 'average' (faster).
+DUPLICATES_HASH = getattr(settings, "FILEBROWSER_DUPLICATES_HASH", 'dct')
+# Max. number of differing bits (of 64) for images to count as near-duplicates.
+DUPLICATES_THRESHOLD = getattr(settings, "FILEBROWSER_DUPLICATES_THRESHOLD", 6)
+# Number of thumbnails loaded and hashed at once.
+DUPLICATES_BATCH_SIZE = getattr(settings, "FILEBROWSER_DUPLICATES_BATCH_SIZE", 256)
+# Max. size in Bytes of files which can be edited (None for no limit).
+EDIT_MAX_SIZE = getattr(settings, "FILEBROWSER_EDIT_MAX_SIZE", 1048576)
+# Chunk size used for reading and saving edited files.
+EDIT_CHUNK_SIZE = getattr(settings, "FILEBROWSER_EDIT_CHUNK_SIZE", 65536)
 # Convert Filename (replace spaces and convert to lowercase)
 CONVERT_FILENAME = getattr(settings, "FILEBROWSER_CONVERT_FILENAME", True)
 # Max. Entries per Page
 # Loading a Sever-Directory with lots of files might take a while
 # Use this setting to limit the items shown
 LIST_PER_PAGE = getattr(settings, "FILEBROWSER_LIST_PER_PAGE", 50)
+# Folders with more entries are listed page by page (FileObjects are only
+# created for the current page), if there is no filter or search and
+# the sorting is by date, filesize or filename. None disables the window.
+LIST_WINDOW_THRESHOLD = getattr(settings, "FILEBROWSER_LIST_WINDOW_THRESHOLD", 5000)
 # Default Sorting
 # Options: date, filesize, filename_lower, filetype_checked
 DEFAULT_SORTING_BY = getattr(settings, "FILEBROWSER_DEFAULT_SORTING_BY", "date")
 # Sorting Order: asc, desc
 DEFAULT_SORTING_ORDER = getattr(settings, "FILEBROWSER_DEFAULT_SORTING_ORDER", "desc")
+# Seconds the user of a session is cached for Flash uploads
+# (s. decorators.flash_login_required). 0 disables the cache.
+FLASH_SESSION_CACHE_TIMEOUT = getattr(settings, "FILEBROWSER_FLASH_SESSION_CACHE_TIMEOUT", 60)
 # regex to clean dir names before creation
 FOLDER_REGEX = getattr(settings, "FILEBROWSER_FOLDER_REGEX", r'^(?u)^[\s\w./-]+$')
 
+# METADATA CACHE
+# Cache directory listings and stat results (useful if MEDIA_ROOT is on NFS).
+# Time to live in seconds. 0 disables the cache, None means entries never expire.
+# Changes made with the FileBrowser are invalidated immediately.
+CACHE_TTL = getattr(settings, "FILEBROWSER_CACHE_TTL", 0)
+# Max. number of cached listings/stat results (least recently used are dropped first).
+CACHE_MAX_ENTRIES = getattr(settings, "FILEBROWSER_CACHE_MAX_ENTRIES", 10000)
+# Watch DIRECTORY (and VERSIONS_BASEDIR) for changes made outside of the FileBrowser
+# (inotify on Linux, polling otherwise) and invalidate the cache accordingly.
+# With a watcher running, FILEBROWSER_CACHE_TTL may be set to None.
+WATCH_FILESYSTEM = getattr(settings, "FILEBROWSER_WATCH_FILESYSTEM", False)
+# Polling interval in seconds (only used if inotify is not available).
+WATCH_POLL_INTERVAL = getattr(settings, "FILEBROWSER_WATCH_POLL_INTERVAL", 5)
+
+# WORKERS
+# Number of threads (per process) used for generating versions.
+WORKER_THREADS = getattr(settings, "FILEBROWSER_WORKER_THREADS", 2)
+# Max. number of queued tasks. Versions which do not fit into the queue
+# are generated when they are displayed for the first time.
+WORKER_QUEUE_SIZE = getattr(settings, "FILEBROWSER_WORKER_QUEUE_SIZE", 100)
+
+# SERVING
+# Serve originals and versions with the FileBrowser (staff only), e.g. if
+# MEDIA_ROOT is not public. URL: reverse('fb_serve', args=[path relative to MEDIA_ROOT])
+SERVE = getattr(settings, "FILEBROWSER_SERVE", False)
+# Let the web server deliver the file: None (stream with Django),
+# 'x-sendfile' (Apache mod_xsendfile, lighttpd) or 'x-accel-redirect' (nginx).
+SERVE_SENDFILE = getattr(settings, "FILEBROWSER_SERVE_SENDFILE", None)
+# Internal nginx location which maps to MEDIA_ROOT (used with 'x-accel-redirect').
+SERVE_ACCEL_PREFIX = getattr(settings, "FILEBROWSER_SERVE_ACCEL_PREFIX", "/protected/")
+# Chunk size in bytes when streaming with Django.
+SERVE_CHUNK_SIZE = getattr(settings, "FILEBROWSER_SERVE_CHUNK_SIZE", 64*1024)
+
+# INSTRUMENTATION
+# Count and time filesystem calls and image operations per request
+# (s. filebrowser/instrumentation.py, requires InstrumentationMiddleware).
+INSTRUMENTATION = getattr(settings, "FILEBROWSER_INSTRUMENTATION", False)
+# Response header with the metrics of a request (None to disable).
+INSTRUMENTATION_HEADER = getattr(settings, "FILEBROWSER_INSTRUMENTATION_HEADER", "X-FileBrowser-Metrics")
+
 # EXTRA TRANSLATION STRINGS
 # The following strings are not availabe within views or templates
 _('Folder')
@@ -124,8 +221,10 @@ _('Audio')
 _('Code')
 
 # use django-uploadify
+# (only checks whether it is installed, it is imported with the upload views)
 USE_UPLOADIFY = getattr(settings, 'FILEBROWSER_USE_UPLOADIFY', True)
 try:
-    import uploadify
+    if USE_UPLOADIFY and pkgutil.find_loader('uploadify') is None:
+        USE_UPLOADIFY = False
 except:
     USE_UPLOADIFY = False
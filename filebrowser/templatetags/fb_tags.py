@@ -6,7 +6,7 @@ from django.utils.encoding import smart_unicode
 from django.utils.safestring import mark_safe
 
 # filebrowser imports
-from filebrowser.settings import SELECT_FORMATS
+from filebrowser.functions import get_settings_var
 
 register = template.Library()
 
@@ -118,10 +118,8 @@ class SelectableNode(template.Node):
             format = self.format.resolve(context)
         except template.VariableDoesNotExist:
             format = ''
-        if filetype and format and filetype in SELECT_FORMATS[format]:
-            selectable = True
-        elif filetype and format and filetype not in SELECT_FORMATS[format]:
-            selectable = False
+        if filetype and format:
+            selectable = filetype in get_settings_var()['SELECTABLE'][format]
         else:
             selectable = True
         context['selectable'] = selectable
@@ -8,15 +8,78 @@ from time import gmtime
 from django.template import Library, Node, Variable, VariableDoesNotExist, TemplateSyntaxError
 from django.conf import settings
 from django.utils.encoding import force_unicode, smart_str
+from django.core.urlresolvers import reverse
 
 # filebrowser imports
-from filebrowser.settings import MEDIA_ROOT, MEDIA_URL, VERSIONS
+from filebrowser.settings import MEDIA_ROOT, MEDIA_URL, VERSIONS, VERSIONS_ON_DEMAND
 from filebrowser.functions import url_to_path, path_to_url, get_version_path, version_generator
 from filebrowser.base import FileObject
+from filebrowser.cache import metadata_cache
+from filebrowser.bulk import resolve_versions
+from filebrowser.instrumentation import scope
 
 register = Library()
 
 
+def get_current_version_path(source, version_prefix):
+    """
+    Get the PATH of an up to date version of source (an URL).
+    The version is (re)generated if it does not exist or if the
+    original image was updated.
+    """
+    
+    source_path = url_to_path(source)
+    version_path = find_current_version_path(source_path, version_prefix)
+    if version_path is not None:
+        return version_path
+    version_path = get_version_path(source_path, version_prefix)
+    if not metadata_cache.isfile(os.path.join(MEDIA_ROOT, version_path)):
+        # create version
+        version_path = version_generator(source_path, version_prefix)
+    else:
+        # recreate version if original image was updated
+        version_path = version_generator(source_path, version_prefix, force=True)
+    if version_path:
+        metadata_cache.set_version(os.path.join(MEDIA_ROOT, source_path), version_prefix, os.path.join(MEDIA_ROOT, version_path))
+    return version_path
+
+
+def find_current_version_path(source_path, version_prefix):
+    """
+    Get the PATH of the version of source_path (a PATH relative to MEDIA_ROOT)
+    if it exists and is up to date, None otherwise. Nothing is generated.
+    """
+    
+    abs_source_path = os.path.join(MEDIA_ROOT, source_path)
+    version_path = metadata_cache.get_version(abs_source_path, version_prefix)
+    if version_path is not None:
+        return version_path
+    version_path = get_version_path(source_path, version_prefix)
+    if version_path is None:
+        return None
+    abs_version_path = os.path.join(MEDIA_ROOT, version_path)
+    if not metadata_cache.isfile(abs_version_path) or metadata_cache.getmtime(abs_source_path) > metadata_cache.getmtime(abs_version_path):
+        return None
+    metadata_cache.set_version(abs_source_path, version_prefix, abs_version_path)
+    return version_path
+
+
+def get_version_url(source, version_prefix):
+    """
+    Get the URL of a version of source (an URL) without generating it
+    (s. VERSIONS_ON_DEMAND): the URL of the version if it is up to date,
+    the URL of the version endpoint (fb_version) otherwise.
+    """
+    
+    source_path = url_to_path(source)
+    version_path = find_current_version_path(source_path, version_prefix)
+    if version_path:
+        return path_to_url(version_path)
+    if not metadata_cache.isfile(os.path.join(MEDIA_ROOT, source_path)):
+        return ""
+    return reverse("fb_version", args=[version_prefix, source_path])
+
+
 class VersionNode(Node):
     def __init__(self, src, version_prefix):
         self.src = Variable(src)
@@ -38,18 +101,16 @@ class VersionNode(Node):
                 version_prefix = self.version_prefix_var.resolve(context)
             except VariableDoesNotExist:
                 return None
-        try:
-            source = force_unicode(source)
-            version_path = get_version_path(url_to_path(source), version_prefix)
-            if not os.path.isfile(smart_str(os.path.join(MEDIA_ROOT, version_path))):
-                # create version
-                version_path = version_generator(url_to_path(source), version_prefix)
-            elif os.path.getmtime(smart_str(os.path.join(MEDIA_ROOT, url_to_path(source)))) > os.path.getmtime(smart_str(os.path.join(MEDIA_ROOT, version_path))):
-                # recreate version if original image was updated
-                version_path = version_generator(url_to_path(source), version_prefix, force=True)
-            return path_to_url(version_path)
-        except:
-            return ""
+        with scope('version'):
+            try:
+                version_path = isinstance(source, FileObject) and source.prefetched_version(version_prefix)
+                if not version_path:
+                    if VERSIONS_ON_DEMAND:
+                        return get_version_url(force_unicode(source), version_prefix)
+                    version_path = get_current_version_path(force_unicode(source), version_prefix)
+                return path_to_url(version_path)
+            except:
+                return ""
 
 
 def version(parser, token):
@@ -60,6 +121,9 @@ def version(parser, token):
     Use {% version my_image 'medium' %} in order to display the medium-size
     version of an Image stored in a field name my_image.
     
+    With VERSIONS_ON_DEMAND, missing versions are not generated while
+    rendering, the URL of the version endpoint is returned instead.
+    
     version_prefix can be a string or a variable. if version_prefix is a string, use quotes.
     """
     
@@ -94,18 +158,14 @@ class VersionObjectNode(Node):
                 version_prefix = self.version_prefix_var.resolve(context)
             except VariableDoesNotExist:
                 return None
-        try:
-            source = force_unicode(source)
-            version_path = get_version_path(url_to_path(source), version_prefix)
-            if not os.path.isfile(smart_str(os.path.join(MEDIA_ROOT, version_path))):
-                # create version
-                version_path = version_generator(url_to_path(source), version_prefix)
-            elif os.path.getmtime(smart_str(os.path.join(MEDIA_ROOT, url_to_path(source)))) > os.path.getmtime(smart_str(os.path.join(MEDIA_ROOT, version_path))):
-                # recreate version if original image was updated
-                version_path = version_generator(url_to_path(source), version_prefix, force=True)
-            context[self.var_name] = FileObject(version_path)
-        except:
-            context[self.var_name] = ""
+        with scope('version_object'):
+            try:
+                version_path = isinstance(source, FileObject) and source.prefetched_version(version_prefix)
+                if not version_path:
+                    version_path = get_current_version_path(force_unicode(source), version_prefix)
+                context[self.var_name] = FileObject(version_path)
+            except:
+                context[self.var_name] = ""
         return ''
 
 
@@ -170,8 +230,67 @@ def version_setting(parser, token):
     return VersionSettingNode(version_prefix)
 
 
+class VersionListNode(Node):
+    def __init__(self, sources, version_prefix, var_name):
+        self.sources = Variable(sources)
+        self.var_name = var_name
+        if (version_prefix[0] == version_prefix[-1] and version_prefix[0] in ('"', "'")):
+            self.version_prefix = version_prefix[1:-1]
+        else:
+            self.version_prefix = None
+            self.version_prefix_var = Variable(version_prefix)
+    
+    def render(self, context):
+        try:
+            sources = self.sources.resolve(context)
+        except VariableDoesNotExist:
+            return ''
+        if self.version_prefix:
+            version_prefix = self.version_prefix
+        else:
+            try:
+                version_prefix = self.version_prefix_var.resolve(context)
+            except VariableDoesNotExist:
+                return ''
+        with scope('version_list'):
+            try:
+                versions = resolve_versions(list(sources), version_prefix, generate=not VERSIONS_ON_DEMAND)
+                if VERSIONS_ON_DEMAND:
+                    for item in versions:
+                        if item['missing'] and not item['url']:
+                            item['url'] = reverse("fb_version", args=[version_prefix, item['fileobject'].path])
+                context[self.var_name] = versions
+            except:
+                context[self.var_name] = []
+        return ''
+
+
+def version_list(parser, token):
+    """
+    Resolve a version for a list of Images at once.
+    {% version_list sources version_prefix as var %}
+    
+    Use {% version_list object_list 'thumbnail' as thumbs %} and then
+    {% for thumb in thumbs %}{{ thumb.url }}{% endfor %}. Every item has
+    the keys source, fileobject, url, missing and generated.
+    Missing versions are generated in parallel before the loop renders
+    (with VERSIONS_ON_DEMAND, url is the URL of the version endpoint instead).
+    
+    version_prefix can be a string or a variable. if version_prefix is a string, use quotes.
+    """
+    
+    bits = token.split_contents()
+    if len(bits) != 5 or bits[3] != 'as':
+        raise TemplateSyntaxError, "%s tag requires the arguments: sources version_prefix as var" % bits[0]
+    tag, sources, version_prefix, as_, var_name = bits
+    if (version_prefix[0] == version_prefix[-1] and version_prefix[0] in ('"', "'")) and version_prefix.lower()[1:-1] not in VERSIONS:
+        raise TemplateSyntaxError, "%s tag received bad version_prefix %s" % (tag, version_prefix)
+    return VersionListNode(sources, version_prefix, var_name)
+
+
 register.tag(version)
 register.tag(version_object)
 register.tag(version_setting)
+register.tag(version_list)
 
 
@@ -17,6 +17,7 @@ from django.dispatch import Signal
 from filebrowser.settings import *
 from filebrowser.templatetags.fb_tags import query_helper
 from filebrowser.functions import get_path, get_settings_var, convert_filename, handle_file_upload
+from filebrowser.workers import generate_versions, get_upload_versions
 
 # upload signals
 filebrowser_pre_upload = Signal(providing_args=["path", "file"])
@@ -39,6 +40,8 @@ def file_process(request):
         filebrowser_pre_upload.send(sender=request, path=abs_path, file=f)
         # HANDLE UPLOAD
         uploadedfile = handle_file_upload(abs_path, f)
+        # GENERATE VERSIONS (IN THE BACKGROUND)
+        generate_versions(uploadedfile, get_upload_versions(form.cleaned_data.get('use_image_generator')))
         # POST UPLOAD SIGNAL
         filebrowser_post_upload.send(sender=request, path=abs_path, file=uploadedfile)
     else:
@@ -71,9 +74,15 @@ def upload(request):
 upload = staff_member_required(never_cache(upload))
 
 # Uploadify handler
-from uploadify.views import upload_received
 def uploadify_received_handler(sender, request, data, **kwargs):
     if (sender=='filebrowser'):
         return file_process(request)
-upload_received.connect(uploadify_received_handler)
+
+def connect_uploadify():
+    """
+    Connect the handler to django-uploadify (s. urls).
+    django-uploadify is imported here, not when this module is imported.
+    """
+    from uploadify.views import upload_received
+    upload_received.connect(uploadify_received_handler, dispatch_uid='filebrowser.uploadify_views')
 
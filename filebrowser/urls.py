@@ -1,15 +1,36 @@
 from django.conf.urls.defaults import *
 
+from filebrowser.settings import WATCH_FILESYSTEM, USE_UPLOADIFY
+
+# live invalidation of the metadata cache
+if WATCH_FILESYSTEM:
+    from filebrowser.watcher import start_watcher
+    start_watcher()
+
+# uploads with django-uploadify (imported only if installed and enabled)
+if USE_UPLOADIFY:
+    from filebrowser.uploadify_views import connect_uploadify
+    connect_uploadify()
+
 urlpatterns = patterns('',
     
     # filebrowser urls
     url(r'^browse/$', 'filebrowser.views.browse', name="fb_browse"),
     url(r'^mkdir/', 'filebrowser.views.mkdir', name="fb_mkdir"),
     url(r'^upload/', 'filebrowser.views.upload', name="fb_upload"),
+    url(r'^upload_multiple/', 'filebrowser.views.upload_multiple', name="fb_upload_multiple"),
+    url(r'^upload_chunked/$', 'filebrowser.views.upload_chunked_start', name="fb_upload_chunked_start"),
+    url(r'^upload_chunked/(?P<upload_id>[0-9a-f]{32})/$', 'filebrowser.views.upload_chunked', name="fb_upload_chunked"),
+    url(r'^upload_chunked/(?P<upload_id>[0-9a-f]{32})/complete/$', 'filebrowser.views.upload_chunked_complete', name="fb_upload_chunked_complete"),
+    url(r'^upload_chunked/(?P<upload_id>[0-9a-f]{32})/abort/$', 'filebrowser.views.upload_chunked_abort', name="fb_upload_chunked_abort"),
     url(r'^upload_flash/', 'filebrowser.uploadify_views.upload', name="fb_upload_flash"),
     url(r'^edit/$', 'filebrowser.views.edit', name="fb_edit"),
     url(r'^rename/$', 'filebrowser.views.rename', name="fb_rename"),
     url(r'^delete/$', 'filebrowser.views.delete', name="fb_delete"),
     url(r'^versions/$', 'filebrowser.views.versions', name="fb_versions"),
+    url(r'^usage/$', 'filebrowser.views.usage_report', name="fb_usage"),
+    url(r'^duplicates/$', 'filebrowser.views.duplicates_report', name="fb_duplicates"),
+    url(r'^serve/(?P<path>.+)$', 'filebrowser.views.serve', name="fb_serve"),
+    url(r'^version/(?P<version_prefix>[^/]+)/(?P<path>.+)$', 'filebrowser.views.version', name="fb_version"),
     
 )
@@ -0,0 +1,375 @@
+# coding: utf-8
+
+"""
+Disk usage report.
+
+scan_usage() computes the recursive size and number of files for every
+folder within DIRECTORY (and VERSIONS_BASEDIR), listing directories in
+parallel on the WorkerPool. The aggregates are stored in DATA_ROOT/usage.json
+and updated incrementally when files are uploaded, deleted or versions are
+generated, so that folder sizes can be shown without walking the tree.
+
+Changes are not written to usage.json right away: they are appended to
+DATA_ROOT/usage.journal (one line each, under a shared lock, so that
+parallel version generation does not wait). get_usage_data() folds the
+journal into the aggregates and compacts it into usage.json once it has
+grown beyond JOURNAL_COMPACT_SIZE. A scan compacts the journal first;
+changes journaled during the scan are applied on top of its results.
+"""
+
+# imports
+import os, re, stat, tempfile, threading
+from time import time
+
+# django imports
+from django.utils import simplejson
+from django.utils.encoding import smart_str, force_unicode
+
+# filebrowser imports
+from filebrowser.settings import MEDIA_ROOT, DATA_ROOT, VERSIONS_BASEDIR, VERSIONS
+from filebrowser.functions import rename_file, FileLock
+from filebrowser.watcher import get_watch_roots
+
+# size, count, versions_size, versions_count
+FIELDS = ('size', 'count', 'versions_size', 'versions_count')
+version_re = re.compile(r'_(%s)\.[^.]+$' % '|'.join(re.escape(smart_str(k)) for k in VERSIONS))
+
+# seconds between checks for changes of usage.json made by other processes
+RELOAD_INTERVAL = 1
+# size in Bytes of the journal which is compacted into usage.json
+JOURNAL_COMPACT_SIZE = 256*1024
+
+# journal: inode of the journal read up to offset
+_store = {'data': None, 'mtime': None, 'journal': None, 'offset': 0, 'checked': 0}
+# guards _store (never acquired while waiting for the FileLock)
+_lock = threading.Lock()
+
+
+def get_store_path():
+    return os.path.join(smart_str(DATA_ROOT), 'usage.json')
+
+
+def get_journal_path():
+    return os.path.join(smart_str(DATA_ROOT), 'usage.journal')
+
+
+def get_lock_path():
+    return os.path.join(smart_str(DATA_ROOT), 'usage.lock')
+
+
+def relative(path):
+    """
+    path relative to MEDIA_ROOT (unicode, as the keys of usage.json).
+    """
+    return force_unicode(os.path.relpath(smart_str(path), smart_str(MEDIA_ROOT)))
+
+
+def is_version(path):
+    if VERSIONS_BASEDIR and (relative(path) + os.sep).startswith(os.path.normpath(force_unicode(VERSIONS_BASEDIR)) + os.sep):
+        return True
+    return bool(version_re.search(os.path.basename(smart_str(path))))
+
+
+def scan_directory(path):
+    """
+    Size and number of the files (and versions) directly within path,
+    plus the subdirectories of path. Hidden files are skipped.
+    """
+
+    totals = [0, 0, 0, 0]
+    directories = []
+    for name in os.listdir(path):
+        if name.startswith('.'):
+            continue
+        full_path = os.path.join(path, name)
+        try:
+            st = os.lstat(full_path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            directories.append(full_path)
+        elif stat.S_ISREG(st.st_mode):
+            totals[0] += st.st_size
+            totals[1] += 1
+            if is_version(full_path):
+                totals[2] += st.st_size
+                totals[3] += 1
+    return totals, directories
+
+
+def scan_usage(pool=None):
+    """
+    Scan the FileBrowser directories and store the aggregates.
+    Directories are listed in parallel on pool (default: the WorkerPool).
+    Returns the stored data.
+    """
+
+    if pool is None:
+        from filebrowser.workers import get_pool
+        pool = get_pool()
+    if os.path.exists(get_store_path()):
+        # changes journaled so far are covered by the scan
+        compact()
+    roots = get_watch_roots()
+    direct = {}
+    frontier = [root for root in roots if os.path.isdir(root)]
+    while frontier:
+        next_frontier = []
+        for path, result in zip(frontier, pool.map(scan_directory, frontier)):
+            if result is None:
+                continue
+            direct[path] = result[0]
+            next_frontier.extend(result[1])
+        frontier = next_frontier
+
+    # ADD UP FROM THE DEEPEST FOLDERS
+    totals = dict((path, list(value)) for path, value in direct.iteritems())
+    for path in sorted(totals, key=lambda path: path.count(os.sep), reverse=True):
+        parent = os.path.dirname(path)
+        if path not in roots and parent in totals:
+            totals[parent] = [a + b for a, b in zip(totals[parent], totals[path])]
+
+    data = {
+        'roots': [relative(root) for root in roots],
+        'folders': dict((relative(path), value) for path, value in totals.iteritems()),
+        'scanned': time(),
+    }
+    if not os.path.isdir(smart_str(DATA_ROOT)):
+        os.makedirs(smart_str(DATA_ROOT))
+    with FileLock(get_lock_path()):
+        save(data)
+    set_store(data)
+    return data
+
+
+def save(data):
+    fd, tmp_path = tempfile.mkstemp(prefix='.usage.', dir=smart_str(DATA_ROOT))
+    f = os.fdopen(fd, 'w')
+    try:
+        simplejson.dump(data, f)
+    finally:
+        f.close()
+    rename_file(tmp_path, get_store_path())
+
+
+def set_store(data):
+    """
+    Use data (just saved) as the aggregates of this process, the journal
+    is read from the start.
+    """
+
+    with _lock:
+        _store.update(data=dict(data, folders=dict(data['folders'])), mtime=os.path.getmtime(get_store_path()),
+            journal=None, offset=0, checked=0)
+
+
+def load():
+    try:
+        f = open(get_store_path())
+    except IOError:
+        return None
+    try:
+        return simplejson.load(f)
+    finally:
+        f.close()
+
+
+def remove_journal():
+    """
+    Remove the journal after it has been folded into usage.json
+    (with the lock held exclusively).
+    """
+
+    try:
+        os.unlink(get_journal_path())
+    except OSError:
+        pass
+
+
+def append(entry):
+    """
+    Append entry to the journal. Appends of other threads and processes
+    share the lock, they only wait for compact().
+    """
+
+    line = simplejson.dumps(entry) + '\n'
+    with FileLock(get_lock_path(), shared=True):
+        fd = os.open(get_journal_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0600)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    # read by the next get_usage_data() of this process
+    with _lock:
+        _store['checked'] = 0
+
+
+def read_journal(offset=0):
+    """
+    The complete entries of the journal from offset on, the inode of the
+    journal and the offset after the last complete entry.
+    """
+
+    try:
+        f = open(get_journal_path(), 'rb')
+    except IOError:
+        return [], None, 0
+    try:
+        inode = os.fstat(f.fileno()).st_ino
+        f.seek(offset)
+        content = f.read()
+    finally:
+        f.close()
+    # an entry being appended right now is read next time
+    end = content.rfind('\n') + 1
+    return [simplejson.loads(line) for line in content[:end].splitlines() if line], inode, offset + end
+
+
+def apply_entry(data, entry):
+    """
+    Apply a journal entry to data: ['update', folder, delta] adds delta to
+    the folder and all parent folders, ['move', old, new] moves the
+    aggregates of the folder old and its subfolders to new (or drops them).
+    """
+
+    if entry[0] == 'update':
+        folder, delta = entry[1:]
+        roots = [root for root in data['roots'] if root == '.' or (folder + os.sep).startswith(root + os.sep)]
+        if not roots:
+            return
+        root = max(roots, key=len)
+        while True:
+            value = data['folders'].setdefault(folder, [0, 0, 0, 0])
+            data['folders'][folder] = [max(a + b, 0) for a, b in zip(value, delta)]
+            if folder == root or not folder:
+                break
+            folder = os.path.dirname(folder) or '.'
+    elif entry[0] == 'move':
+        old, new = entry[1:]
+        for folder in data['folders'].keys():
+            if folder == old or folder.startswith(old + os.sep):
+                value = data['folders'].pop(folder)
+                if new is not None:
+                    data['folders'][new + folder[len(old):]] = value
+
+
+def compact():
+    """
+    Fold the journal into usage.json.
+    """
+
+    with FileLock(get_lock_path()):
+        data = load()
+        if not data:
+            return
+        for entry in read_journal()[0]:
+            apply_entry(data, entry)
+        save(data)
+        remove_journal()
+    set_store(data)
+
+
+def refresh():
+    """
+    Reload usage.json if it was changed by another process and apply the
+    changes journaled since (with _lock held). True if the journal is due
+    for compaction.
+    """
+
+    if time() - _store['checked'] <= RELOAD_INTERVAL:
+        return False
+    compact_journal = False
+    try:
+        mtime = os.path.getmtime(get_store_path())
+    except OSError:
+        mtime = None
+    if mtime != _store['mtime']:
+        _store.update(data=mtime and load(), mtime=mtime, journal=None, offset=0)
+    if _store['data']:
+        entries, inode, offset = read_journal(_store['offset'])
+        if _store['journal'] not in (None, inode):
+            # compacted by another process, reload next time
+            _store['mtime'] = None
+        else:
+            for entry in entries:
+                apply_entry(_store['data'], entry)
+            _store.update(journal=inode, offset=offset)
+            compact_journal = offset > JOURNAL_COMPACT_SIZE
+    _store['checked'] = time()
+    return compact_journal
+
+
+def get_usage_data():
+    """
+    A snapshot of the stored aggregates including the changes journaled
+    since (None without a scan).
+    """
+
+    with _lock:
+        compact_journal = refresh()
+        data = _store['data']
+        data = data and dict(data, folders=dict(data['folders']))
+    if compact_journal:
+        compact()
+    return data
+
+
+def get_usage(path):
+    """
+    Usage of the folder path (relative to MEDIA_ROOT) as a dict with the
+    keys size, count, versions_size and versions_count, None if unknown.
+    """
+
+    with _lock:
+        compact_journal = refresh()
+        value = _store['data'] and _store['data']['folders'].get(os.path.normpath(force_unicode(path)))
+    if compact_journal:
+        compact()
+    if value is None:
+        return None
+    return dict(zip(FIELDS, value))
+
+
+def update(path, size_delta, count_delta):
+    """
+    Apply a change of the file path (absolute) to its folder and all
+    parent folders. Nothing happens before the first scan.
+    """
+
+    if not os.path.exists(get_store_path()) or not (size_delta or count_delta):
+        return
+    delta = [size_delta, count_delta, 0, 0]
+    if is_version(path):
+        delta[2:] = delta[:2]
+    append(['update', os.path.dirname(relative(path)) or '.', delta])
+
+
+def file_added(path, size=None):
+    if size is None:
+        try:
+            size = os.path.getsize(smart_str(path))
+        except OSError:
+            return
+    update(path, size, 1)
+
+
+def file_removed(path, size):
+    update(path, -size, -1)
+
+
+def folder_renamed(path, new_path):
+    """
+    Move the aggregates of the folder path (and its subfolders) to new_path.
+    """
+
+    move_folders(relative(path), relative(new_path))
+
+
+def folder_removed(path):
+    move_folders(relative(path), None)
+
+
+def move_folders(old, new):
+    if not os.path.exists(get_store_path()):
+        return
+    append(['move', old, new])
@@ -0,0 +1,191 @@
+# coding: utf-8
+
+"""
+Garbage collection of versions.
+
+find_versions() classifies every version file as
+- orphaned: the original does not exist anymore (next to the originals,
+  i.e. without VERSIONS_BASEDIR, only for prefixes of VERSIONS: browse
+  hides these files as versions, too),
+- retired: the version prefix is listed in VERSIONS_RETIRED (removed from VERSIONS),
+- stale: the original is newer than the version,
+- current: everything else.
+collect_garbage() deletes orphaned and retired versions and regenerates
+(or deletes) stale ones on the WorkerPool.
+"""
+
+# imports
+import os, re
+
+# django imports
+from django.utils.encoding import smart_str, force_unicode
+
+# filebrowser imports
+from filebrowser.settings import MEDIA_ROOT, DIRECTORY, VERSIONS_BASEDIR, VERSIONS, VERSIONS_RETIRED, EXTENSIONS, VERSION_FORMAT_EXTENSIONS
+from filebrowser.functions import get_version_extension, version_generator
+from filebrowser.cache import metadata_cache
+from filebrowser import usage
+
+STATUSES = ('orphaned', 'retired', 'stale', 'current')
+
+
+def get_version_re():
+    prefixes = sorted(set(list(VERSIONS) + list(VERSIONS_RETIRED)), key=len, reverse=True)
+    return re.compile(r'^(?P<name>.+)_(?P<prefix>%s)(?P<ext>\.[^.]+)$' % '|'.join(re.escape(smart_str(p)) for p in prefixes))
+
+
+def get_versions_root():
+    return os.path.normpath(os.path.join(smart_str(MEDIA_ROOT), smart_str(VERSIONS_BASEDIR or DIRECTORY)))
+
+
+def get_source_dir(version_dir):
+    """
+    Directory of the originals of the versions within version_dir.
+    """
+    if not VERSIONS_BASEDIR:
+        return version_dir
+    basedir = os.path.normpath(os.path.join(smart_str(MEDIA_ROOT), smart_str(VERSIONS_BASEDIR)))
+    return os.path.normpath(os.path.join(smart_str(MEDIA_ROOT), os.path.relpath(version_dir, basedir)))
+
+
+def index_images(names):
+    """
+    The images within names by stem (name without extension).
+    """
+    index = {}
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in EXTENSIONS['Image']:
+            index.setdefault(stem, []).append(name)
+    return index
+
+
+def find_source(index, name, prefix, ext):
+    """
+    The original (within index, s. index_images) of the version
+    name_prefix.ext, or None.
+    """
+    for candidate in index.get(name, ()):
+        if prefix not in VERSIONS or get_version_extension(os.path.splitext(candidate)[1], prefix) == ext:
+            return candidate
+    return None
+
+
+def is_version_output(prefix, ext):
+    """
+    True if a version with prefix can have the extension ext.
+    """
+    if prefix in VERSIONS:
+        extensions = [get_version_extension(e, prefix) for e in EXTENSIONS['Image']]
+    else:
+        extensions = list(EXTENSIONS['Image']) + VERSION_FORMAT_EXTENSIONS.values()
+    return ext.lower() in extensions
+
+
+def find_versions():
+    """
+    All version files with their status. Returns a list of dicts with the
+    keys path (absolute), source (absolute, None if missing), prefix,
+    size and status.
+    """
+
+    version_re = get_version_re()
+    indexes = {}
+    def get_index(path):
+        if path not in indexes:
+            try:
+                indexes[path] = index_images(os.listdir(path))
+            except OSError:
+                indexes[path] = {}
+        return indexes[path]
+
+    versions = []
+    for dirpath, dirnames, filenames in os.walk(get_versions_root()):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        source_dir = get_source_dir(dirpath)
+        for filename in filenames:
+            m = version_re.match(filename)
+            if m is None or not is_version_output(m.group('prefix'), m.group('ext')):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            name, prefix, ext = m.group('name'), m.group('prefix'), m.group('ext')
+            source = find_source(get_index(source_dir), name, prefix, ext)
+            source = source and os.path.join(source_dir, source)
+            if source is None and not VERSIONS_BASEDIR and prefix not in VERSIONS:
+                # not necessarily a version
+                continue
+            elif source is None:
+                status = 'orphaned'
+            elif prefix not in VERSIONS:
+                status = 'retired'
+            else:
+                try:
+                    status = os.path.getmtime(source) > st.st_mtime and 'stale' or 'current'
+                except OSError:
+                    source, status = None, 'orphaned'
+            versions.append({'path': path, 'source': source, 'prefix': prefix, 'size': st.st_size, 'status': status})
+    return versions
+
+
+def delete_version(version):
+    os.unlink(version['path'])
+    metadata_cache.invalidate(version['path'])
+    usage.file_removed(version['path'], version['size'])
+    return True
+
+
+def regenerate_version(version):
+    source = force_unicode(os.path.relpath(version['source'], smart_str(MEDIA_ROOT)))
+    return bool(version_generator(source, version['prefix']))
+
+
+def collect_garbage(dry_run=True, regenerate_stale=True, pool=None):
+    """
+    Delete orphaned and retired versions, regenerate stale versions (or
+    delete them if regenerate_stale is False). With dry_run (default),
+    nothing is changed. Work is done in parallel on pool (default: the WorkerPool).
+
+    Returns a report: count and bytes per status, the number of bytes
+    reclaimed (or to be reclaimed), the number of regenerated versions,
+    the number of failed actions and the versions (s. find_versions).
+    """
+
+    versions = find_versions()
+    report = dict((status, {'count': 0, 'bytes': 0}) for status in STATUSES)
+    deletions, regenerations = [], []
+    for version in versions:
+        report[version['status']]['count'] += 1
+        report[version['status']]['bytes'] += version['size']
+        if version['status'] in ('orphaned', 'retired') or (version['status'] == 'stale' and not regenerate_stale):
+            version['action'] = 'delete'
+            deletions.append(version)
+        elif version['status'] == 'stale':
+            version['action'] = 'regenerate'
+            regenerations.append(version)
+    report.update({
+        'versions': versions,
+        'dry_run': dry_run,
+        'reclaimed': sum(version['size'] for version in deletions),
+        'regenerated': 0,
+        'errors': 0,
+    })
+    if dry_run or not (deletions or regenerations):
+        return report
+
+    if pool is None:
+        from filebrowser.workers import get_pool
+        pool = get_pool()
+    results = pool.map(delete_version, deletions)
+    for version, result in zip(deletions, results):
+        if not result:
+            # failed (e.g. removed in the meantime)
+            report['reclaimed'] -= version['size']
+            report['errors'] += 1
+    results = pool.map(regenerate_version, regenerations)
+    report['regenerated'] = len([result for result in results if result])
+    report['errors'] += len(results) - report['regenerated']
+    return report
@@ -1,13 +1,13 @@
 # coding: utf-8
 
 # general imports
-import os, re
+import os, re, mimetypes, datetime
 from time import gmtime, strftime
 
 # django imports
 from django.shortcuts import render_to_response, HttpResponse
 from django.template import RequestContext as Context
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, HttpResponseNotModified, Http404
 from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.cache import never_cache
 from django.utils.translation import ugettext as _
@@ -18,6 +18,10 @@ from django.core.exceptions import ImproperlyConfigured
 from django.dispatch import Signal
 from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from django.utils.encoding import smart_str
+from django.utils import simplejson
+from django.views.decorators.http import require_POST
+from django.utils.http import http_date, parse_etags, urlquote
+from django.views.static import was_modified_since
 
 try:
     # django SVN
@@ -28,18 +32,16 @@ except:
 
 # filebrowser imports
 from filebrowser.settings import *
-from filebrowser.functions import path_to_url, sort_by_attr, get_path, get_file, get_version_path, get_breadcrumbs, get_filterdate, get_settings_var, handle_file_upload, convert_filename
+from filebrowser.functions import path_to_url, sort_by_attr, get_path, get_file, get_breadcrumbs, get_filterdate_range, get_settings_var, handle_file_upload, convert_filename, get_file_type, delete_versions, get_serve_path, parse_range, file_iterator, is_excluded
 from filebrowser.templatetags.fb_tags import query_helper
+from filebrowser.templatetags.fb_versions import get_current_version_path
 from filebrowser.base import FileObject
+from filebrowser.cache import metadata_cache, stat_path
+from filebrowser.bulk import resolve_versions
+from filebrowser.listing import WindowedListing, use_window, count_entries
+from filebrowser.workers import generate_versions, get_upload_versions
 from filebrowser.decorators import flash_login_required
-
-# Precompile regular expressions
-filter_re = []
-for exp in EXCLUDE:
-   filter_re.append(re.compile(exp))
-for k,v in VERSIONS.iteritems():
-    exp = (r'_%s.(%s)') % (k, '|'.join(EXTENSION_LIST))
-    filter_re.append(re.compile(exp))
+from filebrowser.lazy import ImageFile
 
 
 def browse(request):
@@ -47,6 +49,8 @@ def browse(request):
     Browse Files/Directories.
     """
     
+    from filebrowser import image_index
+    
     # QUERY / PATH CHECK
     query = request.GET.copy()
     path = get_path(query.get('dir', ''))
@@ -67,60 +71,78 @@ def browse(request):
     for k,v in EXTENSIONS.iteritems():
         counter[k] = 0
     
-    dir_list = os.listdir(abs_path)
-    files = []
-    for file in dir_list:
+    dir_list = metadata_cache.listdir(abs_path)
+    
+    # DIMENSIONS FOR FILTERING/SORTING FROM THE IMAGE INDEX (NO IMAGES ARE OPENED)
+    dimension_filter = image_index.DimensionFilter(request.GET)
+    dimensions = None
+    if dimension_filter.active or request.GET.get('o') in image_index.DIMENSION_SORTS:
+        dimensions = image_index.get_dimensions(abs_path, [f for f in dir_list if image_index.is_image(f) and not is_excluded(f)])
+    
+    # DATE FILTER: ONE RANGE OF TIMESTAMPS PER REQUEST
+    date_range = get_filterdate_range(request.GET.get('filter_date', ''))
+    
+    # SORTING
+    query['o'] = request.GET.get('o', DEFAULT_SORTING_BY)
+    query['ot'] = request.GET.get('ot', DEFAULT_SORTING_ORDER)
+    sort_by = request.GET.get('o', DEFAULT_SORTING_BY)
+    sort_reverse = not request.GET.get('ot') and DEFAULT_SORTING_ORDER == "desc" or request.GET.get('ot') == "desc"
+    
+    if use_window(dir_list, request.GET, sort_by):
+        # HUGE FOLDER: COUNT BY NAME, FILEOBJECTS FOR THE CURRENT PAGE ONLY
+        names, results_var, counter = count_entries(abs_path, dir_list, query.get('type'))
+        files = WindowedListing(abs_path, os.path.join(DIRECTORY, path), names, sort_by, sort_reverse)
+    else:
+        files = []
+        for file in dir_list:
         
-        # EXCLUDE FILES MATCHING VERSIONS_PREFIX OR ANY OF THE EXCLUDE PATTERNS
-        filtered = file.startswith('.')
-        for re_prefix in filter_re:
-            if re_prefix.search(file):
-                filtered = True
-        if filtered:
-            continue
-        results_var['results_total'] += 1
+            # EXCLUDE FILES MATCHING VERSIONS_PREFIX OR ANY OF THE EXCLUDE PATTERNS
+            if is_excluded(file):
+                continue
+            results_var['results_total'] += 1
         
-        # CREATE FILEOBJECT
-        fileobject = FileObject(os.path.join(DIRECTORY, path, file))
+            # CREATE FILEOBJECT
+            fileobject = FileObject(os.path.join(DIRECTORY, path, file))
+            if dimensions is not None and fileobject.filetype == 'Image':
+                fileobject._prefetched = {'dimensions': dimensions.get(file)}
         
-        # FILTER / SEARCH
-        append = False
-        if fileobject.filetype == request.GET.get('filter_type', fileobject.filetype) and get_filterdate(request.GET.get('filter_date', ''), fileobject.date):
-            append = True
-        if request.GET.get('q') and not re.compile(request.GET.get('q').lower(), re.M).search(file.lower()):
+            # FILTER / SEARCH
             append = False
+            if fileobject.filetype == request.GET.get('filter_type', fileobject.filetype) and (date_range is None or date_range[0] <= fileobject.date < date_range[1]):
+                append = True
+            if request.GET.get('q') and not re.compile(request.GET.get('q').lower(), re.M).search(file.lower()):
+                append = False
+            if dimension_filter.active and not (fileobject.filetype == 'Image' and dimension_filter.match(fileobject.dimensions)):
+                append = False
         
-        # APPEND FILE_LIST
-        if append:
-            try:
-                # COUNTER/RESULTS
-                if fileobject.filetype == 'Image':
-                    results_var['images_total'] += 1
-                if fileobject.filetype != 'Folder':
-                    results_var['delete_total'] += 1
-                elif fileobject.filetype == 'Folder' and fileobject.is_empty:
-                    results_var['delete_total'] += 1
-                if query.get('type') and query.get('type') in SELECT_FORMATS and fileobject.filetype in SELECT_FORMATS[query.get('type')]:
-                    results_var['select_total'] += 1
-                elif not query.get('type'):
-                    results_var['select_total'] += 1
-            except OSError:
-                # Ignore items that have problems
-                continue
-            else:
-                files.append(fileobject)
-                results_var['results_current'] += 1
+            # APPEND FILE_LIST
+            if append:
+                try:
+                    # COUNTER/RESULTS
+                    if fileobject.filetype == 'Image':
+                        results_var['images_total'] += 1
+                    if fileobject.filetype != 'Folder':
+                        results_var['delete_total'] += 1
+                    elif fileobject.filetype == 'Folder' and fileobject.is_empty:
+                        results_var['delete_total'] += 1
+                    if query.get('type') and query.get('type') in SELECT_FORMATS and fileobject.filetype in SELECT_FORMATS[query.get('type')]:
+                        results_var['select_total'] += 1
+                    elif not query.get('type'):
+                        results_var['select_total'] += 1
+                except OSError:
+                    # Ignore items that have problems
+                    continue
+                else:
+                    files.append(fileobject)
+                    results_var['results_current'] += 1
         
-        # COUNTER/RESULTS
-        if fileobject.filetype:
-            counter[fileobject.filetype] += 1
-    
-    # SORTING
-    query['o'] = request.GET.get('o', DEFAULT_SORTING_BY)
-    query['ot'] = request.GET.get('ot', DEFAULT_SORTING_ORDER)
-    files = sort_by_attr(files, request.GET.get('o', DEFAULT_SORTING_BY))
-    if not request.GET.get('ot') and DEFAULT_SORTING_ORDER == "desc" or request.GET.get('ot') == "desc":
-        files.reverse()
+            # COUNTER/RESULTS
+            if fileobject.filetype:
+                counter[fileobject.filetype] += 1
+        
+        files = sort_by_attr(files, sort_by)
+        if sort_reverse:
+            files.reverse()
     
     p = Paginator(files, LIST_PER_PAGE)
     try:
@@ -132,6 +154,17 @@ def browse(request):
     except (EmptyPage, InvalidPage):
         page = p.page(p.num_pages)
     
+    # DIMENSIONS OF THE CURRENT PAGE FROM THE IMAGE INDEX
+    if dimensions is None:
+        page_images = [f for f in page.object_list if f.filetype == 'Image']
+        if page_images:
+            dimensions = image_index.get_dimensions(abs_path, [f.filename for f in page_images])
+            for fileobject in page_images:
+                fileobject._prefetched = {'dimensions': dimensions.get(fileobject.filename)}
+    
+    # THUMBNAILS OF THE CURRENT PAGE: RESOLVE AT ONCE, GENERATE MISSING IN PARALLEL
+    resolve_versions(page.object_list, ADMIN_THUMBNAIL, generate=not VERSIONS_ON_DEMAND)
+    
     return render_to_response('filebrowser/index.html', {
         'dir': path,
         'p': p,
@@ -176,6 +209,7 @@ def mkdir(request):
                 # CREATE FOLDER
                 os.mkdir(server_path)
                 os.chmod(server_path, 0775)
+                metadata_cache.invalidate(server_path)
                 # POST CREATE SIGNAL
                 filebrowser_post_createdir.send(sender=request, path=path, dirname=form.cleaned_data['dir_name'])
                 # MESSAGE & REDIRECT
@@ -222,14 +256,6 @@ def upload(request):
         return HttpResponseRedirect(reverse("fb_browse"))
     abs_path = os.path.join(MEDIA_ROOT, DIRECTORY, path)
 
-    if STRICT_PIL:
-        from PIL import ImageFile
-    else:
-        try:
-            from PIL import ImageFile
-        except ImportError:
-            import ImageFile
-
     ImageFile.MAXBLOCK = IMAGE_MAXBLOCK # default is 64k
 
     from filebrowser.forms import UploadForm, BaseUploadFormSet
@@ -246,6 +272,8 @@ def upload(request):
                     filebrowser_pre_upload.send(sender=request, path=abs_path, file=f)
                     # HANDLE UPLOAD
                     uploadedfile = handle_file_upload(abs_path, f)
+                    # GENERATE VERSIONS (IN THE BACKGROUND)
+                    generate_versions(uploadedfile, get_upload_versions(cleaned_data.get('use_image_generator')))
                     # POST UPLOAD SIGNAL
                     filebrowser_post_upload.send(sender=request, path=abs_path, file=uploadedfile)
             # MESSAGE & REDIRECT
@@ -268,6 +296,202 @@ def upload(request):
 upload = staff_member_required(never_cache(upload))
 
 
+def json_response(data, status=200):
+    return HttpResponse(simplejson.dumps(data), status=status, content_type='application/json')
+
+
+def upload_multiple(request):
+    """
+    Upload any number of files (POST field "file") with one request.
+    
+    All names are checked against one snapshot of the directory, versions
+    of the uploaded images are generated in the background. Files which
+    do not validate are skipped. Returns JSON with the uploaded files
+    (path relative to MEDIA_ROOT and url) and the errors per file.
+    """
+    
+    from filebrowser.forms import check_upload
+    
+    # QUERY / PATH CHECK
+    query = request.GET
+    path = get_path(query.get('dir', ''))
+    if path is None:
+        return json_response({'errors': {'': [_('The requested Folder does not exist.')]}}, status=404)
+    abs_path = os.path.join(MEDIA_ROOT, DIRECTORY, path)
+    
+    # VALIDATE ALL FILES AGAINST ONE SNAPSHOT OF THE DIRECTORY
+    dir_list = set(metadata_cache.listdir(abs_path))
+    files, errors = [], {}
+    for f in request.FILES.getlist('file'):
+        f.name = convert_filename(f.name)
+        try:
+            check_upload(f.name, f.size, dir_list)
+        except forms.ValidationError, e:
+            errors.setdefault(f.name, []).extend(e.messages)
+            continue
+        # names have to be unique within the batch as well
+        dir_list.add(f.name)
+        files.append(f)
+    
+    # the files are already on disk (or in memory, if small), s. FILE_UPLOAD_HANDLERS
+    version_prefixes = get_upload_versions(request.POST.get('use_image_generator') in ('1', 'true', 'on'))
+    uploaded = []
+    for f in files:
+        # PRE UPLOAD SIGNAL
+        filebrowser_pre_upload.send(sender=request, path=abs_path, file=f)
+        # HANDLE UPLOAD
+        uploadedfile = handle_file_upload(abs_path, f)
+        # GENERATE VERSIONS (IN THE BACKGROUND)
+        generate_versions(uploadedfile, version_prefixes)
+        # POST UPLOAD SIGNAL
+        filebrowser_post_upload.send(sender=request, path=abs_path, file=uploadedfile)
+        relative_path = os.path.relpath(smart_str(uploadedfile), smart_str(MEDIA_ROOT))
+        uploaded.append({'path': relative_path, 'url': path_to_url(relative_path)})
+    
+    return json_response({'uploaded': uploaded, 'errors': errors}, status=(uploaded or not errors) and 200 or 400)
+upload_multiple = staff_member_required(never_cache(require_POST(upload_multiple)))
+
+
+def upload_chunked_start(request):
+    """
+    Start a resumable chunked upload (POST filename, size and optionally
+    use_image_generator). The file is checked up front like with UploadForm.
+    
+    Protocol: PUT the chunks to fb_upload_chunked with ?offset=<byte offset>
+    (in any order, failed chunks can be sent again), GET fb_upload_chunked
+    for the received byte ranges, finally POST to fb_upload_chunked_complete
+    (or fb_upload_chunked_abort).
+    """
+    
+    from filebrowser.forms import check_upload
+    from filebrowser.chunked import ChunkedUpload, cleanup_chunked_uploads
+    
+    # QUERY / PATH CHECK
+    query = request.GET
+    path = get_path(query.get('dir', ''))
+    if path is None:
+        return json_response({'errors': [_('The requested Folder does not exist.')]}, status=404)
+    abs_path = os.path.join(MEDIA_ROOT, DIRECTORY, path)
+    
+    filename = convert_filename(request.POST.get('filename', ''))
+    try:
+        size = int(request.POST.get('size', ''))
+        if size < 0:
+            raise ValueError
+    except ValueError:
+        return json_response({'errors': [_('Invalid size.')]}, status=400)
+    try:
+        check_upload(filename, size, metadata_cache.listdir(abs_path))
+    except forms.ValidationError, e:
+        return json_response({'errors': e.messages}, status=400)
+    
+    cleanup_chunked_uploads()
+    upload = ChunkedUpload.create(os.path.join(DIRECTORY, path), filename, size, request.user.pk,
+        request.POST.get('use_image_generator') in ('1', 'true', 'on'))
+    return json_response(dict(upload.status(), chunk_size=CHUNKED_UPLOAD_CHUNK_SIZE))
+upload_chunked_start = staff_member_required(never_cache(require_POST(upload_chunked_start)))
+
+
+def get_chunked_upload(request, upload_id):
+    from filebrowser.chunked import ChunkedUpload
+    upload = ChunkedUpload.get(upload_id)
+    if upload is None or upload.meta['user'] != request.user.pk:
+        raise Http404
+    return upload
+
+
+def upload_chunked(request, upload_id):
+    """
+    GET: status of a chunked upload, PUT: a chunk (?offset=<byte offset>).
+    """
+    
+    from filebrowser.chunked import ChunkedUploadError
+    
+    upload = get_chunked_upload(request, upload_id)
+    if request.method == 'PUT':
+        try:
+            offset = int(request.GET.get('offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return json_response({'errors': [_('Invalid offset.')]}, status=400)
+        try:
+            upload.write_chunk(offset, request, length)
+        except ChunkedUploadError, e:
+            return json_response(dict(upload.status(), errors=[unicode(e)]), status=400)
+    elif request.method != 'GET':
+        return HttpResponse(status=405)
+    return json_response(upload.status())
+upload_chunked = staff_member_required(never_cache(upload_chunked))
+
+
+def upload_chunked_complete(request, upload_id):
+    """
+    Move a completely received chunked upload into place,
+    sending the upload signals.
+    """
+    
+    from django.core.files import File
+    from filebrowser.forms import check_upload
+    from filebrowser.chunked import ChunkedUploadError
+    from filebrowser import usage, image_index
+    
+    upload = get_chunked_upload(request, upload_id)
+    if not upload.is_complete:
+        return json_response(dict(upload.status(), errors=[_('The upload is incomplete.')]), status=409)
+    try:
+        # another request may be completing the upload at the same time
+        upload.claim()
+    except ChunkedUploadError, e:
+        return json_response(dict(upload.status(), errors=[unicode(e)]), status=409)
+    abs_path = os.path.join(MEDIA_ROOT, upload.meta['path'])
+    try:
+        try:
+            # the directory may have changed in the meantime
+            if not metadata_cache.isdir(abs_path):
+                raise forms.ValidationError(_('The requested Folder does not exist.'))
+            check_upload(upload.meta['filename'], upload.meta['size'], metadata_cache.listdir(abs_path))
+        except forms.ValidationError, e:
+            upload.unclaim()
+            return json_response(dict(upload.status(), errors=e.messages), status=400)
+        
+        # PRE UPLOAD SIGNAL
+        f = File(open(upload.complete_path, 'rb'), name=upload.meta['filename'])
+        try:
+            filebrowser_pre_upload.send(sender=request, path=abs_path, file=f)
+        finally:
+            f.close()
+        # HANDLE UPLOAD
+        uploadedfile = upload.assemble(smart_str(abs_path))
+    except:
+        # not moved into place: the upload can be completed again
+        if os.path.exists(upload.complete_path):
+            upload.unclaim()
+        raise
+    if settings.FILE_UPLOAD_PERMISSIONS is not None:
+        os.chmod(uploadedfile, settings.FILE_UPLOAD_PERMISSIONS)
+    metadata_cache.invalidate(uploadedfile)
+    usage.file_added(uploadedfile)
+    image_index.image_added(uploadedfile)
+    upload.delete()
+    # GENERATE VERSIONS (IN THE BACKGROUND)
+    generate_versions(uploadedfile, get_upload_versions(upload.meta['use_image_generator']))
+    # POST UPLOAD SIGNAL
+    filebrowser_post_upload.send(sender=request, path=abs_path, file=uploadedfile)
+    relative_path = os.path.relpath(uploadedfile, smart_str(MEDIA_ROOT))
+    return json_response({'path': relative_path, 'url': path_to_url(relative_path)})
+upload_chunked_complete = staff_member_required(never_cache(require_POST(upload_chunked_complete)))
+
+
+def upload_chunked_abort(request, upload_id):
+    """
+    Discard a chunked upload.
+    """
+    
+    get_chunked_upload(request, upload_id).delete()
+    return json_response({})
+upload_chunked_abort = staff_member_required(never_cache(require_POST(upload_chunked_abort)))
+
+
 # delete signals
 filebrowser_pre_delete = Signal(providing_args=["path", "filename"])
 filebrowser_post_delete = Signal(providing_args=["path", "filename"])
@@ -279,6 +503,8 @@ def delete(request):
     When trying to delete a Directory, the Directory has to be empty.
     """
     
+    from filebrowser import usage
+    
     # QUERY / PATH CHECK
     query = request.GET
     path = get_path(query.get('dir', ''))
@@ -299,13 +525,12 @@ def delete(request):
                 # PRE DELETE SIGNAL
                 filebrowser_pre_delete.send(sender=request, path=path, filename=filename)
                 # DELETE IMAGE VERSIONS/THUMBNAILS
-                for version in VERSIONS:
-                    try:
-                        os.unlink(os.path.join(MEDIA_ROOT, get_version_path(relative_server_path, version)))
-                    except:
-                        pass
+                delete_versions(relative_server_path)
                 # DELETE FILE
+                size = os.path.getsize(smart_str(os.path.join(abs_path, filename)))
                 os.unlink(smart_str(os.path.join(abs_path, filename)))
+                metadata_cache.invalidate(os.path.join(abs_path, filename))
+                usage.file_removed(os.path.join(abs_path, filename), size)
                 # POST DELETE SIGNAL
                 filebrowser_post_delete.send(sender=request, path=path, filename=filename)
                 # MESSAGE & REDIRECT
@@ -321,6 +546,8 @@ def delete(request):
                 filebrowser_pre_delete.send(sender=request, path=path, filename=filename)
                 # DELETE FOLDER
                 os.rmdir(os.path.join(abs_path, filename))
+                metadata_cache.invalidate_tree(os.path.join(abs_path, filename))
+                usage.folder_removed(os.path.join(abs_path, filename))
                 # POST DELETE SIGNAL
                 filebrowser_post_delete.send(sender=request, path=path, filename=filename)
                 # MESSAGE & REDIRECT
@@ -355,6 +582,8 @@ def rename(request):
     Includes renaming existing Image Versions/Thumbnails.
     """
     
+    from filebrowser import usage
+    
     from filebrowser.forms import RenameForm
     
     # QUERY / PATH CHECK
@@ -381,13 +610,13 @@ def rename(request):
                 filebrowser_pre_rename.send(sender=request, path=path, filename=filename, new_filename=new_filename)
                 # DELETE IMAGE VERSIONS/THUMBNAILS
                 # regenerating versions/thumbs will be done automatically
-                for version in VERSIONS:
-                    try:
-                        os.unlink(os.path.join(MEDIA_ROOT, get_version_path(relative_server_path, version)))
-                    except:
-                        pass
+                delete_versions(relative_server_path)
                 # RENAME ORIGINAL
                 os.rename(os.path.join(MEDIA_ROOT, relative_server_path), os.path.join(MEDIA_ROOT, new_relative_server_path))
+                metadata_cache.invalidate_tree(os.path.join(MEDIA_ROOT, relative_server_path))
+                metadata_cache.invalidate(os.path.join(MEDIA_ROOT, new_relative_server_path))
+                if os.path.isdir(os.path.join(MEDIA_ROOT, new_relative_server_path)):
+                    usage.folder_renamed(os.path.join(MEDIA_ROOT, relative_server_path), os.path.join(MEDIA_ROOT, new_relative_server_path))
                 # POST RENAME SIGNAL
                 filebrowser_post_rename.send(sender=request, path=path, filename=filename, new_filename=new_filename)
                 # MESSAGE & REDIRECT
@@ -437,7 +666,8 @@ def edit(request):
         form = EditForm(abs_path, filename, file_extension, request.POST)
         if form.is_valid():
             try:
-                form.save()
+                if form.save():
+                    metadata_cache.invalidate(os.path.join(abs_path, filename))
                 # MESSAGE & REDIRECT
                 msg = _('Edit action was successful.')
                 
@@ -457,7 +687,7 @@ def edit(request):
         'breadcrumbs': get_breadcrumbs(query, path),
         'breadcrumbs_title': _(u'Edit')
     }, context_instance=Context(request))
-rename = staff_member_required(never_cache(rename))
+edit = staff_member_required(never_cache(edit))
 
 
 def versions(request):
@@ -489,3 +719,161 @@ def versions(request):
 versions = staff_member_required(never_cache(versions))
 
 
+def serve(request, path):
+    """
+    Serve an original or a version (path relative to MEDIA_ROOT).
+    
+    Supports conditional requests (ETag, If-Modified-Since) and single
+    byte ranges. With SERVE_SENDFILE, the file is delivered by the web server.
+    """
+    
+    if not SERVE:
+        raise Http404
+    absolute_path = get_serve_path(path)
+    st = absolute_path and stat_path(absolute_path)
+    if not st:
+        raise Http404
+    etag = '"%x-%x"' % (int(st.st_mtime), st.st_size)
+    last_modified = http_date(st.st_mtime)
+    
+    # CONDITIONAL REQUESTS
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        if if_none_match.strip() == '*' or etag.strip('"') in parse_etags(if_none_match):
+            return not_modified(etag, last_modified)
+    elif not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), int(st.st_mtime), st.st_size):
+        return not_modified(etag, last_modified)
+    
+    content_type = mimetypes.guess_type(absolute_path)[0] or 'application/octet-stream'
+    if SERVE_SENDFILE:
+        # the web server handles ranges
+        response = HttpResponse('', content_type=content_type)
+        if SERVE_SENDFILE == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = urlquote(SERVE_ACCEL_PREFIX + os.path.relpath(absolute_path, smart_str(MEDIA_ROOT)))
+        else:
+            response['X-Sendfile'] = absolute_path
+    else:
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if request.method == 'GET' and (not if_range or if_range in (etag, last_modified)):
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), st.st_size)
+        if byte_range is False:
+            response = HttpResponse('', status=416, content_type=content_type)
+            response['Content-Range'] = 'bytes */%d' % st.st_size
+            return response
+        offset, length = byte_range or (0, st.st_size)
+        if request.method == 'HEAD':
+            response = HttpResponse('', content_type=content_type)
+        else:
+            response = HttpResponse(file_iterator(absolute_path, offset, length, SERVE_CHUNK_SIZE), content_type=content_type)
+        if byte_range:
+            response.status_code = 206
+            response['Content-Range'] = 'bytes %d-%d/%d' % (offset, offset + length - 1, st.st_size)
+        response['Content-Length'] = str(length)
+        response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Cache-Control'] = 'private'
+    return response
+serve = staff_member_required(serve)
+
+
+def version(request, version_prefix, path):
+    """
+    Generate a version on demand (s. VERSIONS_ON_DEMAND) and redirect to it.
+    
+    Concurrent requests for the same version wait for a single generation.
+    """
+    
+    if version_prefix not in VERSIONS or get_file_type(path) != 'Image' or not get_serve_path(path):
+        raise Http404
+    version_path = get_current_version_path(path, version_prefix)
+    if not version_path:
+        raise Http404
+    return HttpResponseRedirect(path_to_url(version_path))
+
+
+def not_modified(etag, last_modified):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
+
+
+def usage_report(request):
+    """
+    Recursive size and number of files per folder (s. filebrowser.usage),
+    largest first. POST rescans the tree.
+    """
+    
+    from filebrowser import usage
+    
+    # QUERY / PATH CHECK
+    query = request.GET
+    path = get_path(query.get('dir', ''))
+    if path is None:
+        return HttpResponseRedirect(reverse("fb_browse"))
+    
+    if request.method == 'POST':
+        from filebrowser.workers import get_request_pool
+        usage.scan_usage(get_request_pool())
+        return HttpResponseRedirect(reverse("fb_usage") + query_helper(query, "", ""))
+    
+    data = usage.get_usage_data()
+    folders = []
+    if data:
+        root = os.path.normpath(os.path.join(DIRECTORY, path))
+        for folder, value in data['folders'].iteritems():
+            if root == '.' or folder == root or folder.startswith(root + os.sep):
+                folders.append(dict(zip(usage.FIELDS, value), path=folder, url=path_to_url(folder)))
+        folders.sort(key=lambda folder: folder['size'], reverse=True)
+    if query.get('format') == 'json':
+        return json_response({'folders': folders, 'scanned': data and data['scanned']})
+    
+    p = Paginator(folders, LIST_PER_PAGE)
+    try:
+        page = p.page(int(request.GET.get('p', '1')))
+    except (ValueError, EmptyPage, InvalidPage):
+        page = p.page(p.num_pages)
+    
+    return render_to_response('filebrowser/usage.html', {
+        'folders': page.object_list,
+        'page': page,
+        'scanned': data and datetime.datetime.fromtimestamp(data['scanned']),
+        'query': query,
+        'title': _(u'Disk usage'),
+        'settings_var': get_settings_var(),
+        'breadcrumbs': get_breadcrumbs(query, path),
+        'breadcrumbs_title': _(u'Disk usage')
+    }, context_instance=Context(request))
+usage_report = staff_member_required(never_cache(usage_report))
+
+
+def duplicates_report(request):
+    """
+    Clusters of near-duplicate images as JSON (s. filebrowser.duplicates).
+    POST updates the hashes first, GET uses the stored ones.
+    """
+    
+    from filebrowser import duplicates
+    
+    try:
+        threshold = int(request.GET.get('threshold', DUPLICATES_THRESHOLD))
+    except ValueError:
+        return json_response({'errors': [_('Invalid threshold.')]}, status=400)
+    
+    try:
+        if request.method == 'POST':
+            data = duplicates.build_index()
+        else:
+            data = duplicates.load()
+        clusters = duplicates.find_duplicates(threshold, data)
+    except ImproperlyConfigured, e:
+        return json_response({'errors': [unicode(e)]}, status=501)
+    return json_response({
+        'clusters': [[{'path': path, 'url': path_to_url(path)} for path in paths] for paths in clusters or []],
+        'indexed': data is not None and len(data['images']),
+        'updated': data and data['updated'],
+        'threshold': threshold,
+    })
+duplicates_report = staff_member_required(never_cache(duplicates_report))
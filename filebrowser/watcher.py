@@ -0,0 +1,240 @@
+# coding: utf-8
+
+# imports
+import os, struct, threading, logging
+from time import sleep
+
+# django imports
+from django.utils.encoding import smart_str
+
+# filebrowser imports
+from filebrowser.settings import MEDIA_ROOT, DIRECTORY, VERSIONS_BASEDIR, WATCH_POLL_INTERVAL
+from filebrowser.cache import metadata_cache
+
+logger = logging.getLogger('filebrowser.watcher')
+
+# inotify constants (s. /usr/include/linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x00080000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def get_watch_roots():
+    """
+    Directories to watch: the FileBrowser directory and
+    (if it is located elsewhere) VERSIONS_BASEDIR.
+    """
+
+    roots = [os.path.normpath(os.path.join(MEDIA_ROOT, DIRECTORY))]
+    if VERSIONS_BASEDIR:
+        versions_root = os.path.normpath(os.path.join(MEDIA_ROOT, VERSIONS_BASEDIR))
+        if not versions_root.startswith(roots[0] + os.sep):
+            roots.append(versions_root)
+    return [smart_str(root) for root in roots]
+
+
+class BaseWatcher(object):
+    """
+    Watches the FileBrowser directories within a daemon thread
+    and invalidates the metadata cache for every changed path.
+    """
+
+    def __init__(self, roots, cache=metadata_cache):
+        self.roots = roots
+        self.cache = cache
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='filebrowser-watcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def changed(self, path, is_dir=False):
+        if is_dir:
+            self.cache.invalidate_tree(path)
+        else:
+            self.cache.invalidate(path)
+
+    def run(self):
+        raise NotImplementedError
+
+
+class InotifyWatcher(BaseWatcher):
+    """
+    Linux inotify watcher (via ctypes).
+    """
+
+    def __init__(self, roots, cache=metadata_cache):
+        import ctypes, ctypes.util
+        super(InotifyWatcher, self).__init__(roots, cache)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.get_errno = ctypes.get_errno
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        # directories which could not be watched are polled instead
+        self.poller = None
+        for root in roots:
+            self.add_tree(root)
+
+    def start(self):
+        super(InotifyWatcher, self).start()
+        if self.poller is not None:
+            self.poller.start()
+
+    def stop(self):
+        super(InotifyWatcher, self).stop()
+        if self.poller is not None:
+            self.poller.stop()
+
+    def add_watch(self, path):
+        """
+        Watch the directory path. Returns False if inotify_add_watch
+        failed (e.g. max_user_watches is exhausted).
+        """
+        wd = self.libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            errno = self.get_errno()
+            logger.error("Watching %s failed (%s), polling it instead.", path, os.strerror(errno))
+            return False
+        self.watches[wd] = path
+        return True
+
+    def add_tree(self, path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            if not self.add_watch(dirpath):
+                # the poller covers the whole subtree
+                dirnames[:] = []
+                self.poll(dirpath)
+
+    def poll(self, path):
+        """
+        Poll the tree path with a PollingWatcher.
+        """
+        if self.poller is None:
+            self.poller = PollingWatcher([path], self.cache)
+            if self.running:
+                self.poller.start()
+        elif path not in self.poller.roots:
+            self.poller.roots.append(path)
+
+    def run(self):
+        while self.running:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except OSError, e:
+                logger.error("Reading inotify events failed: %s", e)
+                self.cache.clear()
+                sleep(WATCH_POLL_INTERVAL)
+                continue
+            self.handle(buf)
+
+    def handle(self, buf):
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, pos)
+            pos += EVENT_HEADER.size
+            name = buf[pos:pos + length].rstrip('\0')
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                # events got lost, start over
+                self.cache.clear()
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self.changed(directory, is_dir=True)
+                continue
+            path = name and os.path.join(directory, name) or directory
+            is_dir = bool(mask & IN_ISDIR)
+            if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+            self.changed(path, is_dir)
+
+
+class PollingWatcher(BaseWatcher):
+    """
+    Pure-Python fallback: compares (mtime, size) of all files and
+    directories every WATCH_POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, roots, cache=metadata_cache, interval=WATCH_POLL_INTERVAL):
+        super(PollingWatcher, self).__init__(roots, cache)
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for root in self.roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                for name in dirnames + filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (st.st_mtime, st.st_size, name in dirnames)
+        return snapshot
+
+    def run(self):
+        while self.running:
+            sleep(self.interval)
+            snapshot = self.scan()
+            for path, value in snapshot.iteritems():
+                if self.snapshot.get(path) != value:
+                    self.changed(path)
+            for path, value in self.snapshot.iteritems():
+                if path not in snapshot:
+                    self.changed(path, is_dir=value[2])
+            self.snapshot = snapshot
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+def start_watcher():
+    """
+    Start watching the FileBrowser directories (once per process).
+    Uses inotify if available, polling otherwise.
+    """
+
+    global _watcher
+    with _watcher_lock:
+        if _watcher is not None:
+            return _watcher
+        roots = [root for root in get_watch_roots() if os.path.isdir(root)]
+        try:
+            _watcher = InotifyWatcher(roots)
+        except (OSError, AttributeError), e:
+            logger.info("inotify not available (%s), falling back to polling.", e)
+            _watcher = PollingWatcher(roots)
+        _watcher.start()
+        return _watcher
+
+
+def get_watcher():
+    return _watcher
+
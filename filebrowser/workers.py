@@ -0,0 +1,193 @@
+# coding: utf-8
+
+# imports
+import os, sys, threading, logging, Queue
+
+# django imports
+from django.utils.encoding import smart_str, force_unicode
+
+# filebrowser imports
+from filebrowser.settings import MEDIA_ROOT, VERSIONS, ADMIN_VERSIONS, UPLOAD_VERSIONS, WORKER_THREADS, WORKER_QUEUE_SIZE
+from filebrowser.functions import get_file_type, version_generator
+from filebrowser import instrumentation
+
+logger = logging.getLogger('filebrowser.workers')
+
+
+class Task(object):
+    """
+    A function call which is executed by a WorkerPool.
+    """
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.value = None
+        self.exc_info = None
+        self.done = threading.Event()
+        # account the work to the request queueing the task
+        self.metrics = instrumentation.current()
+        self.scopes = instrumentation.current_scopes()
+
+    def run(self):
+        if self.metrics is not None:
+            # restored afterwards: the task might run within the thread
+            # of the request itself (s. WorkerPool.map)
+            previous = instrumentation.current(), instrumentation.current_scopes()
+            instrumentation.activate(self.metrics, self.scopes)
+        try:
+            self.value = self.func(*self.args, **self.kwargs)
+        except:
+            self.exc_info = sys.exc_info()
+            logger.exception("Task %r failed", self.func)
+        if self.metrics is not None:
+            instrumentation.activate(*previous)
+        self.done.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the task is finished. Returns False on timeout.
+        """
+        self.done.wait(timeout)
+        return self.done.isSet()
+
+    def result(self, timeout=None):
+        """
+        Return value of the function call (re-raises its exception).
+        """
+        if not self.wait(timeout):
+            raise RuntimeError("Task did not finish within %s seconds." % timeout)
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of daemon threads.
+
+    Image processing (PIL) releases the GIL during decode/resize/encode,
+    so several versions can be generated concurrently within one process.
+    Threads are started with the first task (and after a fork).
+    """
+
+    def __init__(self, max_workers=WORKER_THREADS, max_queue=WORKER_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self.queue = Queue.Queue(max_queue)
+        self.threads = []
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.threads = []
+            for i in range(self.max_workers):
+                thread = threading.Thread(target=self._work, name='filebrowser-worker-%s' % i)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self.queue.get()
+            task.run()
+            self.queue.task_done()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue a function call and return its Task.
+        Raises Queue.Full if the queue is full.
+        """
+        if self.pid != os.getpid():
+            self._start()
+        task = Task(func, args, kwargs)
+        self.queue.put_nowait(task)
+        return task
+
+    def map(self, func, iterable):
+        """
+        Call func for every item concurrently and return the results
+        (None for failed calls). Items which do not fit into the queue
+        are processed within the calling thread, and so are all items if
+        map is called by a thread of this pool (which would wait for itself).
+        """
+        inline = threading.current_thread() in self.threads
+        tasks = []
+        for item in iterable:
+            try:
+                if inline:
+                    raise Queue.Full
+                tasks.append(self.submit(func, item))
+            except Queue.Full:
+                task = Task(func, (item,), {})
+                task.run()
+                tasks.append(task)
+        results = []
+        for task in tasks:
+            task.wait()
+            results.append(task.value)
+        return results
+
+
+_pool = None
+_request_pool = None
+
+def get_pool():
+    """
+    The WorkerPool of this process (background work, e.g. versions of uploads).
+    """
+    global _pool
+    if _pool is None:
+        _pool = WorkerPool()
+    return _pool
+
+
+def get_request_pool():
+    """
+    The WorkerPool for work a request waits for (e.g. the dimensions and
+    thumbnails of a page), so that it does not queue up behind background work.
+    """
+    global _request_pool
+    if _request_pool is None:
+        _request_pool = WorkerPool()
+    return _request_pool
+
+
+def get_upload_versions(use_image_generator=False):
+    """
+    Versions to generate right after an upload:
+    UPLOAD_VERSIONS, plus ADMIN_VERSIONS when the image generator is requested.
+    """
+    versions = list(UPLOAD_VERSIONS)
+    if use_image_generator:
+        versions += [v for v in ADMIN_VERSIONS if v not in versions]
+    return [v for v in versions if v in VERSIONS]
+
+
+def generate_versions(value, version_prefixes):
+    """
+    Generate versions of an uploaded Image on the WorkerPool.
+    value is the path returned by handle_file_upload.
+
+    Returns the queued Tasks. Does not wait for the versions, and versions
+    which do not fit into the queue are skipped (they are generated with
+    the first rendering of the version instead).
+    """
+
+    if get_file_type(value) != 'Image':
+        return []
+    if os.path.isabs(value):
+        value = force_unicode(os.path.relpath(smart_str(value), smart_str(MEDIA_ROOT)))
+    tasks = []
+    pool = get_pool()
+    for version_prefix in version_prefixes:
+        try:
+            tasks.append(pool.submit(version_generator, value, version_prefix))
+        except Queue.Full:
+            logger.warning("Version queue is full, skipping %s of %s", version_prefix, value)
+            break
+    return tasks